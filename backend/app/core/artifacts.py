@@ -0,0 +1,112 @@
+import os
+import re
+import shutil
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from app.core.config import settings
+
+
+# Index artifacts (embeddings.npy, doc store, ANN index, ...) live in one
+# directory per build, under a root per embedding model:
+#   DATA_DIR/models/<model slug>/builds/<build_id>/
+#   DATA_DIR/models/<model slug>/CURRENT
+# CURRENT holds the id of the build search should serve for that model; it is
+# swapped with an atomic rename, so readers see either the old build or the
+# new one, never a mix. Functions taking `model_name=None` address the older
+# shared layout (DATA_DIR/builds/ + DATA_DIR/CURRENT).
+MODELS_DIR = "models"
+BUILDS_DIR = "builds"
+CURRENT_FILE = "CURRENT"
+
+_SLUG_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def model_slug(model_name: str) -> str:
+    """
+    Filesystem-safe directory name for a model, e.g.
+    "sentence-transformers/all-MiniLM-L6-v2" -> "sentence-transformers__all-MiniLM-L6-v2".
+    """
+    return _SLUG_RE.sub("_", model_name.replace("/", "__"))
+
+
+def model_root(model_name: Optional[str]) -> str:
+    if model_name is None:
+        return settings.DATA_DIR
+    return os.path.join(settings.DATA_DIR, MODELS_DIR, model_slug(model_name))
+
+
+def _builds_root(model_name: Optional[str] = None) -> str:
+    return os.path.join(model_root(model_name), BUILDS_DIR)
+
+
+def current_build_id(model_name: Optional[str] = None) -> Optional[str]:
+    try:
+        with open(os.path.join(model_root(model_name), CURRENT_FILE), "r", encoding="utf-8") as f:
+            build_id = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return build_id or None
+
+
+def build_dir_for(build_id: Optional[str], model_name: Optional[str] = None) -> str:
+    """
+    Directory holding a build. `None` means DATA_DIR itself, the flat layout
+    used by trees built before per-build directories existed.
+    """
+    if build_id is None:
+        return settings.DATA_DIR
+    return os.path.join(_builds_root(model_name), build_id)
+
+
+def current_build_dir(model_name: Optional[str] = None) -> str:
+    return build_dir_for(current_build_id(model_name), model_name)
+
+
+def resolve_build(model_name: str) -> Tuple[Optional[str], str]:
+    """
+    (build_id, build_dir) to serve for `model_name`: the model's own current
+    build, else whatever the shared layout serves (callers check that it was
+    built with the same model).
+    """
+    build_id = current_build_id(model_name)
+    if build_id is not None:
+        return build_id, build_dir_for(build_id, model_name)
+    build_id = current_build_id()
+    return build_id, build_dir_for(build_id)
+
+
+def new_build_dir(model_name: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Create an empty directory for a new build. It is invisible to search
+    until publish_build() points CURRENT at it.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    build_id = f"{stamp}-{uuid.uuid4().hex[:6]}"
+    build_dir = os.path.join(_builds_root(model_name), build_id)
+    os.makedirs(build_dir)
+    return build_id, build_dir
+
+
+def publish_build(build_id: str, keep: Optional[int] = None, model_name: Optional[str] = None) -> None:
+    """
+    Atomically make `build_id` the served build, then prune old builds,
+    keeping the newest `keep` (settings.KEEP_BUILDS by default).
+    Workers that still have an old build memory-mapped keep working: the
+    files stay readable until they drop their handles.
+    """
+    current_path = os.path.join(model_root(model_name), CURRENT_FILE)
+    tmp_path = current_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(build_id + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, current_path)
+
+    builds_root = _builds_root(model_name)
+    keep = settings.KEEP_BUILDS if keep is None else keep
+    builds = sorted(os.listdir(builds_root))
+    for old in builds[:-max(1, keep)]:
+        if old != build_id:
+            shutil.rmtree(os.path.join(builds_root, old), ignore_errors=True)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -11,6 +13,109 @@ class Settings(BaseSettings):
     TMDB_BASE_URL: str = "https://api.themoviedb.org/3"
     DATA_DIR: str = "./data"
 
+    # /ingest HTTP behaviour: concurrent requests, average request rate and
+    # retries (with backoff) on 429 / 5xx / connection errors.
+    TMDB_MAX_CONCURRENCY: int = 8
+    TMDB_RATE_LIMIT_PER_S: float = 40.0
+    TMDB_MAX_RETRIES: int = 5
+
     OPENAI_API_KEY: str
+    # Point at an OpenAI-compatible server (e.g. a local fake for tests); None = api.openai.com.
+    OPENAI_BASE_URL: Optional[str] = None
+    # /qa: LLM calls in flight at once per worker, and per-call timeout.
+    QA_MAX_CONCURRENCY: int = 8
+    QA_TIMEOUT_S: float = 60.0
+    # /qa answer cache: reuse an answer when a question embeds within
+    # QA_CACHE_SIMILARITY (cosine) of a cached one over the same evidence.
+    # Persisted to DATA_DIR/qa_answer_cache.jsonl (shared by uvicorn workers
+    # via a file lock); QA_CACHE_SIZE=0 disables it.
+    QA_CACHE_SIZE: int = 1024
+    QA_CACHE_TTL_S: float = 86400.0
+    QA_CACHE_SIMILARITY: float = 0.95
+    # /qa evidence packing: approximate token budget for the EVIDENCE block,
+    # and the MMR trade-off (1.0 = pure relevance, lower = more diverse).
+    QA_CONTEXT_TOKENS: int = 2000
+    QA_MMR_LAMBDA: float = 0.7
+
+    # Encoder for queries and /embed: "torch" (stock SentenceTransformer),
+    # "torch_int8" (dynamic int8 quantization), "onnx" or "onnx_int8" (ONNX
+    # export run by onnxruntime; needs sentence-transformers[onnx]>=3.2). Other
+    # backends than torch are used only if their embeddings stay within
+    # ENCODER_PARITY_MIN_COSINE of torch's. ENCODER_MAX_SEQ_LENGTH caps tokens
+    # per text and ENCODER_THREADS sets intra-op threads (0 = defaults).
+    ENCODER_BACKEND: str = "torch"
+    ENCODER_MAX_SEQ_LENGTH: int = 0
+    ENCODER_THREADS: int = 0
+    ENCODER_ONNX_QUANTIZATION: str = "avx2"
+    ENCODER_PARITY_MIN_COSINE: float = 0.99
+
+    # Corpus written by /transform and read by /embed: "jsonl"
+    # (movies_corpus.jsonl) or "columnar" (movies_corpus.cols/, one file per
+    # column; /embed then also writes a columnar doc index). Either format
+    # is read if it is the only one present; /corpus/convert converts.
+    CORPUS_FORMAT: str = "jsonl"
+
+    # Open embeddings.npy as a read-only memory map instead of copying it into
+    # each worker; pages are shared through the OS page cache.
+    EMBEDDINGS_MMAP: bool = True
+
+    # Build directories kept per model (DATA_DIR/models/<model slug>/builds/<id>)
+    # after /embed publishes a new one; other models' builds are not touched.
+    KEEP_BUILDS: int = 3
+
+    # Micro-batching for /search: concurrent queries arriving within the
+    # window (or until the batch is full) share one encode + one matmul.
+    SEARCH_BATCHING: bool = True
+    SEARCH_BATCH_WINDOW_MS: float = 5.0
+    SEARCH_BATCH_MAX_SIZE: int = 32
+    # Queries per encode/score chunk for /search/batch.
+    SEARCH_BATCH_CHUNK_SIZE: int = 256
+    # Threads for query encoding and scoring (separate from the default pool).
+    SEARCH_EXECUTOR_WORKERS: int = 4
+
+    # LRU caches for query vectors and ranked results (TTL in seconds, 0 = none).
+    # Both are dropped automatically when /embed writes a new embeddings.npy.
+    QUERY_CACHE_SIZE: int = 4096
+    QUERY_CACHE_TTL_S: float = 3600.0
+    RESULT_CACHE_SIZE: int = 2048
+    RESULT_CACHE_TTL_S: float = 300.0
+
+    # Cursor pagination (/search with paginate=true, then /search/page): the
+    # first request ranks SEARCH_CURSOR_DEPTH candidates once and keeps them
+    # (8 bytes each) under an opaque cursor for SEARCH_CURSOR_TTL_S. At most
+    # SEARCH_CURSOR_MAX cursors are kept (least recently used is dropped).
+    SEARCH_CURSOR_DEPTH: int = 500
+    SEARCH_CURSOR_TTL_S: float = 600.0
+    SEARCH_CURSOR_MAX: int = 10000
+
+    # Models and per-model builds kept loaded at once (least recently used is dropped).
+    MAX_LOADED_MODELS: int = 2
+    MAX_LOADED_INDEXES: int = 2
+
+    # Model (and its build) loaded in the background at startup; /ready
+    # reports ready once it is warm. Empty = no warmup, load on first use.
+    WARMUP_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+
+    # Hybrid search: candidates taken from each of the BM25 and vector
+    # rankings, and the reciprocal-rank-fusion constant (score = 1 / (k + rank)).
+    HYBRID_CANDIDATES: int = 100
+    HYBRID_RRF_K: int = 60
+    # Search re-ranking (rerank != "none"): candidate pool re-ranked down to
+    # top_k, MMR relevance/diversity trade-off, and popularity prior weight.
+    RERANK_CANDIDATES: int = 100
+    RERANK_MMR_LAMBDA: float = 0.7
+    RERANK_POPULARITY_WEIGHT: float = 0.2
+    # Sharded builds (/embed?shards=N): each shard is searched by its own
+    # worker process. A query waits at most SEARCH_SHARD_TIMEOUT_MS for the
+    # shards and answers from those that replied (flagged "partial").
+    SEARCH_SHARD_TIMEOUT_MS: float = 2000.0
+    SEARCH_SHARD_START_TIMEOUT_S: float = 60.0
+
+    # Sampling profiler: operations (search, qa) slower than PROFILE_SLOW_MS
+    # get a collapsed-stack profile in DATA_DIR/profiles/. 0 = off. Async
+    # operations (qa) share the event-loop thread: only samples taken while
+    # their own task runs are kept, so time spent awaiting is not in the stacks.
+    PROFILE_SLOW_MS: float = 0.0
+    PROFILE_SAMPLE_INTERVAL_MS: float = 5.0
 
 settings = Settings()
@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.profiler import PROFILER
+
+
+# Latency buckets (seconds), from sub-millisecond scoring up to slow LLM calls.
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram with labels, rendered in the text
+    exposition format by render(). Thread-safe; observe() is a bisect and
+    two additions under a lock.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per-bucket counts (+Inf last), then sum and count
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', le),))} {cumulative:g}")
+            lines.append(f"{self.name}_sum{_labels(key)} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(key)} {values[-1]:g}")
+        return lines
+
+
+def _labels(pairs: Tuple[Tuple[str, str], ...]) -> str:
+    if not pairs:
+        return ""
+    def _escape(v: Any) -> str:
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and method."
+)
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds", "Time spent per stage of an operation (search, qa, ...)."
+)
+OPERATION_SECONDS = Histogram(
+    "operation_duration_seconds", "Total time per operation (search, qa, ...)."
+)
+
+
+# The StageTimer of the operation running in this thread / task, if any.
+_CURRENT: ContextVar[Optional["StageTimer"]] = ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """
+    Wall-clock time per named stage of one operation. Stages named
+    "a.b" are sub-stages of "a" (their time is also counted in "a").
+    finish() records the stages and the total in the histograms.
+    """
+
+    def __init__(self, op: str):
+        self.op = op
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.total: Optional[float] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def finish(self) -> float:
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+            OPERATION_SECONDS.observe(self.total, op=self.op)
+            for name, seconds in self.stages.items():
+                STAGE_SECONDS.observe(seconds, op=self.op, stage=name)
+        return self.total
+
+    def as_ms(self) -> Dict[str, float]:
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        out = {name: round(seconds * 1000.0, 3) for name, seconds in self.stages.items()}
+        out["total"] = round(total * 1000.0, 3)
+        return out
+
+
+@contextmanager
+def operation(op: str) -> Iterator[StageTimer]:
+    """
+    Time one operation: stage() calls made under it (in this thread or
+    task) are attributed to it. Slow operations are profiled when the
+    sampling profiler is on (PROFILE_SLOW_MS).
+    """
+    timer = StageTimer(op)
+    token = _CURRENT.set(timer)
+    sampling = PROFILER.start()
+    try:
+        yield timer
+    finally:
+        _CURRENT.reset(token)
+        PROFILER.stop(sampling, op, timer.finish(), timer.as_ms())
+
+
+@contextmanager
+def stage(name: str, timer: Optional[StageTimer] = None) -> Iterator[None]:
+    """
+    Time a stage of the current operation (no-op outside of one).
+    """
+    timer = timer or _CURRENT.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def render_gauges(prefix: str, stats: Dict[str, Any], **labels: str) -> List[str]:
+    """
+    Numeric leaves of a (nested) stats dict as untyped gauge lines,
+    e.g. {"results": {"hits": 3}} -> prefix_results_hits 3.
+    """
+    lines = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            lines.extend(render_gauges(name, value, **labels))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value:g}")
+    return lines
+
+
+def render_histograms() -> List[str]:
+    lines: List[str] = []
+    for histogram in (HTTP_REQUEST_SECONDS, OPERATION_SECONDS, STAGE_SECONDS):
+        lines.extend(histogram.render())
+    return lines
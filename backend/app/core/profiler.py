@@ -0,0 +1,111 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in sampling profiler for slow operations (PROFILE_SLOW_MS > 0).
+
+    While an operation runs, one background thread samples the stack of the
+    thread running it every PROFILE_SAMPLE_INTERVAL_MS (sys._current_frames,
+    so the profiled code is not slowed by tracing). If the operation took
+    longer than PROFILE_SLOW_MS, its samples are written in collapsed-stack
+    format ("frame;frame;frame count", the input of flamegraph.pl and
+    speedscope) to DATA_DIR/profiles/; otherwise they are dropped.
+
+    An operation started inside an asyncio task (async /qa) shares its
+    thread with every other request on the event loop, so a sample counts
+    only while that task is the one running. Time the task spends awaiting
+    (the search executor, the LLM) is then missing from the stacks; the
+    stage timings in the profile header still cover it.
+    """
+
+    def __init__(self):
+        self._active: Dict[int, Dict[str, Any]] = {}  # sampling id -> state
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._next_id = 0
+        self.profiles_written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.PROFILE_SLOW_MS > 0
+
+    def start(self) -> Optional[int]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            sampling_id = self._next_id
+            self._next_id += 1
+            self._active[sampling_id] = {
+                "thread_id": threading.get_ident(),
+                "task": _current_task(),
+                "stacks": Counter(),
+            }
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        return sampling_id
+
+    def stop(self, sampling_id: Optional[int], op: str, seconds: float, timings: Dict[str, float]) -> None:
+        if sampling_id is None:
+            return
+        with self._lock:
+            state = self._active.pop(sampling_id, None)
+        if state is None or seconds * 1000.0 < settings.PROFILE_SLOW_MS or not state["stacks"]:
+            return
+
+        out_dir = os.path.join(settings.DATA_DIR, "profiles")
+        os.makedirs(out_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(out_dir, f"{stamp}-{op}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# op={op} total_ms={seconds * 1000.0:.1f} timings={timings}\n")
+            for stack, count in state["stacks"].most_common():
+                f.write(f"{stack} {count}\n")
+        self.profiles_written += 1
+
+    def _run(self) -> None:
+        interval = max(0.0005, settings.PROFILE_SAMPLE_INTERVAL_MS / 1000.0)
+        while True:
+            time.sleep(interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                # Under the lock, so stop() never sees a Counter being updated.
+                for state in self._active.values():
+                    frame = frames.get(state["thread_id"])
+                    if frame is None:
+                        continue
+                    task = state["task"]
+                    if task is not None and asyncio.current_task(task.get_loop()) is not task:
+                        continue  # the loop is running another request
+                    state["stacks"][_collapse(frame)] += 1
+
+
+def _current_task() -> Optional["asyncio.Task"]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:  # no event loop running in this thread
+        return None
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+PROFILER = SlowRequestProfiler()
@@ -1,26 +1,371 @@
+import glob
+import hashlib
 import json
+import logging
 import os
-from typing import Dict, Any, List, Optional
+import shutil
+import time
+from array import array
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
+from app.core.artifacts import MODELS_DIR, build_dir_for, model_root, new_build_dir, publish_build, resolve_build
 from app.core.config import settings
+from app.embeddings.encoder import ENCODER_BACKENDS, load_checked_encoder
+from app.ingestion.columnar import (
+    DOC_INDEX_COLUMNAR,
+    DOC_INDEX_COLUMNS,
+    SCHEMA_FILE,
+    ColumnarCorpus,
+    is_columnar,
+    write_columnar,
+)
+from app.search.docstore import write_doc_store
+from app.search.filters import COLUMNS_FILE, ColumnsBuilder
+from app.search.index import INDEX_TYPES, build_index, recall_at_k
+from app.search.lexical import LEXICAL_INDEX_FILE, BM25Builder
+from app.search.quantize import STORAGE_FORMATS, save_codes, storage_report, train_codes
+from app.search.shards import build_shards
 
 
-def _path(filename: str) -> str:
-    return os.path.join(settings.DATA_DIR, filename)
+logger = logging.getLogger(__name__)
 
+MANIFEST_FILE = "manifest.json"
+CHECKPOINT_FILE = "embed_checkpoint.json"
 
-def load_corpus(corpus_path: str) -> List[Dict[str, Any]]:
-    docs = []
-    with open(corpus_path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
+
+def iter_corpus(corpus_path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Stream (byte_offset, doc) pairs from a corpus JSONL file, or
+    (row, doc) pairs from a columnar corpus.
+    """
+    if is_columnar(corpus_path):
+        store = ColumnarCorpus(corpus_path)
+        try:
+            yield from enumerate(store)
+        finally:
+            store.close()
+        return
+
+    with open(corpus_path, "rb") as f:
+        offset = 0
+        for raw in f:
+            start = offset
+            offset += len(raw)
+            line = raw.strip()
             if not line:
                 continue
-            docs.append(json.loads(line))
-    return docs
+            yield start, json.loads(line)
+
+
+def load_corpus(corpus_path: str) -> List[Dict[str, Any]]:
+    return [d for _, d in iter_corpus(corpus_path)]
+
+
+def _read_texts(corpus_path: str, offsets: np.ndarray) -> List[str]:
+    """
+    Random-access read of combined_text for the docs starting at `offsets`.
+    Offsets are visited in file order to keep reads mostly sequential.
+    For a columnar corpus `offsets` are rows, read from the combined_text
+    column alone.
+    """
+    if is_columnar(corpus_path):
+        store = ColumnarCorpus(corpus_path)
+        try:
+            return [t or "" for t in store.strings("combined_text").take(offsets)]
+        finally:
+            store.close()
+
+    order = np.argsort(offsets, kind="stable")
+    texts: List[str] = [""] * len(offsets)
+    with open(corpus_path, "rb") as f:
+        for i in order:
+            f.seek(int(offsets[i]))
+            texts[i] = json.loads(f.readline()).get("combined_text", "")
+    return texts
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _doc_record(d: Dict[str, Any]) -> Dict[str, Any]:
+    # Keep only fields needed for retrieval + UI
+    return {
+        "doc_id": d.get("doc_id"),
+        "movie_id": d.get("movie_id"),
+        "title": d.get("title"),
+        "year": d.get("year"),
+        "genres": d.get("genres"),
+        "rating": d.get("rating"),
+        "vote_count": d.get("vote_count"),
+        "overview": d.get("overview"),
+        "metadata": d.get("metadata", {}),
+    }
+
+
+def _load_previous_build(model_name: str, normalize: bool, encoder_backend: str) -> Optional[Dict[str, Any]]:
+    """
+    Vectors and per-doc text hashes of the build currently served for
+    `model_name`, if it was produced with the same model, normalization,
+    encoder backend and max_seq_length (otherwise nothing can be reused and
+    the build starts from scratch). The backend matches if the previous build
+    ran it, or was asked for it: the parity gate resolves the same request
+    the same way, which build_embeddings re-checks once the encoder is loaded.
+    """
+    _, build_dir = resolve_build(model_name)
+    manifest_path = os.path.join(build_dir, MANIFEST_FILE)
+    embeddings_path = os.path.join(build_dir, "embeddings.npy")
+    if not os.path.exists(manifest_path) or not os.path.exists(embeddings_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("model_name") != model_name or manifest.get("normalize") != normalize:
+        return None
+    # Builds from before encoder backends were selectable ran stock torch, uncapped.
+    previous_backend = manifest.get("encoder_backend", "torch")
+    if encoder_backend not in (previous_backend, manifest.get("encoder_backend_requested", previous_backend)):
+        return None
+    if manifest.get("max_seq_length", 0) != int(settings.ENCODER_MAX_SEQ_LENGTH):
+        return None
+
+    embeddings = np.load(embeddings_path, mmap_mode="r")
+    doc_ids = manifest.get("doc_ids") or []
+    hashes = manifest.get("text_hashes") or []
+    if len(doc_ids) != embeddings.shape[0] or len(hashes) != embeddings.shape[0]:
+        return None
+
+    return {
+        "build_id": manifest.get("build_id"),
+        "encoder_backend": previous_backend,
+        "embeddings": embeddings,
+        "rows": {doc_id: (row, h) for row, (doc_id, h) in enumerate(zip(doc_ids, hashes))},
+    }
+
+
+def _scan_corpus(corpus_path: str, build_dir: str, doc_index_json: bool = False) -> Dict[str, Any]:
+    """
+    Pass 1: stream the corpus once, writing the doc store, the metadata
+    filter columns and the BM25 index as it goes (plus doc_index.json if
+    `doc_index_json`), and keep only what pass 2 needs per doc: id, text
+    hash, byte offset and text length. A columnar corpus gets a columnar doc
+    index (doc_index.cols) in place of the doc store.
+    """
+    columns = ColumnsBuilder()
+    lexical = BM25Builder()
+    scan: Dict[str, Any] = {
+        "doc_ids": [],
+        "hashes": [],
+        "offsets": array("q"),
+        "lengths": array("q"),
+        "empty": 0,
+    }
+
+    fidx = open(os.path.join(build_dir, "doc_index.json"), "w", encoding="utf-8") if doc_index_json else None
+    try:
+        if fidx is not None:
+            fidx.write("[\n")
+
+        def _records():
+            for offset, d in iter_corpus(corpus_path):
+                text = d.get("combined_text", "")
+                if text.strip() == "":
+                    scan["empty"] += 1
+                scan["doc_ids"].append(d.get("doc_id"))
+                scan["hashes"].append(_text_hash(text))
+                scan["offsets"].append(offset)
+                scan["lengths"].append(len(text))
+                lexical.add(text)
+
+                record = _doc_record(d)
+                columns.add(record)
+                if fidx is not None:
+                    if len(scan["doc_ids"]) > 1:
+                        fidx.write(",\n")
+                    fidx.write(json.dumps(record, ensure_ascii=False))
+                yield record
+
+        if is_columnar(corpus_path):
+            write_columnar(_records(), os.path.join(build_dir, DOC_INDEX_COLUMNAR), DOC_INDEX_COLUMNS)
+        else:
+            write_doc_store(
+                _records(),
+                os.path.join(build_dir, "doc_store.bin"),
+                os.path.join(build_dir, "doc_offsets.npy"),
+            )
+        if fidx is not None:
+            fidx.write("\n]\n")
+    finally:
+        if fidx is not None:
+            fidx.close()
+
+    columns.finish().save(os.path.join(build_dir, COLUMNS_FILE))
+    bm25 = lexical.finish()
+    bm25.save(os.path.join(build_dir, LEXICAL_INDEX_FILE))
+    scan["lexical"] = bm25.stats()
+    scan["offsets"] = np.frombuffer(scan["offsets"], dtype=np.int64)
+    scan["lengths"] = np.frombuffer(scan["lengths"], dtype=np.int64)
+    return scan
+
+
+def _corpus_fingerprint(corpus_path: str) -> str:
+    # A columnar store's schema.json is rewritten whenever the store is.
+    st = os.stat(os.path.join(corpus_path, SCHEMA_FILE) if is_columnar(corpus_path) else corpus_path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def _checkpoint_path(model_name: str) -> str:
+    # One checkpoint per model, so builds for different models never clobber it.
+    return os.path.join(model_root(model_name), CHECKPOINT_FILE)
+
+
+def _remove_checkpoint(model_name: str) -> None:
+    try:
+        os.remove(_checkpoint_path(model_name))
+    except FileNotFoundError:
+        pass
+
+
+def _load_checkpoint(params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Checkpoint of an unfinished build with identical inputs, if any.
+    """
+    path = _checkpoint_path(params["model_name"])
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        ckpt = json.load(f)
+    if ckpt.get("params") != params:
+        return None
+    build_dir = build_dir_for(ckpt["build_id"], params["model_name"])
+    if not os.path.exists(os.path.join(build_dir, "embeddings.npy")):
+        return None
+    return ckpt
+
+
+def _save_checkpoint(ckpt: Dict[str, Any]) -> None:
+    path = _checkpoint_path(ckpt["params"]["model_name"])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ckpt, f)
+    os.replace(tmp_path, path)
+
+
+def _checkpoint_progress(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            ckpt = json.load(f)
+    except FileNotFoundError:
+        return None
+    return {
+        "status": ckpt.get("status", "running"),
+        "model_name": ckpt.get("params", {}).get("model_name"),
+        "build_id": ckpt.get("build_id"),
+        **ckpt.get("progress", {}),
+    }
+
+
+def embed_progress(model_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Progress of the build currently running (or interrupted) for `model_name`,
+    or of every model's when None, read from the checkpoint files so any
+    worker process can answer.
+    """
+    if model_name is not None:
+        return _checkpoint_progress(_checkpoint_path(model_name)) or {"status": "idle", "model_name": model_name}
+    pattern = os.path.join(settings.DATA_DIR, MODELS_DIR, "*", CHECKPOINT_FILE)
+    builds = [p for p in map(_checkpoint_progress, sorted(glob.glob(pattern))) if p is not None]
+    return {"status": "running" if builds else "idle", "builds": builds}
+
+
+class _Encoder:
+    """
+    Wraps SentenceTransformer.encode (on the requested encoder backend),
+    optionally fanning chunks out to a multi-process CPU pool.
+    """
+
+    def __init__(self, model_name: str, batch_size: int, normalize: bool, workers: int, backend: str):
+        self.model, self.info = load_checked_encoder(model_name, backend)
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.pool = None
+        # ONNX sessions can't be shipped to pool processes; onnxruntime uses its own threads instead.
+        if workers > 1 and self.info["backend"] in ("torch", "torch_int8"):
+            self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if self.pool is None:
+            # encode returns a numpy array if convert_to_numpy=True
+            return self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=self.normalize,
+            ).astype(np.float32)
+
+        vecs = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size).astype(np.float32)
+        if self.normalize:
+            norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vecs /= norms
+        return vecs
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+def _build_index(
+    build_dir: str,
+    embeddings: np.ndarray,
+    index_type: str,
+    nlist: int,
+    nprobe: int,
+    storage: str,
+    pq_m: int,
+    rerank_factor: int,
+) -> Dict[str, Any]:
+    """
+    Train the ANN index and compressed codes of an unsharded build and save
+    them into `build_dir`. Raises ValueError if the codes can't be trained.
+    """
+    def _build_path(filename: str) -> str:
+        return os.path.join(build_dir, filename)
+
+    codes = train_codes(embeddings, storage, pq_m=pq_m) if storage != "float32" else None
+    index = build_index(
+        embeddings,
+        index_type=index_type,
+        nlist=nlist,
+        nprobe=nprobe,
+        codes=codes,
+        rerank_factor=rerank_factor,
+    )
+    index_report = index.stats()
+
+    if index_type != "flat":
+        index.save(_build_path("ann_index.npz"))
+        index_report["index_file"] = _build_path("ann_index.npz")
+
+    if codes is not None:
+        save_codes(codes, _build_path("quantized.npz"), rerank_factor=rerank_factor)
+        index_report.update(storage_report(codes, embeddings))
+        index_report["rerank_factor"] = rerank_factor
+        index_report["codes_file"] = _build_path("quantized.npz")
+
+    if index_type != "flat" or codes is not None:
+        index_report["recall_at_10"] = recall_at_k(
+            index,
+            embeddings,
+            k=10,
+            nprobe_values=(1, 2, 4, 8, 16, 32, 64),
+            rerank_values=(1, 2, 5, 10, 20),
+        )
+    return index_report
 
 
 def build_embeddings(
@@ -28,68 +373,282 @@ def build_embeddings(
     model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
     batch_size: int = 32,
     normalize: bool = True,
+    index_type: str = "flat",
+    nlist: int = 0,
+    nprobe: int = 8,
+    storage: str = "float32",
+    pq_m: int = 0,
+    rerank_factor: int = 10,
+    incremental: bool = True,
+    chunk_size: int = 4096,
+    encode_workers: int = 1,
+    resume: bool = True,
+    shards: int = 1,
+    encoder_backend: Optional[str] = None,
+    doc_index_json: bool = False,
 ) -> Dict[str, Any]:
     """
-    Read movies_corpus.jsonl, embed combined_text, and save:
+    Read movies_corpus.jsonl (or the columnar movies_corpus.cols), embed
+    combined_text, and save a new build directory
+    (DATA_DIR/models/<model>/builds/<build_id>/) containing:
       - embeddings.npy (float32)
-      - doc_index.json (list aligned with embeddings rows)
+      - doc_index.json (list aligned with embeddings rows), only if
+        `doc_index_json`; /corpus/convert?to=jsonl exports the corpus instead
+      - doc_store.bin + doc_offsets.npy (same rows, offset-indexed for serving),
+        or doc_index.cols (the same rows as a columnar store) for a columnar corpus
+      - metadata_columns.npz (year / rating / vote_count / genre columns for filtered search)
+      - bm25_index.npz (BM25 inverted index over combined_text for lexical / hybrid search)
+      - manifest.json (model, normalization, doc_ids and combined_text hashes)
+      - ann_index.npz (only for index_type="ivf"; nlist=0 picks ~sqrt(N) lists)
+      - quantized.npz (only for storage != "float32"): float16, per-dimension
+        int8 or product-quantization codes that search scans first, rescoring
+        the top k * rerank_factor rows against embeddings.npy
+      - shards.json + shards/<nnn>/ (only for shards > 1): the rows split into
+        `shards` contiguous ranges, each with its own index / codes over its
+        rows, searched by one worker process per shard (see app.search.shards);
+        index_type, nlist and storage then apply per shard
+
+    With incremental=True, docs whose combined_text hash matches the build
+    served for this model reuse its vectors; only new or changed docs are
+    encoded, and docs no longer in the corpus are dropped. The build is
+    published by atomically switching the model's CURRENT file, so search
+    hot-swaps to it on its next request. Builds for other models are untouched.
+
+    Memory stays bounded: the corpus is streamed, docs to encode are sorted
+    by text length (less padding per batch) and encoded `chunk_size` at a
+    time straight into a preallocated embeddings.npy memmap, optionally on
+    `encode_workers` CPU processes. Progress is checkpointed after every
+    chunk; with resume=True an interrupted build of the same corpus and
+    parameters continues where it stopped.
+
+    `encoder_backend` (ENCODER_BACKEND by default) picks the encoder: stock
+    torch, or an int8 / ONNX variant that is used only if its embeddings pass
+    the parity check against torch (see app.embeddings.encoder).
 
     normalize=True is recommended because it makes cosine similarity simply a dot product later.
     """
+    if index_type not in INDEX_TYPES:
+        return {"error": f"Unknown index_type {index_type!r}.", "supported": list(INDEX_TYPES)}
+    if storage not in STORAGE_FORMATS:
+        return {"error": f"Unknown storage {storage!r}.", "supported": list(STORAGE_FORMATS)}
+    if shards < 1:
+        return {"error": "shards must be at least 1."}
+    encoder_backend = encoder_backend or settings.ENCODER_BACKEND
+    if encoder_backend not in ENCODER_BACKENDS:
+        return {"error": f"Unknown encoder_backend {encoder_backend!r}.", "supported": list(ENCODER_BACKENDS)}
+
     os.makedirs(settings.DATA_DIR, exist_ok=True)
+    started = time.perf_counter()
 
-    docs = load_corpus(corpus_path)
-    if not docs:
-        return {"error": "No documents found in corpus.", "corpus_path": corpus_path}
+    previous = _load_previous_build(model_name, normalize, encoder_backend) if incremental else None
+    prev_rows = previous["rows"] if previous else {}
 
-    texts = [d.get("combined_text", "") for d in docs]
-    if any(t.strip() == "" for t in texts):
+    params = {
+        "corpus": _corpus_fingerprint(corpus_path),
+        "model_name": model_name,
+        "normalize": normalize,
+        # Everything that changes the vectors: resuming with a different
+        # encoder would mix two encoders' vectors in one embeddings.npy.
+        "encoder_backend": encoder_backend,
+        "max_seq_length": int(settings.ENCODER_MAX_SEQ_LENGTH),
+        "batch_size": int(batch_size),
+        "chunk_size": int(chunk_size),
+        "previous_build_id": previous["build_id"] if previous else None,
+    }
+    ckpt = _load_checkpoint(params) if resume else None
+    if ckpt is not None:
+        build_id = ckpt["build_id"]
+        build_dir = build_dir_for(build_id, model_name)
+    else:
+        build_id, build_dir = new_build_dir(model_name)
+
+    def _build_path(filename: str) -> str:
+        return os.path.join(build_dir, filename)
+
+    try:
+        scan = _scan_corpus(corpus_path, build_dir, doc_index_json)
+    except Exception:
+        if ckpt is None:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    doc_ids: List[str] = scan["doc_ids"]
+    hashes: List[str] = scan["hashes"]
+    if not doc_ids:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        return {"error": "No documents found in corpus.", "corpus_path": corpus_path}
+    if scan["empty"]:
         # If any document is empty, better to fail now.
-        empty_count = sum(1 for t in texts if t.strip() == "")
-        return {"error": "Some documents have empty combined_text.", "empty_count": empty_count}
-
-    model = SentenceTransformer(model_name)
-
-    # encode returns a numpy array if convert_to_numpy=True
-    embeddings = model.encode(
-        texts,
-        batch_size=batch_size,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        normalize_embeddings=normalize,
-    ).astype(np.float32)
-
-    # Build doc index: keep only fields needed for retrieval + UI
-    doc_index = []
-    for d in docs:
-        doc_index.append(
-            {
-                "doc_id": d.get("doc_id"),
-                "movie_id": d.get("movie_id"),
-                "title": d.get("title"),
-                "year": d.get("year"),
-                "genres": d.get("genres"),
-                "rating": d.get("rating"),
-                "vote_count": d.get("vote_count"),
-                "overview": d.get("overview"),
-                "metadata": d.get("metadata", {}),
+        shutil.rmtree(build_dir, ignore_errors=True)
+        return {"error": "Some documents have empty combined_text.", "empty_count": scan["empty"]}
+
+    reuse_new: List[int] = []
+    reuse_old: List[int] = []
+    to_encode: List[int] = []
+    changed = 0
+    for row, (doc_id, h) in enumerate(zip(doc_ids, hashes)):
+        old = prev_rows.get(doc_id)
+        if old is not None and old[1] == h:
+            reuse_new.append(row)
+            reuse_old.append(old[0])
+        else:
+            to_encode.append(row)
+            if old is not None:
+                changed += 1
+    current_ids = set(doc_ids)
+    removed = sum(1 for doc_id in prev_rows if doc_id not in current_ids)
+
+    encoder = None
+    encoder_info: Optional[Dict[str, Any]] = None
+    try:
+        if to_encode:
+            encoder = _Encoder(model_name, batch_size, normalize, encode_workers, encoder_backend)
+            encoder_info = encoder.info
+            dim = int(encoder.model.get_sentence_embedding_dimension())
+            if reuse_new and encoder_info["backend"] != previous["encoder_backend"]:
+                # The parity gate fell back differently than for the previous
+                # build (e.g. onnxruntime came or went): its vectors don't mix.
+                to_encode, reuse_new, reuse_old, changed = list(range(len(doc_ids))), [], [], 0
+        else:
+            dim = int(previous["embeddings"].shape[1])
+
+        # Longest texts first, so similar lengths share a batch and padding is minimal.
+        encode_rows = np.asarray(to_encode, dtype=np.int64)
+        encode_rows = encode_rows[np.argsort(-scan["lengths"][encode_rows], kind="stable")]
+        chunks = [encode_rows[i:i + chunk_size] for i in range(0, len(encode_rows), chunk_size)]
+
+        embeddings_path = _build_path("embeddings.npy")
+        if ckpt is not None and ckpt.get("encoder_backend") != (encoder_info or {}).get("backend"):
+            # Resolved to another backend than the interrupted run: start over.
+            ckpt = None
+        if ckpt is not None:
+            embeddings = np.load(embeddings_path, mmap_mode="r+")
+            chunks_done = int(ckpt["chunks_done"])
+        else:
+            embeddings = np.lib.format.open_memmap(
+                embeddings_path, mode="w+", dtype=np.float32, shape=(len(doc_ids), dim)
+            )
+            chunks_done = 0
+            ckpt = {
+                "build_id": build_id,
+                "params": params,
+                "encoder_backend": (encoder_info or {}).get("backend"),
+                "chunks_done": 0,
             }
-        )
 
-    embeddings_path = _path("embeddings.npy")
-    index_path = _path("doc_index.json")
+        for start in range(0, len(reuse_new), chunk_size):
+            new_rows = np.asarray(reuse_new[start:start + chunk_size], dtype=np.int64)
+            old_rows = np.asarray(reuse_old[start:start + chunk_size], dtype=np.int64)
+            embeddings[new_rows] = previous["embeddings"][old_rows]
 
-    np.save(embeddings_path, embeddings)
+        encode_started = time.perf_counter()
+        docs_done = sum(len(c) for c in chunks[:chunks_done])
+        for i in range(chunks_done, len(chunks)):
+            rows = chunks[i]
+            vecs = encoder.encode(_read_texts(corpus_path, scan["offsets"][rows]))
+            # Write in row order so the memmap is touched sequentially.
+            order = np.argsort(rows)
+            embeddings[rows[order]] = vecs[order]
+            embeddings.flush()
 
-    with open(index_path, "w", encoding="utf-8") as f:
-        json.dump(doc_index, f, ensure_ascii=False, indent=2)
+            docs_done += len(rows)
+            elapsed = time.perf_counter() - encode_started
+            ckpt["chunks_done"] = i + 1
+            ckpt["progress"] = {
+                "docs_encoded": docs_done,
+                "docs_to_encode": int(len(encode_rows)),
+                "chunks_done": i + 1,
+                "chunks_total": len(chunks),
+                "docs_per_s": round(docs_done / elapsed, 1) if elapsed > 0 else None,
+            }
+            _save_checkpoint(ckpt)
+            logger.info("embed %s: %d/%d docs encoded", build_id, docs_done, len(encode_rows))
+        encode_seconds = time.perf_counter() - encode_started
+    finally:
+        if encoder is not None:
+            encoder.close()
 
-    return {
+    ckpt["status"] = "indexing"
+    _save_checkpoint(ckpt)
+
+    try:
+        if shards > 1:
+            index_report = build_shards(
+                build_dir,
+                embeddings,
+                shards,
+                index_type=index_type,
+                nlist=nlist,
+                nprobe=nprobe,
+                storage=storage,
+                pq_m=pq_m,
+                rerank_factor=rerank_factor,
+            )
+        else:
+            index_report = _build_index(
+                build_dir, embeddings, index_type, nlist, nprobe, storage, pq_m, rerank_factor
+            )
+    except ValueError as e:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        _remove_checkpoint(model_name)
+        return {"error": str(e)}
+
+    with open(_build_path(MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "build_id": build_id,
+                "model_name": model_name,
+                "normalize": normalize,
+                # Nothing encoded means every vector came from the previous build.
+                "encoder_backend": encoder_info["backend"] if encoder_info else previous["encoder_backend"],
+                "encoder_backend_requested": encoder_backend,
+                "max_seq_length": int(settings.ENCODER_MAX_SEQ_LENGTH),
+                "num_docs": len(doc_ids),
+                "embedding_dim": dim,
+                "doc_ids": doc_ids,
+                "text_hashes": hashes,
+            },
+            f,
+        )
+
+    # Everything is on disk; switching CURRENT is what makes it live.
+    embeddings.flush()
+    publish_build(build_id, model_name=model_name)
+    _remove_checkpoint(model_name)
+
+    elapsed = time.perf_counter() - started
+    report = {
         "model_name": model_name,
         "normalize_embeddings": normalize,
         "batch_size": batch_size,
-        "num_docs": len(doc_index),
-        "embedding_dim": int(embeddings.shape[1]),
+        "build_id": build_id,
+        "model_dir": model_root(model_name),
+        "num_docs": len(doc_ids),
+        "embedding_dim": dim,
+        "encoder": encoder_info,
+        "incremental": {
+            "enabled": incremental,
+            "previous_build_id": previous["build_id"] if previous else None,
+            "reused": len(reuse_new),
+            "encoded": len(to_encode),
+            "new": len(to_encode) - changed,
+            "changed": changed,
+            "removed": removed,
+        },
+        "stats": {
+            "seconds": round(elapsed, 3),
+            "encode_seconds": round(encode_seconds, 3),
+            "encode_docs_per_s": round(len(to_encode) / encode_seconds, 1) if encode_seconds > 0 else None,
+            "chunk_size": int(chunk_size),
+            "encode_workers": int(encode_workers),
+            "resumed_from_chunk": chunks_done,
+        },
         "embeddings_file": embeddings_path,
-        "doc_index_file": index_path,
+        "doc_store_file": _build_path(DOC_INDEX_COLUMNAR if is_columnar(corpus_path) else "doc_store.bin"),
+        "columns_file": _build_path(COLUMNS_FILE),
+        "lexical_index": dict(scan["lexical"], file=_build_path(LEXICAL_INDEX_FILE)),
+        "index": index_report,
     }
+    if doc_index_json:
+        report["doc_index_file"] = _build_path("doc_index.json")
+    return report
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.artifacts import model_slug
+from app.core.config import settings
+from app.ingestion.columnar import ColumnarCorpus, is_columnar
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+logger = logging.getLogger(__name__)
+
+# Encoder backends for query and corpus encoding:
+#   torch       stock SentenceTransformer (the reference)
+#   torch_int8  the same, with its Linear layers dynamically quantized to int8
+#   onnx        the model exported to ONNX and run by onnxruntime
+#   onnx_int8   that ONNX graph, dynamically quantized to int8
+# The onnx backends need sentence-transformers>=3.2 with its [onnx] extra.
+# Exported graphs are kept in DATA_DIR/encoders/<model slug>/ and reused.
+ENCODER_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+ENCODERS_DIR = "encoders"
+
+# Used for the parity check when no corpus texts are given.
+PARITY_TEXTS = [
+    "space exploration with emotional ending",
+    "a detective hunts a serial killer through a rainy city",
+    "animated family comedy about talking animals",
+    "heist thriller with a twist",
+    "Two estranged brothers reunite to save the family farm from foreclosure.",
+    "A young wizard discovers his heritage and battles a dark lord.",
+    "romantic drama set during the second world war",
+    "zombies",
+    "An astronaut stranded on Mars must find a way to survive until rescue arrives, "
+    "growing food in the dust and improvising with the equipment left behind.",
+    "high school coming of age story",
+    "A retired hitman is pulled back in for one last job after his dog is killed.",
+    "documentary about deep sea creatures",
+]
+
+
+def encoder_dir(model_name: str) -> str:
+    return os.path.join(settings.DATA_DIR, ENCODERS_DIR, model_slug(model_name))
+
+
+def load_encoder(
+    model_name: str,
+    backend: Optional[str] = None,
+    max_seq_length: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> "SentenceTransformer":
+    """
+    A SentenceTransformer for `model_name` running on `backend`
+    (ENCODER_BACKEND by default), with tokens per text capped at
+    `max_seq_length` (ENCODER_MAX_SEQ_LENGTH; 0 = the model's own limit)
+    and `threads` intra-op threads (ENCODER_THREADS; 0 = library default).
+    Every backend returns the same encode() API.
+    """
+    backend = backend or settings.ENCODER_BACKEND
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {list(ENCODER_BACKENDS)}.")
+    max_seq_length = settings.ENCODER_MAX_SEQ_LENGTH if max_seq_length is None else max_seq_length
+    threads = settings.ENCODER_THREADS if threads is None else threads
+
+    from sentence_transformers import SentenceTransformer  # heavy (torch); imported on first use
+
+    if backend in ("torch", "torch_int8"):
+        if threads > 0:
+            import torch
+
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name)
+        if backend == "torch_int8":
+            import torch
+
+            torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    else:
+        model = _load_onnx(model_name, quantized=backend == "onnx_int8", threads=threads)
+
+    if max_seq_length > 0:
+        model.max_seq_length = int(max_seq_length)
+    return model
+
+
+def _load_onnx(model_name: str, quantized: bool, threads: int) -> "SentenceTransformer":
+    from sentence_transformers import SentenceTransformer
+
+    model_kwargs: Dict[str, Any] = {"provider": "CPUExecutionProvider"}
+    if threads > 0:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        model_kwargs["session_options"] = options
+
+    export_dir = encoder_dir(model_name)
+    if not os.path.exists(os.path.join(export_dir, "modules.json")):
+        # First use: export once (into a temporary directory, renamed when complete).
+        tmp_dir = f"{export_dir}.tmp-{uuid.uuid4().hex[:6]}"
+        SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs).save_pretrained(tmp_dir)
+        try:
+            os.replace(tmp_dir, export_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)  # another process exported it first
+    if not quantized:
+        return SentenceTransformer(export_dir, backend="onnx", model_kwargs=model_kwargs)
+
+    config = settings.ENCODER_ONNX_QUANTIZATION
+    file_name = f"onnx/model_qint8_{config}.onnx"
+    if not os.path.exists(os.path.join(export_dir, file_name)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        export_dynamic_quantized_onnx_model(
+            SentenceTransformer(export_dir, backend="onnx", model_kwargs=model_kwargs), config, export_dir
+        )
+    return SentenceTransformer(export_dir, backend="onnx", model_kwargs=dict(model_kwargs, file_name=file_name))
+
+
+def _encode(model: "SentenceTransformer", texts: List[str], batch_size: int = 32) -> np.ndarray:
+    return model.encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    ).astype(np.float32)
+
+
+def measure_encoder(
+    model: "SentenceTransformer", texts: List[str], batch_size: int = 32, num_queries: int = 50
+) -> Dict[str, Any]:
+    """
+    Query latency (one text per encode call, like /search) and corpus
+    throughput (batches of `batch_size`, like /embed) of `model` on `texts`.
+    """
+    _encode(model, texts[:1])  # first call pays for lazy initialisation
+    latencies = []
+    for text in texts[:num_queries]:
+        started = time.perf_counter()
+        _encode(model, [text])
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    started = time.perf_counter()
+    _encode(model, texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    return {
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "docs_per_s": round(len(texts) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def check_parity(
+    model_name: str,
+    backend: str,
+    texts: Optional[List[str]] = None,
+    reference: Optional["SentenceTransformer"] = None,
+    candidate: Optional["SentenceTransformer"] = None,
+    measure: bool = True,
+) -> Dict[str, Any]:
+    """
+    Compare `backend` to the stock torch model on `texts`: the cosine
+    between the two embeddings of each text (passed if the lowest is at
+    least ENCODER_PARITY_MIN_COSINE) and, with measure=True, query latency
+    and docs/sec of both. Already loaded models can be passed in.
+    """
+    texts = texts or PARITY_TEXTS
+    reference = reference or load_encoder(model_name, "torch", max_seq_length=0)
+    candidate = candidate or load_encoder(model_name, backend)
+
+    cosines = np.sum(_encode(reference, texts) * _encode(candidate, texts), axis=1)
+    report: Dict[str, Any] = {
+        "model_name": model_name,
+        "backend": backend,
+        "max_seq_length": int(settings.ENCODER_MAX_SEQ_LENGTH),
+        "threads": int(settings.ENCODER_THREADS),
+        "num_texts": len(texts),
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "tolerance": settings.ENCODER_PARITY_MIN_COSINE,
+        "passed": bool(cosines.min() >= settings.ENCODER_PARITY_MIN_COSINE),
+    }
+    if measure:
+        ref = measure_encoder(reference, texts)
+        cand = measure_encoder(candidate, texts)
+        report["reference"] = ref
+        report["candidate"] = cand
+        # > 1 means the backend is faster than torch.
+        if cand["query_p50_ms"]:
+            report["query_speedup"] = round(ref["query_p50_ms"] / cand["query_p50_ms"], 2)
+        if ref["docs_per_s"] and cand["docs_per_s"]:
+            report["throughput_speedup"] = round(cand["docs_per_s"] / ref["docs_per_s"], 2)
+    return report
+
+
+def _parity_key(model_name: str, backend: str) -> Dict[str, Any]:
+    return {
+        "model_name": model_name,
+        "backend": backend,
+        "max_seq_length": int(settings.ENCODER_MAX_SEQ_LENGTH),
+        "onnx_quantization": settings.ENCODER_ONNX_QUANTIZATION,
+        "tolerance": settings.ENCODER_PARITY_MIN_COSINE,
+    }
+
+
+def load_checked_encoder(
+    model_name: str, backend: Optional[str] = None
+) -> Tuple["SentenceTransformer", Dict[str, Any]]:
+    """
+    load_encoder, gated by the parity check for anything but "torch": a
+    backend whose embeddings drift past the tolerance (or that can't be
+    loaded, e.g. onnxruntime is not installed) is replaced by the stock
+    model. The check runs once per model / backend / settings; its result
+    is kept in the model's encoder directory. Returns (model, info).
+    """
+    backend = backend or settings.ENCODER_BACKEND
+    if backend == "torch":
+        return load_encoder(model_name, "torch"), {"backend": "torch"}
+
+    path = os.path.join(encoder_dir(model_name), f"parity_{backend}.json")
+    key = _parity_key(model_name, backend)
+    try:
+        candidate = load_encoder(model_name, backend)
+        report = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("key") == key:
+                report = saved["report"]
+        if report is None:
+            report = check_parity(model_name, backend, candidate=candidate, measure=False)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "report": report}, f)
+    except (ImportError, OSError, ValueError) as e:
+        logger.warning("Encoder backend %s unavailable for %s (%s); using torch", backend, model_name, e)
+        return load_encoder(model_name, "torch"), {"backend": "torch", "requested": backend, "error": str(e)}
+
+    if not report["passed"]:
+        logger.warning(
+            "Encoder backend %s for %s failed the parity check (min cosine %.4f < %.4f); using torch",
+            backend, model_name, report["min_cosine"], report["tolerance"],
+        )
+        return load_encoder(model_name, "torch"), {"backend": "torch", "requested": backend, "parity": report}
+    return candidate, {"backend": backend, "parity": report}
+
+
+def corpus_texts(corpus_path: str, limit: int) -> List[str]:
+    """
+    combined_text of the first `limit` docs of a corpus JSONL file (or
+    columnar corpus).
+    """
+    texts: List[str] = []
+    if not os.path.exists(corpus_path):
+        return texts
+    if is_columnar(corpus_path):
+        store = ColumnarCorpus(corpus_path)
+        try:
+            return [t for t in store.column("combined_text", 0, limit) if t and t.strip()]
+        finally:
+            store.close()
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if len(texts) >= limit:
+                break
+            if line.strip():
+                texts.append(json.loads(line).get("combined_text", ""))
+    return [t for t in texts if t.strip()]
@@ -0,0 +1,450 @@
+import json
+import mmap
+import os
+import shutil
+import time
+import uuid
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Columnar corpus / doc index (CORPUS_FORMAT=columnar): a directory with one
+# file per column instead of one JSON object per line, so a stage reads only
+# the columns it needs (embedding reads combined_text alone) without parsing
+# JSON or building a dict per row:
+#   schema.json                      row count and (name, kind) of each column
+#   <name>.bin + <name>.offsets.npy  str / json columns: UTF-8 values
+#                                    concatenated, int64 N+1 byte offsets
+#   <name>.npy                       int (int64) / float (float64) columns
+#   <name>.valid.npy                 bool, False where the value is null
+# json columns hold nested values (genres, metadata) as compact JSON text.
+# Keys outside the schema are kept, as JSON, in an "_extra" column.
+COLUMNAR_SUFFIX = ".cols"
+SCHEMA_FILE = "schema.json"
+FORMAT_VERSION = 1
+EXTRA_COLUMN = "_extra"
+
+CORPUS_COLUMNS: List[Tuple[str, str]] = [
+    ("doc_id", "str"),
+    ("movie_id", "int"),
+    ("title", "str"),
+    ("year", "int"),
+    ("genres", "json"),
+    ("rating", "float"),
+    ("vote_count", "int"),
+    ("overview", "str"),
+    ("combined_text", "str"),
+    ("metadata", "json"),
+]
+# The doc index /embed writes per build (app.embeddings.build._doc_record).
+DOC_INDEX_COLUMNS = [c for c in CORPUS_COLUMNS if c[0] != "combined_text"]
+DOC_INDEX_COLUMNAR = "doc_index" + COLUMNAR_SUFFIX
+
+CORPUS_FILES = {"jsonl": "movies_corpus.jsonl", "columnar": "movies_corpus" + COLUMNAR_SUFFIX}
+
+_NUMERIC_DTYPES = {"int": np.int64, "float": np.float64}
+
+
+def is_columnar(path: str) -> bool:
+    return path.endswith(COLUMNAR_SUFFIX) or os.path.isdir(path)
+
+
+def find_corpus(data_dir: str, fmt: str) -> str:
+    """
+    Path of the corpus in format `fmt` ("jsonl" or "columnar") under
+    `data_dir`, or of the other format if only that one exists.
+    """
+    path = os.path.join(data_dir, CORPUS_FILES[fmt])
+    if not os.path.exists(path):
+        for other in CORPUS_FILES.values():
+            if os.path.exists(os.path.join(data_dir, other)):
+                return os.path.join(data_dir, other)
+    return path
+
+
+def _publish_dir(tmp_dir: str, out_dir: str) -> None:
+    # Swap a finished directory into place; readers see the old or the new one.
+    old_dir = None
+    if os.path.exists(out_dir):
+        old_dir = f"{out_dir}.old-{uuid.uuid4().hex[:6]}"
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class ColumnarWriter:
+    """
+    Streams rows into a columnar store at `out_dir`. Files are written to a
+    temporary directory that replaces `out_dir` on close(), so readers never
+    see a half-written store. Use as a context manager (discarded on error).
+    """
+
+    def __init__(self, out_dir: str, columns: Sequence[Tuple[str, str]] = CORPUS_COLUMNS):
+        self.out_dir = out_dir
+        self.columns = list(columns) + [(EXTRA_COLUMN, "json")]
+        self.kinds = dict(self.columns)
+        self.num_rows = 0
+        self.tmp_dir = f"{out_dir}.tmp-{uuid.uuid4().hex[:6]}"
+        os.makedirs(self.tmp_dir)
+
+        self._files: Dict[str, Any] = {}
+        self._offsets: Dict[str, array] = {}
+        self._values: Dict[str, array] = {}
+        self._valid: Dict[str, bytearray] = {}
+        for name, kind in self.columns:
+            if kind in ("str", "json"):
+                self._files[name] = open(self._file(f"{name}.bin"), "wb")
+                self._offsets[name] = array("q", [0])
+            elif kind in _NUMERIC_DTYPES:
+                self._values[name] = array("q" if kind == "int" else "d")
+            else:
+                raise ValueError(f"Unknown column kind {kind!r} for {name!r}.")
+            self._valid[name] = bytearray()
+
+    def _file(self, filename: str) -> str:
+        return os.path.join(self.tmp_dir, filename)
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        extra = {k: v for k, v in doc.items() if k not in self.kinds}
+        for name, kind in self.columns:
+            value = (extra or None) if name == EXTRA_COLUMN else doc.get(name)
+            self._valid[name].append(value is not None)
+            if kind in _NUMERIC_DTYPES:
+                if value is None:
+                    value = 0
+                self._values[name].append(int(value) if kind == "int" else float(value))
+                continue
+            if value is None:
+                data = b""
+            elif kind == "json":
+                data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            else:
+                data = str(value).encode("utf-8")
+            self._files[name].write(data)
+            offsets = self._offsets[name]
+            offsets.append(offsets[-1] + len(data))
+        self.num_rows += 1
+
+    def extend(self, other: "ColumnarCorpus") -> None:
+        """
+        Append all rows of another store column by column, without decoding
+        them (how parallel /transform joins its part stores).
+        """
+        n = len(other)
+        for name, kind in self.columns:
+            present = name in other.kinds
+            valid = np.asarray(other.valid(name), dtype=np.uint8) if present else np.zeros(n, dtype=np.uint8)
+            self._valid[name] += valid.tobytes()
+            if kind in _NUMERIC_DTYPES:
+                values = other.values(name) if present else np.zeros(n)
+                self._values[name].frombytes(np.asarray(values, dtype=_NUMERIC_DTYPES[kind]).tobytes())
+                continue
+            offsets = self._offsets[name]
+            if present:
+                col = other.strings(name)
+                self._files[name].write(col.raw_bytes())
+                new = np.asarray(col.offsets[1:], dtype=np.int64) + offsets[-1]
+            else:
+                new = np.full(n, offsets[-1], dtype=np.int64)
+            offsets.frombytes(new.tobytes())
+        self.num_rows += n
+
+    def close(self) -> int:
+        columns = []
+        for name, kind in self.columns:
+            valid = np.frombuffer(bytes(self._valid[name]), dtype=np.uint8).astype(bool)
+            if kind in _NUMERIC_DTYPES:
+                values = np.frombuffer(self._values[name], dtype=_NUMERIC_DTYPES[kind])
+                np.save(self._file(f"{name}.npy"), values)
+            else:
+                self._files[name].close()
+                if name == EXTRA_COLUMN and not valid.any():
+                    os.remove(self._file(f"{name}.bin"))
+                    continue
+                np.save(self._file(f"{name}.offsets.npy"), np.frombuffer(self._offsets[name], dtype=np.int64))
+            np.save(self._file(f"{name}.valid.npy"), valid)
+            columns.append({"name": name, "kind": kind})
+
+        # Written last: a directory without schema.json is not a store.
+        with open(self._file(SCHEMA_FILE), "w", encoding="utf-8") as f:
+            json.dump(
+                {"format": "columnar", "version": FORMAT_VERSION, "num_rows": self.num_rows, "columns": columns}, f
+            )
+        _publish_dir(self.tmp_dir, self.out_dir)
+        return self.num_rows
+
+    def abort(self) -> None:
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class StringColumn:
+    """
+    One str / json column, memory-mapped: values are decoded only when read.
+    """
+
+    def __init__(self, bin_path: str, offsets_path: str, valid: np.ndarray):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self.valid = valid
+        self._file = open(bin_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap of an empty file is not allowed; an all-empty column has nothing to read anyway.
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return int(self.offsets.shape[0]) - 1
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if not self.valid[i]:
+            return None
+        return self._buf[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def slice(self, start: int, stop: int) -> List[Optional[str]]:
+        offsets = self.offsets[start:stop + 1].tolist()
+        valid = self.valid[start:stop].tolist()
+        buf = self._buf
+        return [
+            buf[offsets[j]:offsets[j + 1]].decode("utf-8") if valid[j] else None for j in range(len(valid))
+        ]
+
+    def slice_json(self, start: int, stop: int) -> List[Any]:
+        # One json.loads over the whole slice (as a JSON array) instead of one per value.
+        offsets = self.offsets[start:stop + 1].tolist()
+        valid = self.valid[start:stop].tolist()
+        buf = self._buf
+        parts = [buf[offsets[j]:offsets[j + 1]] if valid[j] else b"null" for j in range(len(valid))]
+        return json.loads(b"[" + b",".join(parts) + b"]")
+
+    def take(self, rows: Iterable[int]) -> List[Optional[str]]:
+        return [self[int(i)] for i in rows]
+
+    def raw_bytes(self) -> bytes:
+        return bytes(self._buf[:int(self.offsets[-1])])
+
+    def close(self) -> None:
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._file.close()
+
+
+class ColumnarCorpus:
+    """
+    Read-only columnar store written by ColumnarWriter. Columns are opened
+    (memory-mapped) on first use. Rows read as dicts like the JSONL records,
+    so it also serves as a build's doc index (same interface as DocStore).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE), "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        self.num_rows = int(schema["num_rows"])
+        self.kinds: Dict[str, str] = {c["name"]: c["kind"] for c in schema["columns"]}
+        self._open: Dict[str, Any] = {}
+
+    def _file(self, filename: str) -> str:
+        return os.path.join(self.path, filename)
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def valid(self, name: str) -> np.ndarray:
+        key = f"{name}.valid"
+        if key not in self._open:
+            self._open[key] = np.load(self._file(f"{name}.valid.npy"), mmap_mode="r")
+        return self._open[key]
+
+    def values(self, name: str) -> np.ndarray:
+        """
+        Raw values of an int / float column (nulls read as 0; see valid()).
+        """
+        if name not in self._open:
+            self._open[name] = np.load(self._file(f"{name}.npy"), mmap_mode="r")
+        return self._open[name]
+
+    def strings(self, name: str) -> StringColumn:
+        if name not in self._open:
+            self._open[name] = StringColumn(
+                self._file(f"{name}.bin"), self._file(f"{name}.offsets.npy"), self.valid(name)
+            )
+        return self._open[name]
+
+    def column(self, name: str, start: int = 0, stop: Optional[int] = None) -> List[Any]:
+        """
+        Python values of rows start..stop of one column (None for nulls).
+        """
+        stop = self.num_rows if stop is None else min(stop, self.num_rows)
+        kind = self.kinds[name]
+        if kind == "str":
+            return self.strings(name).slice(start, stop)
+        if kind == "json":
+            return self.strings(name).slice_json(start, stop)
+        values = self.values(name)[start:stop].tolist()
+        valid = self.valid(name)[start:stop].tolist()
+        return [v if ok else None for v, ok in zip(values, valid)]
+
+    def _value(self, name: str, i: int) -> Any:
+        kind = self.kinds[name]
+        if kind in ("str", "json"):
+            value = self.strings(name)[i]
+            return json.loads(value) if kind == "json" and value is not None else value
+        return self.values(name)[i].item() if self.valid(name)[i] else None
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += self.num_rows
+        if not 0 <= i < self.num_rows:
+            raise IndexError(f"columnar store index {i} out of range")
+        row = {name: self._value(name, i) for name in self.kinds if name != EXTRA_COLUMN}
+        if EXTRA_COLUMN in self.kinds:
+            row.update(self._value(EXTRA_COLUMN, i) or {})
+        return row
+
+    def get_many(self, ids: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self[int(i)] for i in ids]
+
+    def iter_rows(self, chunk_size: int = 65536) -> Iterator[Dict[str, Any]]:
+        # Decoded a chunk of rows at a time, column by column.
+        names = [name for name in self.kinds if name != EXTRA_COLUMN]
+        for start in range(0, self.num_rows, chunk_size):
+            cols = [self.column(name, start, start + chunk_size) for name in names]
+            extras = self.column(EXTRA_COLUMN, start, start + chunk_size) if EXTRA_COLUMN in self.kinds else None
+            for j, values in enumerate(zip(*cols)):
+                row = dict(zip(names, values))
+                if extras is not None and extras[j]:
+                    row.update(extras[j])
+                yield row
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_rows()
+
+    def close(self) -> None:
+        for col in self._open.values():
+            if isinstance(col, StringColumn):
+                col.close()
+        self._open.clear()
+
+
+def write_columnar(
+    docs: Iterable[Dict[str, Any]], out_dir: str, columns: Sequence[Tuple[str, str]] = CORPUS_COLUMNS
+) -> int:
+    """
+    Write records as a columnar store. Returns the number of records written.
+    """
+    with ColumnarWriter(out_dir, columns) as writer:
+        for doc in docs:
+            writer.add(doc)
+    return writer.num_rows
+
+
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def store_bytes(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def jsonl_to_columnar(jsonl_path: str, out_dir: str) -> Dict[str, Any]:
+    """
+    Import a corpus JSONL file as a columnar store.
+    """
+    started = time.perf_counter()
+    rows = write_columnar(iter_jsonl(jsonl_path), out_dir)
+    return {"input": jsonl_path, "output": out_dir, "rows": rows, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def columnar_to_jsonl(path: str, jsonl_path: str) -> Dict[str, Any]:
+    """
+    Export a columnar store as JSONL (the format /transform writes by default).
+    """
+    started = time.perf_counter()
+    store = ColumnarCorpus(path)
+    tmp_path = jsonl_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in store:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    finally:
+        store.close()
+    os.replace(tmp_path, jsonl_path)
+    return {"input": path, "output": jsonl_path, "rows": len(store), "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _timed(fn) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def format_report(jsonl_path: str, columnar_path: str, column: str = "combined_text") -> Dict[str, Any]:
+    """
+    The same corpus in both formats: bytes on disk, time to parse every row
+    into dicts, and time to read one column (what /embed needs).
+    """
+    def jsonl_column() -> List[Any]:
+        with open(jsonl_path, "rb") as f:
+            return [json.loads(line).get(column) for line in f if line.strip()]
+
+    def columnar_rows() -> int:
+        store = ColumnarCorpus(columnar_path)
+        try:
+            return sum(1 for _ in store)
+        finally:
+            store.close()
+
+    def columnar_column() -> List[Any]:
+        store = ColumnarCorpus(columnar_path)
+        try:
+            return store.column(column)
+        finally:
+            store.close()
+
+    rows, jsonl_rows_s = _timed(lambda: sum(1 for _ in iter_jsonl(jsonl_path)))
+    _, columnar_rows_s = _timed(columnar_rows)
+    _, jsonl_column_s = _timed(jsonl_column)
+    _, columnar_column_s = _timed(columnar_column)
+
+    jsonl_bytes = store_bytes(jsonl_path)
+    columnar_bytes = store_bytes(columnar_path)
+
+    def _speedup(old: float, new: float) -> Optional[float]:
+        return round(old / new, 2) if new > 0 else None
+
+    return {
+        "rows": rows,
+        "column": column,
+        "jsonl": {
+            "bytes": jsonl_bytes,
+            "parse_rows_s": round(jsonl_rows_s, 4),
+            "read_column_s": round(jsonl_column_s, 4),
+        },
+        "columnar": {
+            "bytes": columnar_bytes,
+            "parse_rows_s": round(columnar_rows_s, 4),
+            "read_column_s": round(columnar_column_s, 4),
+        },
+        # > 1 means columnar is smaller / faster.
+        "size_ratio": round(jsonl_bytes / columnar_bytes, 2) if columnar_bytes else None,
+        "parse_rows_speedup": _speedup(jsonl_rows_s, columnar_rows_s),
+        "read_column_speedup": _speedup(jsonl_column_s, columnar_column_s),
+    }
@@ -1,6 +1,10 @@
+import asyncio
 import json
 import os
-from typing import Dict, List
+import time
+from typing import Dict, List, Optional, Set
+
+import httpx
 
 from app.core.config import settings
 from app.tmdb.client import TMDbClient
@@ -11,51 +15,161 @@ def ensure_data_dir():
 def jsonl_path(filename: str) -> str:
     return os.path.join(settings.DATA_DIR, filename)
 
-async def ingest_movies(limit: int = 200, language: str = "en-US") -> Dict:
+
+def _load_checkpoint(path: str, limit: int, language: str) -> Optional[Dict]:
     """
-    Fetch 'limit' movies from TMDb Popular list, then fetch details for each movie.
-    Save raw detail JSON to data/movies_raw.jsonl.
+    Checkpoint of an unfinished ingest with the same parameters, if any.
     """
-    ensure_data_dir()
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        ckpt = json.load(f)
+    if ckpt.get("limit") != limit or ckpt.get("language") != language:
+        return None
+    return ckpt
+
+
+def _save_checkpoint(path: str, ckpt: Dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ckpt, f)
+    os.replace(tmp_path, path)
+
 
-    client = TMDbClient()
+def _completed_ids(out_file: str) -> Set[int]:
+    """
+    Movie ids already written to `out_file`. A trailing partial line (from a
+    crash mid-write) is truncated away so appending can continue cleanly.
+    """
+    done: Set[int] = set()
+    if not os.path.exists(out_file):
+        return done
+
+    good_bytes = 0
+    with open(out_file, "rb") as f:
+        for raw in f:
+            try:
+                movie = json.loads(raw)
+            except ValueError:
+                break
+            if not raw.endswith(b"\n"):
+                break
+            done.add(movie.get("id"))
+            good_bytes += len(raw)
+
+    if good_bytes < os.path.getsize(out_file):
+        with open(out_file, "r+b") as f:
+            f.truncate(good_bytes)
+    return done
 
+
+async def _collect_popular_ids(client: TMDbClient, limit: int, language: str) -> List[int]:
+    """
+    Collect IDs from popular pages, fetching a window of pages concurrently.
+    """
     seen_ids = set()
     collected_ids: List[int] = []
 
     page = 1
-    # Collect IDs first (from popular pages)
-    while len(collected_ids) < limit:
-        data = await client.get_popular_movies_page(page=page, language=language)
-        results = data.get("results", [])
-        if not results:
+    window = client.max_concurrency
+    while len(collected_ids) < limit and page <= 500:  # TMDb serves at most 500 pages
+        pages = range(page, min(page + window, 501))
+        datas = await asyncio.gather(
+            *[client.get_popular_movies_page(page=p, language=language) for p in pages]
+        )
+        page += len(pages)
+
+        exhausted = False
+        for data in datas:
+            results = data.get("results", [])
+            if not results:
+                exhausted = True
+                break
+            for m in results:
+                mid = m.get("id")
+                if mid and mid not in seen_ids:
+                    seen_ids.add(mid)
+                    collected_ids.append(mid)
+        if exhausted:
             break
 
-        for m in results:
-            mid = m.get("id")
-            if mid and mid not in seen_ids:
-                seen_ids.add(mid)
-                collected_ids.append(mid)
-                if len(collected_ids) >= limit:
-                    break
+    return collected_ids[:limit]
 
-        page += 1
-        if page > 500:  # safety cap
-            break
 
-    # Fetch details and write JSONL
+async def ingest_movies(limit: int = 200, language: str = "en-US", resume: bool = True) -> Dict:
+    """
+    Fetch 'limit' movies from TMDb Popular list, then fetch details for each movie.
+    Save raw detail JSON to data/movies_raw.jsonl.
+
+    Details are fetched concurrently (bounded by TMDB_MAX_CONCURRENCY and
+    TMDB_RATE_LIMIT_PER_S) and appended as they arrive. The collected id list
+    is checkpointed to data/ingest_checkpoint.json, so with resume=True an
+    interrupted ingest with the same limit/language only fetches the movies
+    that are not in movies_raw.jsonl yet.
+    """
+    ensure_data_dir()
+
     out_file = jsonl_path("movies_raw.jsonl")
-    wrote = 0
+    ckpt_file = jsonl_path("ingest_checkpoint.json")
+    started = time.perf_counter()
+
+    async with TMDbClient() as client:
+        ckpt = _load_checkpoint(ckpt_file, limit, language) if resume else None
+        if ckpt is not None:
+            collected_ids = ckpt["ids"]
+            already_done = _completed_ids(out_file)
+        else:
+            collected_ids = await _collect_popular_ids(client, limit, language)
+            _save_checkpoint(ckpt_file, {"limit": limit, "language": language, "ids": collected_ids})
+            already_done = set()
+            # Fresh run: start the output over.
+            open(out_file, "w", encoding="utf-8").close()
+
+        todo = [mid for mid in collected_ids if mid not in already_done]
+        queue: "asyncio.Queue[int]" = asyncio.Queue()
+        for mid in todo:
+            queue.put_nowait(mid)
+
+        wrote = 0
+        failed: List[Dict] = []
+
+        with open(out_file, "a", encoding="utf-8") as f:
+
+            async def worker():
+                nonlocal wrote
+                while True:
+                    try:
+                        mid = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    try:
+                        details = await client.get_movie_details(movie_id=mid, language=language)
+                    except httpx.HTTPError as e:
+                        # e.g. 404 for a movie removed since it was listed; skip it.
+                        failed.append({"movie_id": mid, "error": str(e)})
+                        continue
+                    f.write(json.dumps(details, ensure_ascii=False) + "\n")
+                    f.flush()
+                    wrote += 1
+
+            await asyncio.gather(*[worker() for _ in range(min(client.max_concurrency, max(1, len(todo))))])
+
+        client_stats = client.stats()
 
-    with open(out_file, "w", encoding="utf-8") as f:
-        for mid in collected_ids:
-            details = await client.get_movie_details(movie_id=mid, language=language)
-            f.write(json.dumps(details, ensure_ascii=False) + "\n")
-            wrote += 1
+    if not failed:
+        os.remove(ckpt_file)
 
+    elapsed = time.perf_counter() - started
     return {
         "requested": limit,
         "collected": len(collected_ids),
         "written": wrote,
+        "resumed": ckpt is not None,
+        "already_written": len(already_done),
+        "failed": len(failed),
+        "failures": failed[:20],
+        "elapsed_s": round(elapsed, 3),
+        "movies_per_s": round(wrote / elapsed, 2) if elapsed > 0 else None,
+        "http": client_stats,
         "output_file": out_file,
     }
@@ -1,8 +1,12 @@
 import json
 import os
-from typing import Dict, Any, List, Optional
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 
 from app.core.config import settings
+from app.ingestion.columnar import ColumnarCorpus, ColumnarWriter, is_columnar, store_bytes
 
 
 def _safe_int_year(date_str: Optional[str]) -> Optional[int]:
@@ -46,74 +50,175 @@ def build_combined_text(movie: Dict[str, Any]) -> str:
     return "\n".join(parts).strip()
 
 
-def transform_raw_to_corpus(
-    raw_path: str,
-    corpus_path: str,
-    min_overview_chars: int = 20,
-) -> Dict[str, Any]:
+def transform_movie(movie: Dict[str, Any], min_overview_chars: int = 20) -> Optional[Dict[str, Any]]:
     """
-    Read movies_raw.jsonl and write normalized movies_corpus.jsonl.
-
-    - Filters out entries with missing/too-short overview (optional)
-    - Creates doc_id, combined_text, and metadata fields
+    Normalize one raw TMDb movie into a corpus doc, or None if its overview
+    is missing/too short.
     """
-    os.makedirs(settings.DATA_DIR, exist_ok=True)
+    overview = (movie.get("overview") or "").strip()
+    if len(overview) < min_overview_chars:
+        return None
 
+    movie_id = movie.get("id")
+    title = movie.get("title") or movie.get("original_title") or ""
+    year = _safe_int_year(movie.get("release_date"))
+    genres = movie.get("genres") or []
+    genre_names = [g.get("name") for g in genres if isinstance(g, dict) and g.get("name")]
+
+    vote_avg = movie.get("vote_average")
+    vote_count = movie.get("vote_count")
+
+    combined_text = build_combined_text(movie)
+
+    return {
+        "doc_id": f"movie_{movie_id}",
+        "movie_id": movie_id,
+        "title": title,
+        "year": year,
+        "genres": genre_names,
+        "rating": vote_avg,
+        "vote_count": vote_count,
+        "overview": overview,
+        "combined_text": combined_text,
+        "metadata": {
+            "tmdb_id": movie_id,
+            "original_title": movie.get("original_title"),
+            "original_language": movie.get("original_language"),
+            "release_date": movie.get("release_date"),
+            "popularity": movie.get("popularity"),
+        },
+    }
+
+
+def _transform_range(
+    raw_path: str,
+    start: int,
+    end: int,
+    out_path: str,
+    min_overview_chars: int,
+) -> Tuple[int, int]:
+    """
+    Transform the lines that *start* inside [start, end) of raw_path into
+    out_path (JSONL, or a columnar store for a *.cols path). A line
+    straddling `start` belongs to the previous range. Returns (read, written).
+    """
     total_in = 0
     total_out = 0
-    dropped_no_overview = 0
-
-    with open(raw_path, "r", encoding="utf-8") as fin, open(corpus_path, "w", encoding="utf-8") as fout:
-        for line in fin:
+    columnar = is_columnar(out_path)
+    sink = ColumnarWriter(out_path) if columnar else open(out_path, "w", encoding="utf-8")
+    with open(raw_path, "rb") as fin, sink as fout:
+        if start > 0:
+            fin.seek(start - 1)
+            # Skip the rest of the line that started before this range.
+            fin.readline()
+        while fin.tell() < end:
+            line = fin.readline()
+            if not line:
+                break
             line = line.strip()
             if not line:
                 continue
 
             total_in += 1
-            movie = json.loads(line)
-
-            overview = (movie.get("overview") or "").strip()
-            if len(overview) < min_overview_chars:
-                dropped_no_overview += 1
+            doc = transform_movie(json.loads(line), min_overview_chars)
+            if doc is None:
                 continue
-
-            movie_id = movie.get("id")
-            title = movie.get("title") or movie.get("original_title") or ""
-            year = _safe_int_year(movie.get("release_date"))
-            genres = movie.get("genres") or []
-            genre_names = [g.get("name") for g in genres if isinstance(g, dict) and g.get("name")]
-
-            vote_avg = movie.get("vote_average")
-            vote_count = movie.get("vote_count")
-
-            combined_text = build_combined_text(movie)
-
-            doc = {
-                "doc_id": f"movie_{movie_id}",
-                "movie_id": movie_id,
-                "title": title,
-                "year": year,
-                "genres": genre_names,
-                "rating": vote_avg,
-                "vote_count": vote_count,
-                "overview": overview,
-                "combined_text": combined_text,
-                "metadata": {
-                    "tmdb_id": movie_id,
-                    "original_title": movie.get("original_title"),
-                    "original_language": movie.get("original_language"),
-                    "release_date": movie.get("release_date"),
-                    "popularity": movie.get("popularity"),
-                },
-            }
-
-            fout.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            if columnar:
+                fout.add(doc)
+            else:
+                fout.write(json.dumps(doc, ensure_ascii=False) + "\n")
             total_out += 1
+    return total_in, total_out
+
+
+def transform_raw_to_corpus(
+    raw_path: str,
+    corpus_path: str,
+    min_overview_chars: int = 20,
+    workers: int = 1,
+    chunk_mb: int = 32,
+) -> Dict[str, Any]:
+    """
+    Read movies_raw.jsonl and write normalized movies_corpus.jsonl (or,
+    for a corpus_path ending in .cols, a columnar store; see
+    app.ingestion.columnar).
+
+    - Filters out entries with missing/too-short overview (optional)
+    - Creates doc_id, combined_text, and metadata fields
+
+    With workers > 1 (0 = one per CPU), the raw file is split into byte
+    ranges of ~chunk_mb MB that worker processes transform into part files,
+    which are then concatenated in order, so the output is identical to the
+    serial path. The corpus is written to a temp file and renamed into place.
+    """
+    os.makedirs(settings.DATA_DIR, exist_ok=True)
+
+    started = time.perf_counter()
+    size = os.path.getsize(raw_path)
+    workers = (os.cpu_count() or 1) if workers <= 0 else workers
+    chunk_bytes = max(1, chunk_mb) * 1024 * 1024
+    columnar = is_columnar(corpus_path)
+    # A columnar store is published by its writer; JSONL goes through a temp file.
+    tmp_path = corpus_path if columnar else corpus_path + ".tmp"
+
+    if workers <= 1 or size <= chunk_bytes:
+        workers = 1
+        total_in, total_out = _transform_range(raw_path, 0, size, tmp_path, min_overview_chars)
+    else:
+        bounds = list(range(0, size, chunk_bytes)) + [size]
+        ranges = list(zip(bounds[:-1], bounds[1:]))
+        suffix = os.path.splitext(corpus_path)[1] if columnar else ""
+        part_paths = [f"{corpus_path}.tmp.part{i}{suffix}" for i in range(len(ranges))]
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                counts = list(
+                    pool.map(
+                        _transform_range,
+                        [raw_path] * len(ranges),
+                        [r[0] for r in ranges],
+                        [r[1] for r in ranges],
+                        part_paths,
+                        [min_overview_chars] * len(ranges),
+                    )
+                )
+            if columnar:
+                with ColumnarWriter(corpus_path) as fout:
+                    for part in part_paths:
+                        store = ColumnarCorpus(part)
+                        fout.extend(store)
+                        store.close()
+            else:
+                with open(tmp_path, "wb") as fout:
+                    for part in part_paths:
+                        with open(part, "rb") as fin:
+                            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        finally:
+            for part in part_paths:
+                if os.path.isdir(part):
+                    shutil.rmtree(part, ignore_errors=True)
+                elif os.path.exists(part):
+                    os.remove(part)
+
+        total_in = sum(c[0] for c in counts)
+        total_out = sum(c[1] for c in counts)
+
+    if not columnar:
+        os.replace(tmp_path, corpus_path)
+    elapsed = time.perf_counter() - started
 
     return {
         "input_file": raw_path,
         "output_file": corpus_path,
+        "format": "columnar" if columnar else "jsonl",
         "read": total_in,
         "written": total_out,
-        "dropped_no_overview": dropped_no_overview,
+        "dropped_no_overview": total_in - total_out,
+        "stats": {
+            "workers": workers,
+            "output_bytes": store_bytes(corpus_path),
+            "seconds": round(elapsed, 3),
+            "records_per_s": round(total_in / elapsed, 1) if elapsed > 0 else None,
+            "mb_per_s": round(size / 1024 / 1024 / elapsed, 2) if elapsed > 0 else None,
+        },
     }
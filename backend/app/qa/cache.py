@@ -0,0 +1,284 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file locks, so keep to a single worker there
+    fcntl = None
+
+
+class SemanticAnswerCache:
+    """
+    Persistent cache of LLM answers for /qa.
+
+    An entry is reused when a new question is a near-duplicate of a cached
+    one (cosine similarity of the question embeddings >= `threshold`) and
+    it was answered from the same evidence: the same retrieved movie_ids in
+    the same order (citations [#] refer to positions), the same llm_model,
+    and the same build of the same embedding model. The first lookup that
+    sees a new build of a model drops that model's older entries.
+
+    Bounded LRU with a TTL (wall-clock, so it holds across restarts).
+    Entries are appended to a JSONL file as they are added and reloaded on
+    first use; the file is rewritten compactly once it holds twice
+    `max_size` records, and whenever entries are invalidated. get() and
+    put() may do that file I/O, so async callers run them on an executor.
+
+    Several worker processes can share the file: appends and rewrites hold
+    an flock on `<path>.lock`, and a rewrite first merges in the records
+    other workers appended, so none are lost.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        max_size: int = 1024,
+        ttl_s: Optional[float] = None,
+        threshold: float = 0.95,
+    ):
+        self.path = path
+        self.max_size = max(0, int(max_size))
+        self.ttl_s = ttl_s if ttl_s and ttl_s > 0 else None
+        self.threshold = float(threshold)
+
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._buckets: Dict[Tuple, List[int]] = {}
+        self._versions: Dict[str, Optional[str]] = {}
+        self._stale: Set[Tuple[str, Optional[str]]] = set()
+        self._next_id = 0
+        self._records_on_disk = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.saved_latency_s = 0.0
+
+    @staticmethod
+    def _bucket_key(entry: Dict[str, Any]) -> Tuple:
+        return (
+            entry["model_name"],
+            entry["index_version"],
+            entry["llm_model"],
+            tuple(entry["movie_ids"]),
+        )
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.ttl_s is not None and entry["created_at"] + self.ttl_s < now
+
+    def _add(self, entry: Dict[str, Any]) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._buckets.setdefault(self._bucket_key(entry), []).append(entry_id)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        key = self._bucket_key(entry)
+        ids = self._buckets[key]
+        ids.remove(entry_id)
+        if not ids:
+            del self._buckets[key]
+
+    @staticmethod
+    def _record(entry: Dict[str, Any]) -> str:
+        return json.dumps(dict(entry, vector=entry["vector"].tolist()), ensure_ascii=False)
+
+    @staticmethod
+    def _identity(entry: Dict[str, Any]) -> Tuple:
+        return SemanticAnswerCache._bucket_key(entry) + (entry["question"], entry["created_at"])
+
+    @contextmanager
+    def _file_lock(self):
+        # A separate lock file: _rewrite replaces the cache file's inode.
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _read_records(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partial trailing line from a crash
+                entry["vector"] = np.asarray(entry["vector"], dtype=np.float32)
+                records.append(entry)
+        return records
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+
+        now = time.time()
+        for entry in self._read_records():
+            self._records_on_disk += 1
+            if not self._expired(entry, now):
+                self._add(entry)
+
+    def _rewrite(self, merge: bool = True) -> None:
+        if not self.path:
+            return
+        with self._file_lock():
+            if merge:
+                # Keep what other workers appended since this one loaded,
+                # except entries from builds this worker has invalidated.
+                now = time.time()
+                known = {self._identity(entry) for entry in self._entries.values()}
+                for entry in self._read_records():
+                    if (
+                        self._identity(entry) not in known
+                        and (entry["model_name"], entry["index_version"]) not in self._stale
+                        and not self._expired(entry, now)
+                    ):
+                        self._add(entry)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self._entries.values():
+                    f.write(self._record(entry) + "\n")
+            os.replace(tmp_path, self.path)
+        self._records_on_disk = len(self._entries)
+
+    def get(
+        self,
+        vector: np.ndarray,
+        model_name: str,
+        index_version: Optional[str],
+        llm_model: str,
+        movie_ids: Sequence[Any],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Best cached entry for this evidence whose question is within the
+        similarity threshold (with its `similarity` added), or None.
+        """
+        key = (model_name, index_version, llm_model, tuple(movie_ids))
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            if model_name not in self._versions or self._versions[model_name] != index_version:
+                self._invalidate(model_name, index_version)
+                self._versions[model_name] = index_version
+
+            best_id, best_sim = None, self.threshold
+            for entry_id in list(self._buckets.get(key, [])):
+                entry = self._entries[entry_id]
+                if self._expired(entry, now):
+                    self._remove(entry_id)
+                    self.expirations += 1
+                    continue
+                sim = float(np.dot(entry["vector"], vector))
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            self.hits += 1
+            self.saved_latency_s += entry["latency_s"]
+            return dict(entry, similarity=best_sim)
+
+    def put(
+        self,
+        question: str,
+        vector: np.ndarray,
+        model_name: str,
+        index_version: Optional[str],
+        llm_model: str,
+        movie_ids: Sequence[Any],
+        answer: str,
+        latency_s: float,
+    ) -> None:
+        if self.max_size == 0:
+            return
+        entry = {
+            "question": question,
+            "vector": np.asarray(vector, dtype=np.float32),
+            "model_name": model_name,
+            "index_version": index_version,
+            "llm_model": llm_model,
+            "movie_ids": list(movie_ids),
+            "answer": answer,
+            "latency_s": float(latency_s),
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self._ensure_loaded()
+            self._add(entry)
+            if not self.path:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            if self._records_on_disk >= 2 * self.max_size:
+                self._rewrite()
+            else:
+                with self._file_lock(), open(self.path, "a", encoding="utf-8") as f:
+                    f.write(self._record(entry) + "\n")
+                self._records_on_disk += 1
+
+    def _invalidate(self, model_name: str, index_version: Optional[str]) -> None:
+        # Entries answered from any other build of `model_name`.
+        stale = [
+            entry_id
+            for entry_id, entry in self._entries.items()
+            if entry["model_name"] == model_name and entry["index_version"] != index_version
+        ]
+        for entry_id in stale:
+            self._stale.add((model_name, self._entries[entry_id]["index_version"]))
+            self._remove(entry_id)
+        if stale:
+            self.invalidations += len(stale)
+            self._rewrite()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._loaded = True
+            self._rewrite(merge=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl_s,
+            "similarity_threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "saved_latency_s": round(self.saved_latency_s, 3),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -1,63 +1,227 @@
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import re
 import textwrap
+import time
 
-from openai import OpenAI
+import numpy as np
 
 from app.core.config import settings
-from app.search.service import search_movies
+from app.core.metrics import StageTimer, operation, stage
+from app.qa.cache import SemanticAnswerCache
+from app.search.rerank import mmr_order
+from app.search.service import (
+    doc_vectors,
+    embed_query,
+    run_in_search_executor,
+    search_movies_async,
+)
 
 
-def _build_context(results: List[Dict[str, Any]], max_chars: int = 9000) -> str:
-    """
-    Build a compact evidence context from top-K results.
-    Keep it short enough to avoid huge token usage.
-    """
-    chunks = []
-    for i, r in enumerate(results, start=1):
-        title = r.get("title", "Unknown")
-        year = r.get("year")
-        genres = r.get("genres") or []
-        overview = r.get("overview") or ""
-        movie_id = r.get("movie_id")
+# One pooled AsyncOpenAI client and one concurrency limit per event loop
+# (both are bound to the loop they were created on).
+_LLM: Dict[str, Any] = {
+    "loop": None,
+    "client": None,
+    "semaphore": None,
+}
+
+_ANSWER_CACHE = SemanticAnswerCache(
+    path=os.path.join(settings.DATA_DIR, "qa_answer_cache.jsonl"),
+    max_size=settings.QA_CACHE_SIZE,
+    ttl_s=settings.QA_CACHE_TTL_S,
+    threshold=settings.QA_CACHE_SIMILARITY,
+)
+
+SYSTEM_INSTRUCTIONS = textwrap.dedent("""
+You are a helpful assistant for a movie semantic search app.
+You MUST answer using only the provided EVIDENCE.
+If the evidence is insufficient, say you don't have enough information.
+Always include citations as [#] referring to the evidence item number(s).
+Keep the answer clear and concise.
+""").strip()
+
+
+# Evidence whose vector is at least this similar to an already packed item
+# is treated as a duplicate (same movie under another id, near-identical text).
+NEAR_DUPLICATE_SIM = 0.95
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; close enough for a budget.
+    return (len(text) + 3) // 4
+
 
-        chunk = f"""[{i}] {title} ({year if year else "N/A"}) | id={movie_id}
+def _evidence_chunk(ref: int, r: Dict[str, Any], overview: str) -> str:
+    title = r.get("title", "Unknown")
+    year = r.get("year")
+    genres = r.get("genres") or []
+    movie_id = r.get("movie_id")
+
+    chunk = f"""[{ref}] {title} ({year if year else "N/A"}) | id={movie_id}
 Genres: {", ".join(genres) if genres else "N/A"}
 Overview: {overview}
 SimilarityScore: {r.get("score")}
 """
-        chunks.append(chunk.strip())
+    return chunk.strip()
+
+
+def _mmr_order(
+    results: List[Dict[str, Any]], vectors: Optional[np.ndarray], lam: float
+) -> Tuple[List[int], int]:
+    """
+    Result positions in maximal-marginal-relevance order (see
+    app.search.rerank.mmr_order), relevance being the retrieval score
+    min-max scaled to [0, 1]. Repeated movie_ids and near-duplicate vectors
+    are dropped.
+    Without vectors this is score order minus repeated movie_ids.
+    Returns (order, number dropped).
+    """
+    seen_ids = set()
+    unique = []
+    for i, r in enumerate(results):
+        movie_id = r.get("movie_id")
+        if movie_id is not None and movie_id in seen_ids:
+            continue
+        seen_ids.add(movie_id)
+        unique.append(i)
+    if vectors is None or len(unique) < 2:
+        return unique, len(results) - len(unique)
+
+    scores = np.asarray([results[i].get("score") or 0.0 for i in unique], dtype=np.float32)
+    spread = float(scores.max() - scores.min())
+    rel = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    order = mmr_order(vectors[unique], rel, len(unique), lam, dedupe_sim=NEAR_DUPLICATE_SIM)
+    return [unique[i] for i in order], len(results) - len(order)
+
+
+def _build_context(
+    results: List[Dict[str, Any]],
+    vectors: Optional[np.ndarray] = None,
+    max_tokens: Optional[int] = None,
+    lam: Optional[float] = None,
+) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Pack retrieved results into an evidence context of at most `max_tokens`
+    (estimated) tokens: duplicates are dropped, the rest is taken greedily in
+    MMR order, and an item that does not fit whole keeps as many leading
+    overview sentences as fit (or is skipped).
+    `vectors` are the results' corpus embeddings (row-aligned); without them
+    ordering falls back to retrieval score.
+    Returns (context, packed results, stats). Evidence is numbered [1..n]
+    in packed order, matching the packed results.
+    """
+    max_tokens = settings.QA_CONTEXT_TOKENS if max_tokens is None else max_tokens
+    lam = settings.QA_MMR_LAMBDA if lam is None else lam
+
+    order, duplicates = _mmr_order(results, vectors, lam)
 
-    context = "\n\n".join(chunks).strip()
-    return context[:max_chars]
+    chunks: List[str] = []
+    packed: List[Dict[str, Any]] = []
+    used = 0
+    trimmed = 0
+    for i in order:
+        r = results[i]
+        ref = len(packed) + 1
+        sep = 1 if chunks else 0  # the blank line between chunks
+        sentences = _SENTENCE_RE.split((r.get("overview") or "").strip())
+        for n in range(len(sentences), 0, -1):
+            chunk = _evidence_chunk(ref, r, " ".join(sentences[:n]))
+            cost = _estimate_tokens(chunk) + sep
+            if used + cost <= max_tokens:
+                break
+        else:
+            continue  # not even the first sentence fits; a shorter item still might
+        if n < len(sentences):
+            trimmed += 1
+        chunks.append(chunk)
+        packed.append(r)
+        used += cost
 
+    stats = {
+        "context_tokens": used,
+        "context_token_budget": max_tokens,
+        "evidence_dropped": {
+            "duplicates": duplicates,
+            "over_budget": len(order) - len(packed),
+            "trimmed": trimmed,
+        },
+    }
+    return "\n\n".join(chunks), packed, stats
+
+
+def _llm() -> Tuple[Any, asyncio.Semaphore]:
+    """
+    The shared AsyncOpenAI client (keep-alive connection pool) and the
+    semaphore capping concurrent LLM calls at QA_MAX_CONCURRENCY.
+    """
+    loop = asyncio.get_running_loop()
+    if _LLM["loop"] is not loop:
+        from openai import AsyncOpenAI  # imported on first /qa, not at startup
+
+        _LLM.update(
+            {
+                "loop": loop,
+                "client": AsyncOpenAI(
+                    api_key=settings.OPENAI_API_KEY,
+                    base_url=settings.OPENAI_BASE_URL,
+                    timeout=settings.QA_TIMEOUT_S,
+                ),
+                "semaphore": asyncio.Semaphore(max(1, settings.QA_MAX_CONCURRENCY)),
+            }
+        )
+    return _LLM["client"], _LLM["semaphore"]
 
-def answer_question_grounded(
+
+async def _retrieve_evidence(
     question: str,
     query: str,
     top_k: int,
     model_name: str,
     llm_model: str,
+    filters: Optional[Dict[str, Any]],
+    mode: str,
+    timer: StageTimer,
+    debug: bool = False,
 ) -> Dict[str, Any]:
     """
-    1) Retrieve top-K results with embeddings
-    2) Ask LLM to answer using ONLY the retrieved evidence
-    3) Return answer + citations
+    Retrieve top-K results, pack them into a token-budgeted evidence context
+    (see _build_context) and build the LLM input and citations from it.
+    Retrieval goes through the async search path (micro-batched, on the
+    search executor), so it never blocks the event loop. With the answer
+    cache on, the question is embedded alongside, and a cached answer for
+    the same evidence is looked up; not in lexical mode, which must not
+    load the model just for the cache. Stages are timed into `timer`.
     """
-    # Retrieve evidence
-    search = search_movies(query=query, top_k=top_k, model_name=model_name)
+    search_task = search_movies_async(
+        query=query, top_k=top_k, model_name=model_name, filters=filters, mode=mode, debug=debug
+    )
+    vector = None
+    with stage("retrieve", timer):
+        if _ANSWER_CACHE.max_size and mode != "lexical":
+            search, vector = await asyncio.gather(
+                search_task, run_in_search_executor(embed_query, question, model_name)
+            )
+        else:
+            search = await search_task
     if "error" in search:
         return {"error": search["error"]}
 
-    results = search["results"]
-    context = _build_context(results)
-
-    system_instructions = textwrap.dedent("""
-    You are a helpful assistant for a movie semantic search app.
-    You MUST answer using only the provided EVIDENCE.
-    If the evidence is insufficient, say you don't have enough information.
-    Always include citations as [#] referring to the evidence item number(s).
-    Keep the answer clear and concise.
-    """).strip()
+    vectors = None
+    if search["results"]:
+        with stage("doc_vectors", timer):
+            try:
+                vectors = await run_in_search_executor(
+                    doc_vectors, [r.get("movie_id") for r in search["results"]], model_name
+                )
+            except Exception:
+                vectors = None  # pack by score alone
+    with stage("pack_context", timer):
+        context, results, packing = _build_context(search["results"], vectors)
 
     user_prompt = textwrap.dedent(f"""
     USER QUESTION:
@@ -67,20 +231,7 @@ def answer_question_grounded(
     {context}
     """).strip()
 
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-    # Responses API (recommended for new projects)
-    resp = client.responses.create(
-        model=llm_model,
-        input=[
-            {"role": "system", "content": system_instructions},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-
-    answer_text = resp.output_text
-
-    # Provide simple citation objects for the UI (titles + ids)
+    # Provide simple citation objects for the UI (titles + ids), numbered as in the evidence
     citations = []
     for i, r in enumerate(results, start=1):
         citations.append({
@@ -89,12 +240,222 @@ def answer_question_grounded(
             "movie_id": r.get("movie_id"),
         })
 
+    cache_key = None
+    cached = None
+    if vector is not None:
+        cache_key = {
+            "model_name": model_name,
+            "index_version": search.get("index_version"),
+            "movie_ids": [r.get("movie_id") for r in results],
+        }
+        with stage("cache_lookup", timer):
+            # The cache reads and rewrites its file under a lock: off the event loop.
+            cached = await run_in_search_executor(
+                _ANSWER_CACHE.get, vector, llm_model=llm_model, **cache_key
+            )
+
     return {
+        "input": [
+            {"role": "system", "content": SYSTEM_INSTRUCTIONS},
+            {"role": "user", "content": user_prompt},
+        ],
+        "citations": citations,
+        "results": results,
+        "packing": packing,
+        "vector": vector,
+        "cache_key": cache_key,
+        "cached": cached,
+        "search_timings": search.get("timings"),
+    }
+
+
+async def _cache_answer(
+    evidence: Dict[str, Any], question: str, llm_model: str, answer: str, latency_s: float
+) -> None:
+    if evidence["cache_key"] is not None and answer:
+        # Appends to (or rewrites) the cache file: off the event loop.
+        await run_in_search_executor(
+            _ANSWER_CACHE.put,
+            question,
+            evidence["vector"],
+            llm_model=llm_model,
+            answer=answer,
+            latency_s=latency_s,
+            **evidence["cache_key"],
+        )
+
+
+def _cache_info(evidence: Dict[str, Any]) -> Dict[str, Any]:
+    cached = evidence["cached"]
+    if cached is None:
+        return {"cached": False}
+    return {
+        "cached": True,
+        "cache_similarity": round(cached["similarity"], 4),
+        "cached_question": cached["question"],
+        "saved_latency_s": round(cached["latency_s"], 3),
+    }
+
+
+async def answer_question_grounded(
+    question: str,
+    query: str,
+    top_k: int,
+    model_name: str,
+    llm_model: str,
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "semantic",
+    debug: bool = False,
+) -> Dict[str, Any]:
+    """
+    1) Retrieve top-K results with embeddings
+    2) Ask LLM to answer using ONLY the retrieved evidence
+    3) Return answer + citations
+
+    The LLM call is awaited on the shared async client, so a slow answer
+    holds no thread; at most QA_MAX_CONCURRENCY calls run at once. A
+    near-duplicate question over the same evidence is answered from the
+    answer cache without calling the LLM.
+
+    Stages (retrieve, pack_context, llm_wait, llm, ...) are timed into the
+    /metrics histograms; debug=True also returns them as `timings`.
+    """
+    with operation("qa") as timer:
+        evidence = await _retrieve_evidence(
+            question, query, top_k, model_name, llm_model, filters, mode, timer, debug
+        )
+        if "error" in evidence:
+            return {"error": evidence["error"]}
+
+        if evidence["cached"] is not None:
+            answer_text = evidence["cached"]["answer"]
+        else:
+            client, semaphore = _llm()
+            with stage("llm_wait", timer):
+                await semaphore.acquire()
+            try:
+                started = time.perf_counter()
+                with stage("llm", timer):
+                    # Responses API (recommended for new projects)
+                    resp = await client.responses.create(model=llm_model, input=evidence["input"])
+            finally:
+                semaphore.release()
+            answer_text = resp.output_text
+            await _cache_answer(evidence, question, llm_model, answer_text, time.perf_counter() - started)
+
+    response = {
         "question": question,
         "query": query,
         "top_k": top_k,
         "llm_model": llm_model,
         "answer": answer_text,
-        "citations": citations,
-        "results_used": results,
+        "citations": evidence["citations"],
+        "results_used": evidence["results"],
+        **evidence["packing"],
+        **_cache_info(evidence),
     }
+    if debug:
+        response["timings"] = _timings(timer, evidence)
+    return response
+
+
+def _timings(timer: StageTimer, evidence: Dict[str, Any]) -> Dict[str, Any]:
+    timings: Dict[str, Any] = timer.as_ms()
+    if evidence.get("search_timings"):
+        timings["search"] = evidence["search_timings"]
+    return timings
+
+
+def _done(answer_text: str, timer: StageTimer, evidence: Dict[str, Any], debug: bool) -> Dict[str, Any]:
+    done: Dict[str, Any] = {"answer": answer_text}
+    if debug:
+        done["timings"] = _timings(timer, evidence)
+    return done
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_answer(
+    question: str,
+    query: str,
+    top_k: int,
+    model_name: str,
+    llm_model: str,
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "semantic",
+    debug: bool = False,
+) -> AsyncIterator[str]:
+    """
+    Server-sent events for /qa?stream=true:
+      - `citations`: citations + results_used, as soon as retrieval is done
+      - `token`: answer text deltas as the LLM produces them (a cached
+        answer arrives as a single token)
+      - `done`: the full answer (+ `timings` with debug=True, including
+        `first_token` = time to the first token)
+      - `error`: retrieval or LLM failure (ends the stream)
+    """
+    # Timed explicitly rather than with operation(): the generator is
+    # resumed by the response, so it can't hold a context variable.
+    timer = StageTimer("qa_stream")
+    evidence = await _retrieve_evidence(
+        question, query, top_k, model_name, llm_model, filters, mode, timer, debug
+    )
+    if "error" in evidence:
+        yield _sse("error", {"error": evidence["error"]})
+        return
+
+    yield _sse(
+        "citations",
+        {
+            "question": question,
+            "query": query,
+            "top_k": top_k,
+            "llm_model": llm_model,
+            "citations": evidence["citations"],
+            "results_used": evidence["results"],
+            **evidence["packing"],
+            **_cache_info(evidence),
+        },
+    )
+
+    if evidence["cached"] is not None:
+        answer_text = evidence["cached"]["answer"]
+        timer.finish()
+        yield _sse("token", {"delta": answer_text})
+        yield _sse("done", _done(answer_text, timer, evidence, debug))
+        return
+
+    client, semaphore = _llm()
+    parts: List[str] = []
+    try:
+        with stage("llm_wait", timer):
+            await semaphore.acquire()
+        try:
+            started = time.perf_counter()
+            stream = await client.responses.create(
+                model=llm_model, input=evidence["input"], stream=True
+            )
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    if not parts:
+                        timer.add("first_token", time.perf_counter() - started)
+                    parts.append(event.delta)
+                    yield _sse("token", {"delta": event.delta})
+        finally:
+            semaphore.release()
+    except Exception as e:
+        yield _sse("error", {"error": str(e)})
+        return
+
+    elapsed = time.perf_counter() - started
+    timer.add("llm", elapsed)
+    timer.finish()
+    answer_text = "".join(parts)
+    await _cache_answer(evidence, question, llm_model, answer_text, elapsed)
+    yield _sse("done", _done(answer_text, timer, evidence, debug))
+
+
+def answer_cache_stats() -> Dict[str, Any]:
+    return _ANSWER_CACHE.stats()
@@ -0,0 +1,101 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """
+    Collect items submitted by concurrent coroutines and hand them to a
+    synchronous `handler` in batches.
+
+    A batch closes when `max_batch_size` items are waiting or `window_ms`
+    has passed since its first item arrived. The handler runs in a worker
+    thread of `executor` (the loop's default executor if None), so the event
+    loop keeps accepting requests; it must return one
+    result per item, in order; an Exception instance in that list is raised
+    to the matching caller only.
+
+    Only one batch is in flight at a time: while the model works on one
+    batch the next one fills up, so throughput grows with batch size rather
+    than with the number of requests.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        window_ms: float = 5.0,
+        executor: Optional[Executor] = None,
+    ):
+        self.handler = handler
+        self.executor = executor
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window_s = max(0.0, float(window_ms)) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.num_batches = 0
+        self.num_items = 0
+        self.max_seen_batch = 0
+
+    async def submit(self, item: Any) -> Any:
+        self._ensure_worker()
+        fut = self._loop.create_future()
+        await self._queue.put((item, fut))
+        return await fut
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.window_s
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Anything already queued rides along for free.
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+
+            self.num_batches += 1
+            self.num_items += len(items)
+            self.max_seen_batch = max(self.max_seen_batch, len(items))
+
+            try:
+                results = await self._loop.run_in_executor(self.executor, self.handler, items)
+            except Exception as e:
+                results = [e] * len(items)
+
+            for (_, fut), result in zip(batch, results):
+                if fut.done():  # caller went away (cancelled)
+                    continue
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.num_batches,
+            "items": self.num_items,
+            "mean_batch_size": (self.num_items / self.num_batches) if self.num_batches else 0.0,
+            "max_batch_size_seen": self.max_seen_batch,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window_s * 1000.0,
+        }
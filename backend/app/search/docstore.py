@@ -0,0 +1,74 @@
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+
+class DocStore:
+    """
+    Read-only, offset-indexed doc store.
+
+    Layout:
+      - doc_store.bin:     compact UTF-8 JSON records, concatenated
+      - doc_offsets.npy:   int64 array of N+1 byte offsets into doc_store.bin
+
+    Both files are memory-mapped, so opening the store is O(1) and only the
+    rows a request actually touches get decoded. Pages are shared between
+    worker processes through the OS page cache.
+    """
+
+    def __init__(self, store_path: str, offsets_path: str):
+        self.store_path = store_path
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(store_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap of an empty file is not allowed; an empty store has no rows anyway.
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return int(self.offsets.shape[0]) - 1
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"doc store index {i} out of range")
+        start = int(self.offsets[i])
+        end = int(self.offsets[i + 1])
+        return json.loads(self._buf[start:end])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_many(self, ids: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self[int(i)] for i in ids]
+
+    def close(self) -> None:
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._file.close()
+
+
+def write_doc_store(docs: Iterable[Dict[str, Any]], store_path: str, offsets_path: str) -> int:
+    """
+    Write records as a doc store. Both files are written to temp paths and
+    renamed into place, so readers never see a half-written store.
+    Returns the number of records written.
+    """
+    tmp_store = store_path + ".tmp"
+    tmp_offsets = offsets_path + ".tmp.npy"
+
+    offsets = [0]
+    with open(tmp_store, "wb") as f:
+        for d in docs:
+            data = json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    np.save(tmp_offsets, np.asarray(offsets, dtype=np.int64))
+    os.replace(tmp_store, store_path)
+    os.replace(tmp_offsets, offsets_path)
+    return len(offsets) - 1
@@ -0,0 +1,209 @@
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+COLUMNS_FILE = "metadata_columns.npz"
+
+FILTER_KEYS = ("year_min", "year_max", "genres", "rating_min", "rating_max", "vote_count_min")
+
+
+class MetadataColumns:
+    """
+    Column-oriented copy of the filterable doc fields, one array per field,
+    aligned with embedding rows:
+      - year (int32, -1 if unknown)
+      - rating, popularity (float32, NaN if unknown)
+      - vote_count (int64, -1 if unknown)
+      - genre_bits (uint64, shape (N, W)): bit j set if the doc has genre_names[j]
+      - movie_id (int64, -1 if unknown), with a hash index mapping ids back to rows
+
+    `mask(filters)` turns a filter dict into a boolean row mask with a few
+    vectorized comparisons, so it costs O(N) cheap ops instead of touching
+    any doc metadata.
+    """
+
+    def __init__(
+        self,
+        year: np.ndarray,
+        rating: np.ndarray,
+        vote_count: np.ndarray,
+        popularity: np.ndarray,
+        genre_bits: np.ndarray,
+        genre_names: List[str],
+        movie_id: np.ndarray,
+    ):
+        self.year = year
+        self.rating = rating
+        self.vote_count = vote_count
+        self.popularity = popularity
+        self.genre_bits = genre_bits
+        self.genre_names = list(genre_names)
+        self.movie_id = movie_id
+        self._genre_pos = {g.lower(): i for i, g in enumerate(self.genre_names)}
+        # movie_id -> row hash index, built once per load (first row wins for duplicate ids)
+        self._row_of: Dict[int, int] = {}
+        for row, m in enumerate(movie_id.tolist()):
+            if m >= 0:
+                self._row_of.setdefault(m, row)
+
+    def __len__(self) -> int:
+        return int(self.year.shape[0])
+
+    @classmethod
+    def from_docs(cls, docs: Iterable[Dict[str, Any]]) -> "MetadataColumns":
+        builder = ColumnsBuilder()
+        for d in docs:
+            builder.add(d)
+        return builder.finish()
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            year=self.year,
+            rating=self.rating,
+            vote_count=self.vote_count,
+            popularity=self.popularity,
+            genre_bits=self.genre_bits,
+            genre_names=np.array(json.dumps(self.genre_names)),
+            movie_id=self.movie_id,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataColumns":
+        with np.load(path) as data:
+            return cls(
+                year=data["year"],
+                rating=data["rating"],
+                vote_count=data["vote_count"],
+                popularity=data["popularity"],
+                genre_bits=data["genre_bits"],
+                genre_names=json.loads(str(data["genre_names"])),
+                movie_id=data["movie_id"],
+            )
+
+    def row_for_movie_id(self, movie_id: Any) -> int:
+        """
+        Row of `movie_id` in this build, or -1.
+        """
+        return self._row_of.get(movie_id, -1) if isinstance(movie_id, int) else -1
+
+    def rows_for_movie_ids(self, movie_ids: List[Any]) -> np.ndarray:
+        return np.asarray([self.row_for_movie_id(m) for m in movie_ids], dtype=np.int64)
+
+    def _genre_query_bits(self, genres: List[str]) -> np.ndarray:
+        bits = np.zeros(self.genre_bits.shape[1], dtype=np.uint64)
+        for g in genres:
+            j = self._genre_pos.get(g.strip().lower())
+            if j is not None:
+                bits[j // 64] |= np.uint64(1) << np.uint64(j % 64)
+        return bits
+
+    def mask(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Boolean row mask for `filters`, or None if no filter is set.
+        Docs with an unknown value for a filtered field never match.
+        `genres` matches docs having any of the listed genres.
+        """
+        filters = normalize_filters(filters)
+        if not filters:
+            return None
+
+        m = np.ones(len(self), dtype=bool)
+        if "year_min" in filters:
+            m &= self.year >= filters["year_min"]
+        if "year_max" in filters:
+            m &= (self.year <= filters["year_max"]) & (self.year >= 0)
+        if "rating_min" in filters:
+            m &= self.rating >= filters["rating_min"]
+        if "rating_max" in filters:
+            m &= self.rating <= filters["rating_max"]
+        if "vote_count_min" in filters:
+            m &= self.vote_count >= filters["vote_count_min"]
+        if "genres" in filters:
+            bits = self._genre_query_bits(filters["genres"])
+            m &= (self.genre_bits & bits).any(axis=1)
+        return m
+
+
+class ColumnsBuilder:
+    """
+    Accumulates MetadataColumns one doc at a time, so /embed can fill the
+    columns during its single streaming pass over the corpus.
+    """
+
+    def __init__(self):
+        self.year: List[int] = []
+        self.rating: List[float] = []
+        self.vote_count: List[int] = []
+        self.popularity: List[float] = []
+        self.doc_genres: List[List[str]] = []
+        self.movie_id: List[int] = []
+
+    def add(self, d: Dict[str, Any]) -> None:
+        self.year.append(d["year"] if isinstance(d.get("year"), int) else -1)
+        self.rating.append(d["rating"] if d.get("rating") is not None else np.nan)
+        self.vote_count.append(d["vote_count"] if d.get("vote_count") is not None else -1)
+        pop = (d.get("metadata") or {}).get("popularity")
+        self.popularity.append(pop if pop is not None else np.nan)
+        self.doc_genres.append(d.get("genres") or [])
+        self.movie_id.append(d["movie_id"] if isinstance(d.get("movie_id"), int) else -1)
+
+    def finish(self) -> MetadataColumns:
+        genre_names = sorted({g for gs in self.doc_genres for g in gs})
+        pos = {g: i for i, g in enumerate(genre_names)}
+        words = max(1, (len(genre_names) + 63) // 64)
+        genre_bits = np.zeros((len(self.doc_genres), words), dtype=np.uint64)
+        for row, gs in enumerate(self.doc_genres):
+            for g in gs:
+                j = pos[g]
+                genre_bits[row, j // 64] |= np.uint64(1) << np.uint64(j % 64)
+
+        return MetadataColumns(
+            year=np.asarray(self.year, dtype=np.int32),
+            rating=np.asarray(self.rating, dtype=np.float32),
+            vote_count=np.asarray(self.vote_count, dtype=np.int64),
+            popularity=np.asarray(self.popularity, dtype=np.float32),
+            genre_bits=genre_bits,
+            genre_names=genre_names,
+            movie_id=np.asarray(self.movie_id, dtype=np.int64),
+        )
+
+
+def load_columns(build_dir: str, doc_index) -> MetadataColumns:
+    """
+    Columns written by /embed, or (for builds that predate them) derived once
+    from the doc index.
+    """
+    path = os.path.join(build_dir, COLUMNS_FILE)
+    if os.path.exists(path):
+        try:
+            cols = MetadataColumns.load(path)
+        except KeyError:
+            cols = None  # written before a column was added
+        if cols is not None and len(cols) == len(doc_index):
+            return cols
+    return MetadataColumns.from_docs(doc_index)
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Drop unset fields so equivalent filters compare (and cache) equal.
+    """
+    if not filters:
+        return {}
+    out = {k: filters[k] for k in FILTER_KEYS if filters.get(k) is not None}
+    if "genres" in out:
+        if not out["genres"]:
+            del out["genres"]
+        else:
+            out["genres"] = sorted({g.strip().lower() for g in out["genres"]})
+    return out
+
+
+def filters_key(filters: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(normalize_filters(filters), sort_keys=True)
@@ -0,0 +1,486 @@
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.metrics import stage
+
+
+INDEX_TYPES = ("flat", "ivf")
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Return indices of top-k scores in descending order.
+    Uses argpartition for speed then sorts the small top-k slice.
+    """
+    k = max(1, min(int(k), scores.shape[0]))
+    if k == scores.shape[0]:
+        return np.argsort(-scores)
+
+    top = np.argpartition(-scores, kth=k - 1)[:k]
+    top_sorted = top[np.argsort(-scores[top])]
+    return top_sorted
+
+
+def score_with_rerank(
+    embeddings: np.ndarray,
+    codes,
+    q: np.ndarray,
+    k: int,
+    rerank_factor: int,
+    ids: Optional[np.ndarray] = None,
+):
+    """
+    Two-stage scoring: rank every candidate by its compressed codes, keep a
+    shortlist of k * rerank_factor, and rescore the shortlist against the
+    exact float32 rows. `ids` restricts scoring to a candidate subset.
+    Returns (row_ids, exact_scores) sorted by score.
+    """
+    approx = codes.score(q, ids)
+    if approx.shape[0] == 0:
+        return _empty_hits()
+
+    shortlist = top_k_indices(approx, max(int(k), int(k) * max(1, int(rerank_factor))))
+    rows = shortlist if ids is None else ids[shortlist]
+    # Sorted row order keeps reads from a memory-mapped matrix sequential.
+    rows = np.sort(rows)
+    exact = np.asarray(embeddings[rows], dtype=np.float32) @ q
+    top = top_k_indices(exact, k)
+    return rows[top], exact[top]
+
+
+def _empty_hits() -> Tuple[np.ndarray, np.ndarray]:
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+
+def search_subset(
+    embeddings: np.ndarray,
+    q: np.ndarray,
+    k: int,
+    ids: np.ndarray,
+    codes=None,
+    rerank_factor: int = 10,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact (or codes + rerank) search restricted to rows `ids`. Cost is
+    proportional to len(ids), which is what makes restrictive filters cheap.
+    """
+    if ids.size == 0:
+        return _empty_hits()
+    if codes is not None:
+        return score_with_rerank(embeddings, codes, q, k, rerank_factor, ids=ids)
+    scores = np.asarray(embeddings[ids], dtype=np.float32) @ q
+    top = top_k_indices(scores, k)
+    return ids[top], scores[top]
+
+
+def blocked_top_k(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    ids: Optional[np.ndarray] = None,
+    max_block_scores: int = 1 << 24,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Exact top-k for a batch of queries: one (Q, block) matrix product per
+    block of rows, keeping a running top-k per query, so the full (Q, N)
+    score matrix is never materialized. Blocks are sized so a score block
+    holds at most `max_block_scores` floats (64 MB by default).
+    `ids` restricts the search to those rows (gathered block by block).
+    Returns one (row_ids, scores) pair per query, sorted by score.
+    """
+    n = embeddings.shape[0] if ids is None else ids.shape[0]
+    nq = queries.shape[0]
+    if n == 0:
+        return [_empty_hits() for _ in range(nq)]
+    k = max(1, min(int(k), n))
+    block_rows = max(k, max_block_scores // max(1, nq))
+
+    best_ids = np.empty((nq, 0), dtype=np.int64)
+    best_scores = np.empty((nq, 0), dtype=np.float32)
+    for start in range(0, n, block_rows):
+        if ids is None:
+            block = embeddings[start:start + block_rows]
+            block_ids = np.arange(start, start + block.shape[0], dtype=np.int64)
+        else:
+            block_ids = ids[start:start + block_rows]
+            block = embeddings[block_ids]
+        scores = queries @ block.T  # (Q, B)
+        kk = min(k, scores.shape[1])
+        part = np.argpartition(-scores, kth=kk - 1, axis=1)[:, :kk]
+
+        best_ids = np.concatenate([best_ids, block_ids[part]], axis=1)
+        best_scores = np.concatenate([best_scores, np.take_along_axis(scores, part, axis=1)], axis=1)
+        if best_ids.shape[1] > k:
+            keep = np.argpartition(-best_scores, kth=k - 1, axis=1)[:, :k]
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1)
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    return list(zip(best_ids, best_scores))
+
+
+class FlatIndex:
+    """
+    Exact search: one dot product against every row.
+    With compressed `codes`, the scan runs over the codes and only a
+    shortlist is rescored against the exact rows.
+    """
+
+    kind = "flat"
+
+    def __init__(self, embeddings: np.ndarray, codes=None, rerank_factor: int = 10):
+        self.embeddings = embeddings
+        self.codes = codes
+        self.rerank_factor = rerank_factor
+
+    def search(
+        self,
+        q: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if mask is not None:
+            return search_subset(
+                self.embeddings, q, k, np.flatnonzero(mask), self.codes, self.rerank_factor
+            )
+        if self.codes is not None:
+            return score_with_rerank(self.embeddings, self.codes, q, k, self.rerank_factor)
+        with stage("vector_search.dot_product"):
+            scores = self.embeddings @ q
+        with stage("vector_search.top_k"):
+            top = top_k_indices(scores, k)
+        return top, scores[top]
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if self.codes is not None:
+            return [self.search(q, k, mask=mask) for q in queries]
+        ids = np.flatnonzero(mask) if mask is not None else None
+        return blocked_top_k(self.embeddings, queries, k, ids=ids)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "index_type": self.kind,
+            "num_docs": int(self.embeddings.shape[0]),
+            "storage": self.codes.kind if self.codes is not None else "float32",
+        }
+
+
+class IVFIndex:
+    """
+    Inverted-file index: rows are bucketed by their nearest k-means centroid,
+    and a query only scans the `nprobe` buckets whose centroids score highest.
+
+    Lists are stored CSR-style (`list_offsets` into a flat `list_ids` array)
+    so the whole structure is three NumPy arrays.
+    """
+
+    kind = "ivf"
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        nprobe: int = 8,
+        codes=None,
+        rerank_factor: int = 10,
+    ):
+        self.embeddings = embeddings
+        self.codes = codes
+        self.rerank_factor = rerank_factor
+        self.centroids = centroids.astype(np.float32, copy=False)
+        self.list_offsets = list_offsets.astype(np.int64, copy=False)
+        self.list_ids = list_ids.astype(np.int64, copy=False)
+        self.nprobe = int(nprobe)
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @classmethod
+    def train(
+        cls,
+        embeddings: np.ndarray,
+        nlist: int = 0,
+        nprobe: int = 8,
+        n_iter: int = 20,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        n = embeddings.shape[0]
+        if nlist <= 0:
+            # Common rule of thumb: ~sqrt(N) lists.
+            nlist = int(np.sqrt(n))
+        nlist = max(1, min(int(nlist), n))
+
+        centroids = _spherical_kmeans(embeddings, nlist, n_iter=n_iter, seed=seed)
+        assign = _assign(embeddings, centroids)
+
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=list_offsets[1:])
+
+        return cls(embeddings, centroids, list_offsets, order.astype(np.int64), nprobe=nprobe)
+
+    def _gather(self, lists: np.ndarray) -> np.ndarray:
+        if len(lists) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(
+            [self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in lists]
+        )
+
+    def search(
+        self,
+        q: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        With a filter `mask`: if fewer rows pass the filter than the probed
+        lists would hold, scanning just those rows exactly is cheaper (and
+        exact); otherwise probed candidates are filtered, and more lists are
+        probed until at least k candidates survive.
+        """
+        nprobe = max(1, min(int(nprobe or self.nprobe), self.nlist))
+
+        if mask is None:
+            cand = self._gather(top_k_indices(self.centroids @ q, nprobe))
+        else:
+            selected = np.flatnonzero(mask)
+            expected = nprobe * self.list_ids.shape[0] / self.nlist
+            if selected.size <= expected:
+                return search_subset(self.embeddings, q, k, selected, self.codes, self.rerank_factor)
+
+            order = np.argsort(-(self.centroids @ q))
+            taken = 0
+            parts = []
+            found = 0
+            while taken < self.nlist and (taken < nprobe or found < k):
+                step = order[taken:taken + max(nprobe, taken)]
+                taken += len(step)
+                part = self._gather(step)
+                part = part[mask[part]]
+                parts.append(part)
+                found += part.size
+            cand = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+        if cand.size == 0:
+            return _empty_hits()
+
+        if self.codes is not None:
+            return score_with_rerank(self.embeddings, self.codes, q, k, self.rerank_factor, ids=cand)
+
+        scores = self.embeddings[cand] @ q
+        top = top_k_indices(scores, k)
+        return cand[top], scores[top]
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        # Each query probes different lists, so there is no shared matrix to batch.
+        return [self.search(q, k, nprobe=nprobe, mask=mask) for q in queries]
+
+    def save(self, path: str) -> None:
+        # np.savez appends ".npz" unless the name already ends with it.
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            kind=np.array(self.kind),
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_ids=self.list_ids,
+            nprobe=np.array(self.nprobe),
+        )
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = np.diff(self.list_offsets)
+        return {
+            "index_type": self.kind,
+            "num_docs": int(self.list_ids.shape[0]),
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "storage": self.codes.kind if self.codes is not None else "float32",
+            "list_size_min": int(sizes.min()),
+            "list_size_max": int(sizes.max()),
+            "list_size_mean": float(sizes.mean()),
+        }
+
+
+def _assign(embeddings: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """
+    Nearest centroid (by dot product) for every row, in chunks so the
+    (chunk, nlist) score matrix stays small.
+    """
+    out = np.empty(embeddings.shape[0], dtype=np.int64)
+    for start in range(0, embeddings.shape[0], chunk_size):
+        block = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+        out[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def _spherical_kmeans(
+    embeddings: np.ndarray,
+    k: int,
+    n_iter: int = 20,
+    seed: int = 0,
+    max_train_points: int = 256,
+) -> np.ndarray:
+    """
+    k-means on the unit sphere (centroids re-normalized every step), which
+    matches the dot-product scoring used for normalized embeddings.
+    Trains on at most `max_train_points` rows per centroid.
+    """
+    rng = np.random.default_rng(seed)
+    n = embeddings.shape[0]
+
+    sample_size = min(n, k * max_train_points)
+    sample_ids = np.sort(rng.choice(n, size=sample_size, replace=False))
+    sample = np.asarray(embeddings[sample_ids], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, size=k, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = _assign(sample, centroids)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=k)
+
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters from random sample points.
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+def build_index(
+    embeddings: np.ndarray,
+    index_type: str = "flat",
+    nlist: int = 0,
+    nprobe: int = 8,
+    seed: int = 0,
+    codes=None,
+    rerank_factor: int = 10,
+):
+    if index_type == "flat":
+        return FlatIndex(embeddings, codes=codes, rerank_factor=rerank_factor)
+    if index_type == "ivf":
+        index = IVFIndex.train(embeddings, nlist=nlist, nprobe=nprobe, seed=seed)
+        index.codes = codes
+        index.rerank_factor = rerank_factor
+        return index
+    raise ValueError(f"Unknown index_type {index_type!r}, expected one of {INDEX_TYPES}")
+
+
+def load_index(index_path: str, embeddings: np.ndarray, codes=None, rerank_factor: int = 10):
+    """
+    Load a persisted ANN index for `embeddings`, falling back to exact flat
+    search if there is none or it was built for a different matrix.
+    """
+    if not os.path.exists(index_path):
+        return FlatIndex(embeddings, codes=codes, rerank_factor=rerank_factor)
+
+    with np.load(index_path) as data:
+        kind = str(data["kind"])
+        if kind != "ivf" or data["list_ids"].shape[0] != embeddings.shape[0]:
+            return FlatIndex(embeddings, codes=codes, rerank_factor=rerank_factor)
+        return IVFIndex(
+            embeddings,
+            centroids=data["centroids"],
+            list_offsets=data["list_offsets"],
+            list_ids=data["list_ids"],
+            nprobe=int(data["nprobe"]),
+            codes=codes,
+            rerank_factor=rerank_factor,
+        )
+
+
+def recall_at_k(
+    index,
+    embeddings: np.ndarray,
+    k: int = 10,
+    num_queries: int = 200,
+    nprobe_values: Iterable[int] = (),
+    rerank_values: Iterable[int] = (),
+    seed: int = 0,
+    noise: float = 0.3,
+) -> Dict[str, Any]:
+    """
+    Measure recall@k of `index` against exact search. Queries are sampled
+    corpus rows perturbed with Gaussian noise and renormalized: an unperturbed
+    row is its own nearest neighbour and lands in its own IVF list, which
+    inflates recall. Optionally sweeps several nprobe / rerank_factor values
+    so the speed/recall trade-off can be tuned without rebuilding.
+    """
+    rng = np.random.default_rng(seed)
+    n = embeddings.shape[0]
+    k = max(1, min(int(k), n))
+    query_ids = rng.choice(n, size=min(int(num_queries), n), replace=False)
+    queries = np.asarray(embeddings[np.sort(query_ids)], dtype=np.float32)
+    if noise > 0:
+        queries += noise * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    exact = FlatIndex(embeddings)
+    t0 = time.perf_counter()
+    truth = [set(exact.search(q, k)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - t0) * 1000.0 / len(truth)
+
+    def _measure(nprobe: Optional[int]) -> Tuple[float, float]:
+        hits = 0
+        t0 = time.perf_counter()
+        for q, t in zip(queries, truth):
+            approx, _ = index.search(q, k, nprobe=nprobe)
+            hits += len(t.intersection(approx.tolist()))
+        ms = (time.perf_counter() - t0) * 1000.0 / len(truth)
+        return hits / float(k * len(truth)), ms
+
+    recall, ms = _measure(None)
+    report: Dict[str, Any] = {
+        "k": k,
+        "num_queries": int(len(truth)),
+        "recall": recall,
+        "ms_per_query": round(ms, 4),
+        "exact_ms_per_query": round(exact_ms, 4),
+    }
+
+    sweep = sorted(set(int(p) for p in nprobe_values if int(p) > 0))
+    if sweep and index.kind == "ivf":
+        report["recall_by_nprobe"] = {str(p): _measure(p)[0] for p in sweep}
+
+    sweep = sorted(set(int(r) for r in rerank_values if int(r) > 0))
+    if sweep and index.codes is not None:
+        configured = index.rerank_factor
+        try:
+            by_rerank = {}
+            for r in sweep:
+                index.rerank_factor = r
+                by_rerank[str(r)] = _measure(None)[0]
+            report["recall_by_rerank_factor"] = by_rerank
+        finally:
+            index.rerank_factor = configured
+    return report
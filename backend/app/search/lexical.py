@@ -0,0 +1,229 @@
+import json
+import os
+import re
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.search.index import top_k_indices
+
+
+LEXICAL_INDEX_FILE = "bm25_index.npz"
+
+SEARCH_MODES = ("semantic", "lexical", "hybrid")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class BM25Index:
+    """
+    BM25 inverted index with array-backed postings (CSR layout):
+      - terms[t] is the term with id t
+      - post_docs[post_offsets[t]:post_offsets[t + 1]] are the docs containing
+        term t, sorted by row; post_scores holds each posting's precomputed
+        BM25 term score, so query time is only additions
+      - term_max[t] is the largest score in t's postings (the MaxScore bound)
+    """
+
+    def __init__(
+        self,
+        terms: List[str],
+        post_offsets: np.ndarray,
+        post_docs: np.ndarray,
+        post_scores: np.ndarray,
+        num_docs: int,
+    ):
+        self.terms = list(terms)
+        self.term_ids = {t: i for i, t in enumerate(self.terms)}
+        self.post_offsets = post_offsets
+        self.post_docs = post_docs
+        self.post_scores = post_scores
+        self.num_docs = int(num_docs)
+        self.term_max = np.zeros(len(self.terms), dtype=np.float32)
+        nonempty = np.diff(post_offsets) > 0
+        if post_scores.size:
+            self.term_max[nonempty] = np.maximum.reduceat(post_scores, post_offsets[:-1][nonempty])
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def _postings(self, t: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.post_offsets[t], self.post_offsets[t + 1]
+        return self.post_docs[start:end], self.post_scores[start:end]
+
+    def search(
+        self, query: str, k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k docs by BM25, using MaxScore early termination: query terms are
+        processed from the highest score bound down, and once the bounds of
+        the remaining terms add up to less than the current k-th best score,
+        no unseen doc can reach the top k. From then on the remaining terms
+        only rescore surviving candidates (binary search into their postings)
+        instead of merging in every posting.
+        """
+        tids = sorted(
+            {self.term_ids[w] for w in tokenize(query) if w in self.term_ids},
+            key=lambda t: -self.term_max[t],
+        )
+        if not tids or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # remaining[i] = best score any doc can still gain from terms i..end
+        remaining = np.cumsum(self.term_max[tids][::-1])[::-1]
+
+        cand = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float32)
+        i = 0
+        while i < len(tids):
+            if cand.size >= k:
+                theta = np.partition(scores, -k)[-k]
+                if remaining[i] < theta:
+                    break
+            docs, imp = self._postings(tids[i])
+            if mask is not None:
+                keep = mask[docs]
+                docs, imp = docs[keep], imp[keep]
+            cand, inv = np.unique(np.concatenate([cand, docs]), return_inverse=True)
+            scores = np.bincount(inv, weights=np.concatenate([scores, imp])).astype(np.float32)
+            i += 1
+
+        for j in range(i, len(tids)):
+            theta = np.partition(scores, -k)[-k] if cand.size >= k else 0.0
+            alive = scores + remaining[j] >= theta
+            cand, scores = cand[alive], scores[alive]
+
+            docs, imp = self._postings(tids[j])
+            if docs.size == 0:
+                continue
+            pos = np.minimum(np.searchsorted(docs, cand), docs.size - 1)
+            hit = docs[pos] == cand
+            scores[hit] += imp[pos[hit]]
+
+        top = top_k_indices(scores, k)
+        return cand[top], scores[top]
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            terms=np.array(json.dumps(self.terms, ensure_ascii=False)),
+            post_offsets=self.post_offsets,
+            post_docs=self.post_docs,
+            post_scores=self.post_scores,
+            num_docs=np.array(self.num_docs),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            return cls(
+                terms=json.loads(str(data["terms"])),
+                post_offsets=data["post_offsets"],
+                post_docs=data["post_docs"],
+                post_scores=data["post_scores"],
+                num_docs=int(data["num_docs"]),
+            )
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "num_docs": self.num_docs,
+            "num_terms": len(self.terms),
+            "num_postings": int(self.post_docs.shape[0]),
+            "bytes": int(
+                self.post_offsets.nbytes + self.post_docs.nbytes + self.post_scores.nbytes
+            ),
+        }
+
+
+class BM25Builder:
+    """
+    Accumulates (term, doc, tf) postings one doc at a time in flat arrays, so
+    /embed can build the lexical index during its streaming corpus pass.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.terms = array("i")
+        self.docs = array("i")
+        self.tfs = array("i")
+        self.doc_len = array("i")
+
+    def add(self, text: str) -> None:
+        doc = len(self.doc_len)
+        tokens = tokenize(text)
+        counts: Dict[int, int] = {}
+        for w in tokens:
+            t = self.vocab.setdefault(w, len(self.vocab))
+            counts[t] = counts.get(t, 0) + 1
+        for t, tf in counts.items():
+            self.terms.append(t)
+            self.docs.append(doc)
+            self.tfs.append(tf)
+        self.doc_len.append(len(tokens))
+
+    def finish(self) -> BM25Index:
+        n = len(self.doc_len)
+        terms = np.frombuffer(self.terms, dtype=np.int32)
+        docs = np.frombuffer(self.docs, dtype=np.int32)
+        tfs = np.frombuffer(self.tfs, dtype=np.int32).astype(np.float32)
+        doc_len = np.frombuffer(self.doc_len, dtype=np.int32).astype(np.float32)
+
+        order = np.lexsort((docs, terms))
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+
+        df = np.bincount(terms, minlength=len(self.vocab))
+        post_offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=post_offsets[1:])
+
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if n and doc_len.mean() > 0 else 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * doc_len[docs] / avgdl)
+        post_scores = (idf[terms] * tfs * (self.k1 + 1.0) / (tfs + norm)).astype(np.float32)
+
+        return BM25Index(
+            terms=sorted(self.vocab, key=self.vocab.get),
+            post_offsets=post_offsets,
+            post_docs=docs,
+            post_scores=post_scores,
+            num_docs=n,
+        )
+
+
+def load_lexical_index(build_dir: str) -> Optional[BM25Index]:
+    path = os.path.join(build_dir, LEXICAL_INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    return BM25Index.load(path)
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[np.ndarray], k: int, rrf_k: int = 60
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse ranked id lists: each doc scores sum(1 / (rrf_k + rank)) over the
+    lists it appears in. Only ranks are used, so BM25 and cosine scores
+    need no calibration against each other.
+    """
+    fused: Dict[int, float] = {}
+    for ids in rankings:
+        for rank, i in enumerate(ids.tolist(), start=1):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (rrf_k + rank)
+    if not fused:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    top = top_k_indices(scores, k)
+    return ids[top], scores[top]
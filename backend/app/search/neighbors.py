@@ -0,0 +1,91 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.search.index import blocked_top_k
+
+
+NEIGHBORS_FILE = "neighbors.npz"
+
+
+class NeighborLists:
+    """
+    Precomputed "more like this" lists for every row of a build:
+      - ids[r] (int32): the top_n rows most similar to row r (itself
+        excluded), best first, padded with -1 for tiny corpora
+      - scores[r] (float16): their cosine similarities
+    A lookup is two array slices; no scoring at request time.
+    """
+
+    def __init__(self, ids: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.scores = scores
+
+    @property
+    def top_n(self) -> int:
+        return int(self.ids.shape[1])
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def get(self, row: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        ids = self.ids[row, :k]
+        keep = ids >= 0
+        return ids[keep].astype(np.int64), self.scores[row, :k][keep].astype(np.float32)
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, ids=self.ids, scores=self.scores)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "NeighborLists":
+        with np.load(path) as data:
+            return cls(ids=data["ids"], scores=data["scores"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "num_docs": len(self),
+            "top_n": self.top_n,
+            "bytes": int(self.ids.nbytes + self.scores.nbytes),
+        }
+
+
+def compute_neighbors(
+    embeddings: np.ndarray, top_n: int, chunk_size: int = 1024
+) -> NeighborLists:
+    """
+    Exact top_n neighbors of every row. Rows are taken `chunk_size` at a
+    time as a query block and scored against the corpus with blocked
+    matrix products (blocked_top_k), so memory stays bounded for any N.
+    """
+    n = embeddings.shape[0]
+    top_n = max(1, int(top_n))
+    ids = np.full((n, top_n), -1, dtype=np.int32)
+    scores = np.zeros((n, top_n), dtype=np.float16)
+
+    for start in range(0, n, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n), dtype=np.int64)
+        hits = blocked_top_k(embeddings, np.asarray(embeddings[rows], dtype=np.float32), top_n + 1)
+        hit_ids = np.stack([h[0] for h in hits])
+        hit_scores = np.stack([h[1] for h in hits])
+
+        # Drop each row from its own list (stable, so order is kept).
+        order = np.argsort(hit_ids == rows[:, None], axis=1, kind="stable")[:, :top_n]
+        hit_ids = np.take_along_axis(hit_ids, order, axis=1)
+        hit_scores = np.take_along_axis(hit_scores, order, axis=1)
+        hit_ids[hit_ids == rows[:, None]] = -1  # corpus smaller than top_n + 1
+
+        m = hit_ids.shape[1]
+        ids[rows, :m] = hit_ids
+        scores[rows, :m] = hit_scores
+
+    return NeighborLists(ids, scores)
+
+
+def load_neighbors(build_dir: str) -> Optional[NeighborLists]:
+    path = os.path.join(build_dir, NEIGHBORS_FILE)
+    if not os.path.exists(path):
+        return None
+    return NeighborLists.load(path)
@@ -0,0 +1,208 @@
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+STORAGE_FORMATS = ("float32", "float16", "int8", "pq")
+
+# Rows scored per block when scanning compressed codes, so the float32
+# upcast never materializes the full (N, D) matrix.
+_SCAN_CHUNK = 16384
+
+
+class Float16Codes:
+    kind = "float16"
+
+    def __init__(self, codes: np.ndarray):
+        self.codes = codes.astype(np.float16, copy=False)
+
+    @classmethod
+    def train(cls, embeddings: np.ndarray) -> "Float16Codes":
+        return cls(np.asarray(embeddings, dtype=np.float16))
+
+    def score(self, q: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        codes = self.codes if ids is None else self.codes[ids]
+        return _chunked_dot(codes, q.astype(np.float32))
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes}
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes)
+
+
+class Int8Codes:
+    """
+    Symmetric per-dimension scalar quantization: x[:, d] ~= codes[:, d] * scale[d].
+    Scoring folds the scale into the query, so q . x ~= codes @ (q * scale).
+    """
+
+    kind = "int8"
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray):
+        self.codes = codes.astype(np.int8, copy=False)
+        self.scale = scale.astype(np.float32, copy=False)
+
+    @classmethod
+    def train(cls, embeddings: np.ndarray) -> "Int8Codes":
+        emb = np.asarray(embeddings, dtype=np.float32)
+        scale = np.abs(emb).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        codes = np.clip(np.rint(emb / scale), -127, 127).astype(np.int8)
+        return cls(codes, scale)
+
+    def score(self, q: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        codes = self.codes if ids is None else self.codes[ids]
+        return _chunked_dot(codes, (q * self.scale).astype(np.float32))
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes, "scale": self.scale}
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.scale.nbytes)
+
+
+class PQCodes:
+    """
+    Product quantization: each vector is split into `m` sub-vectors and each
+    sub-vector is replaced by the id of its nearest of 256 sub-centroids, so a
+    row costs `m` bytes. A query is scored by asymmetric distance computation:
+    one (m, 256) lookup table of q_sub . centroid, then a sum of table lookups.
+    """
+
+    kind = "pq"
+
+    def __init__(self, codes: np.ndarray, codebooks: np.ndarray):
+        self.codes = codes.astype(np.uint8, copy=False)          # (N, m)
+        self.codebooks = codebooks.astype(np.float32, copy=False)  # (m, ksub, dsub)
+
+    @property
+    def m(self) -> int:
+        return int(self.codebooks.shape[0])
+
+    @classmethod
+    def train(
+        cls,
+        embeddings: np.ndarray,
+        m: int = 0,
+        n_iter: int = 20,
+        seed: int = 0,
+        max_train_points: int = 65536,
+    ) -> "PQCodes":
+        emb = np.asarray(embeddings, dtype=np.float32)
+        n, dim = emb.shape
+        if m <= 0:
+            # 8 dims per sub-quantizer (=> 32x smaller than float32) when possible.
+            m = dim // 8 if dim % 8 == 0 else 1
+        if dim % m != 0:
+            raise ValueError(f"pq_m={m} must divide the embedding dimension {dim}")
+        dsub = dim // m
+        ksub = min(256, n)
+
+        rng = np.random.default_rng(seed)
+        sample = emb[rng.choice(n, size=min(n, max_train_points), replace=False)]
+
+        codebooks = np.empty((m, ksub, dsub), dtype=np.float32)
+        codes = np.empty((n, m), dtype=np.uint8)
+        for j in range(m):
+            sub = slice(j * dsub, (j + 1) * dsub)
+            codebooks[j] = _kmeans_l2(sample[:, sub], ksub, n_iter=n_iter, rng=rng)
+            codes[:, j] = _assign_l2(emb[:, sub], codebooks[j])
+        return cls(codes, codebooks)
+
+    def score(self, q: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        m, _, dsub = self.codebooks.shape
+        table = np.einsum("mkd,md->mk", self.codebooks, q.reshape(m, dsub).astype(np.float32))
+        codes = self.codes if ids is None else self.codes[ids]
+        scores = np.zeros(codes.shape[0], dtype=np.float32)
+        for j in range(m):
+            scores += table[j, codes[:, j]]
+        return scores
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes, "codebooks": self.codebooks}
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.codebooks.nbytes)
+
+
+_FORMATS = {cls.kind: cls for cls in (Float16Codes, Int8Codes, PQCodes)}
+
+
+def _chunked_dot(codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+    out = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], _SCAN_CHUNK):
+        block = codes[start:start + _SCAN_CHUNK].astype(np.float32)
+        out[start:start + block.shape[0]] = block @ q
+    return out
+
+
+def _assign_l2(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 == argmax (x . c - ||c||^2 / 2)
+    half_norms = 0.5 * np.einsum("kd,kd->k", centroids, centroids)
+    out = np.empty(x.shape[0], dtype=np.int64)
+    for start in range(0, x.shape[0], _SCAN_CHUNK):
+        block = x[start:start + _SCAN_CHUNK]
+        out[start:start + block.shape[0]] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return out
+
+
+def _kmeans_l2(x: np.ndarray, k: int, n_iter: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = x[rng.choice(x.shape[0], size=k, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _assign_l2(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+def train_codes(embeddings: np.ndarray, storage: str, pq_m: int = 0, seed: int = 0):
+    if storage == "float16":
+        return Float16Codes.train(embeddings)
+    if storage == "int8":
+        return Int8Codes.train(embeddings)
+    if storage == "pq":
+        return PQCodes.train(embeddings, m=pq_m, seed=seed)
+    raise ValueError(f"Unknown storage {storage!r}, expected one of {STORAGE_FORMATS}")
+
+
+def save_codes(codes, path: str, rerank_factor: int) -> None:
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, kind=np.array(codes.kind), rerank_factor=np.array(int(rerank_factor)), **codes.arrays())
+    os.replace(tmp_path, path)
+
+
+def load_codes(path: str, num_rows: int):
+    """
+    Load compressed codes written by /embed, or None if there are none or
+    they don't match the current embedding matrix.
+    Returns (codes, rerank_factor).
+    """
+    if not os.path.exists(path):
+        return None, 0
+    with np.load(path) as data:
+        kind = str(data["kind"])
+        cls = _FORMATS.get(kind)
+        if cls is None or data["codes"].shape[0] != num_rows:
+            return None, 0
+        arrays = {name: data[name] for name in data.files if name not in ("kind", "rerank_factor")}
+        return cls(**arrays), int(data["rerank_factor"])
+
+
+def storage_report(codes, embeddings: np.ndarray) -> Dict[str, Any]:
+    full_bytes = int(embeddings.shape[0]) * int(embeddings.shape[1]) * 4
+    return {
+        "storage": codes.kind,
+        "codes_bytes": codes.nbytes,
+        "float32_bytes": full_bytes,
+        "compression_ratio": round(full_bytes / max(1, codes.nbytes), 2),
+    }
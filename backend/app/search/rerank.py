@@ -0,0 +1,108 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.search.filters import MetadataColumns
+from app.search.index import top_k_indices
+
+
+RERANK_METHODS = ("none", "mmr", "popularity", "mmr_popularity")
+
+# Votes at which a movie's own rating and the candidate pool's mean rating
+# weigh the same in the popularity prior (Bayesian average).
+PRIOR_VOTES = 100.0
+
+
+def _minmax(x: np.ndarray) -> np.ndarray:
+    spread = float(x.max() - x.min())
+    if spread <= 0:
+        return np.ones_like(x, dtype=np.float32)
+    return ((x - x.min()) / spread).astype(np.float32)
+
+
+def popularity_prior(columns: MetadataColumns, rows: np.ndarray) -> np.ndarray:
+    """
+    Per-candidate prior in [0, 1], the mean of:
+      - log(1 + popularity), scaled by the pool's maximum
+      - rating / 10, shrunk toward the pool's mean rating for movies with
+        few votes (v / (v + PRIOR_VOTES) weight on their own rating)
+    Unknown popularity counts as 0; an unknown rating as the pool mean.
+    """
+    pop = np.nan_to_num(columns.popularity[rows], nan=0.0).clip(min=0.0)
+    pop = np.log1p(pop)
+    pop_max = float(pop.max())
+    pop = pop / pop_max if pop_max > 0 else np.zeros_like(pop)
+
+    rating = columns.rating[rows]
+    known = ~np.isnan(rating)
+    mean = float(rating[known].mean()) if known.any() else 0.0
+    votes = columns.vote_count[rows].clip(min=0).astype(np.float32)
+    trust = np.where(known, votes / (votes + PRIOR_VOTES), 0.0)
+    rating = trust * np.nan_to_num(rating, nan=mean) + (1.0 - trust) * mean
+
+    return (0.5 * pop + 0.5 * rating / 10.0).astype(np.float32)
+
+
+def mmr_order(
+    vectors: np.ndarray,
+    relevance: np.ndarray,
+    k: int,
+    lam: float,
+    dedupe_sim: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Greedy maximal marginal relevance over a candidate sub-matrix: each step
+    takes the candidate maximizing
+        lam * relevance - (1 - lam) * max cosine to the candidates already taken,
+    keeping the running max-similarity vector so a step is one (n,) update.
+    Candidates within `dedupe_sim` of a taken one are dropped instead.
+    Returns up to k positions into `vectors`, in selection order.
+    """
+    n = vectors.shape[0]
+    sims = vectors @ vectors.T  # (n, n); n is a candidate pool, not the corpus
+    max_sim = np.zeros(n, dtype=np.float32)
+    alive = np.ones(n, dtype=bool)
+    order = []
+    while len(order) < k and alive.any():
+        gain = np.where(alive, lam * relevance - (1.0 - lam) * max_sim, -np.inf)
+        best = int(np.argmax(gain))
+        order.append(best)
+        alive[best] = False
+        max_sim = np.maximum(max_sim, sims[best])
+        if dedupe_sim is not None:
+            alive &= max_sim < dedupe_sim
+    return np.asarray(order, dtype=np.int64)
+
+
+def rerank(
+    rows: np.ndarray,
+    scores: np.ndarray,
+    vectors: np.ndarray,
+    columns: MetadataColumns,
+    k: int,
+    method: str,
+    lam: float = 0.7,
+    popularity_weight: float = 0.2,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Re-rank a candidate pool (rows + retrieval scores, `vectors` = their
+    embeddings) down to k. Relevance is the retrieval score min-max scaled
+    to [0, 1], so cosine, BM25 and fused scores all work:
+      - popularity: relevance blended with popularity_prior by popularity_weight
+      - mmr: MMR over the candidate vectors
+      - mmr_popularity: MMR on the blended relevance
+    Returns (rows, retrieval scores) in the new order.
+    """
+    if rows.size == 0 or method == "none":
+        return rows[:k], scores[:k]
+
+    relevance = _minmax(scores)
+    if method in ("popularity", "mmr_popularity"):
+        prior = popularity_prior(columns, rows)
+        relevance = (1.0 - popularity_weight) * relevance + popularity_weight * prior
+
+    if method in ("mmr", "mmr_popularity"):
+        order = mmr_order(vectors, relevance, k, lam)
+    else:
+        order = top_k_indices(relevance, k)
+    return rows[order], scores[order]
@@ -1,6 +1,39 @@
+from typing import List, Literal, Optional
+
 from pydantic import BaseModel, Field
 
+class SearchFilters(BaseModel):
+    year_min: Optional[int] = Field(None, description="Earliest release year (inclusive)")
+    year_max: Optional[int] = Field(None, description="Latest release year (inclusive)")
+    genres: Optional[List[str]] = Field(None, description="Match docs having any of these genres")
+    rating_min: Optional[float] = Field(None, ge=0, le=10, description="Minimum TMDb rating")
+    rating_max: Optional[float] = Field(None, ge=0, le=10, description="Maximum TMDb rating")
+    vote_count_min: Optional[int] = Field(None, ge=0, description="Minimum TMDb vote count")
+
+
 class SearchRequest(BaseModel):
     query: str = Field(..., min_length=1, description="User search query")
     top_k: int = Field(10, ge=1, le=50, description="Number of results to return")
     model_name: str = Field("sentence-transformers/all-MiniLM-L6-v2", description="Embedding model name")
+    nprobe: Optional[int] = Field(None, ge=1, description="IVF lists to scan (ignored for flat index)")
+    filters: Optional[SearchFilters] = Field(None, description="Metadata filters applied before ranking")
+    mode: Literal["semantic", "lexical", "hybrid"] = Field("semantic", description="Vector, BM25 or fused ranking")
+    rerank: Literal["none", "mmr", "popularity", "mmr_popularity"] = Field(
+        "none", description="Re-rank a larger candidate pool for diversity (MMR) and/or popularity"
+    )
+    paginate: bool = Field(
+        False, description="Rank a deeper candidate list once and return a cursor for the next pages"
+    )
+    debug: bool = Field(False, description="Include per-stage timings (ms) in the response")
+
+
+class SearchBatchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=10000, description="Search queries")
+    top_k: int = Field(10, ge=1, le=50, description="Number of results to return per query")
+    model_name: str = Field("sentence-transformers/all-MiniLM-L6-v2", description="Embedding model name")
+    nprobe: Optional[int] = Field(None, ge=1, description="IVF lists to scan (ignored for flat index)")
+    filters: Optional[SearchFilters] = Field(None, description="Metadata filters applied before ranking")
+    mode: Literal["semantic", "lexical", "hybrid"] = Field("semantic", description="Vector, BM25 or fused ranking")
+    rerank: Literal["none", "mmr", "popularity", "mmr_popularity"] = Field(
+        "none", description="Re-rank a larger candidate pool for diversity (MMR) and/or popularity"
+    )
@@ -1,118 +1,440 @@
+import asyncio
+import base64
+import functools
 import json
+import logging
 import os
-from typing import Any, Dict, List, Tuple
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
+from app.core.artifacts import resolve_build
 from app.core.config import settings
+from app.core.metrics import operation, stage
+from app.embeddings.encoder import load_checked_encoder
+from app.ingestion.columnar import DOC_INDEX_COLUMNAR, SCHEMA_FILE, ColumnarCorpus
+from app.search.batching import MicroBatcher
+from app.search.cache import LRUCache
+from app.search.docstore import DocStore
+from app.search.filters import filters_key, load_columns, normalize_filters
+from app.search.index import load_index
+from app.search.lexical import SEARCH_MODES, load_lexical_index, reciprocal_rank_fusion
+from app.search.neighbors import NEIGHBORS_FILE, compute_neighbors, load_neighbors
+from app.search.quantize import load_codes
+from app.search.rerank import RERANK_METHODS, rerank as rerank_candidates
+from app.search.shards import ShardedIndex, load_shard_manifest
 
+if TYPE_CHECKING:
+    # Imported lazily (it pulls in torch): see get_model().
+    from sentence_transformers import SentenceTransformer
 
-# --- Simple in-process cache so we don't reload on every request ---
-_CACHE: Dict[str, Any] = {
-    "model_name": None,
-    "model": None,
-    "embeddings": None,   # shape: (N, D), float32, normalized
-    "doc_index": None,    # list aligned with embeddings rows
-}
 
+logger = logging.getLogger(__name__)
 
-def _path(filename: str) -> str:
-    return os.path.join(settings.DATA_DIR, filename)
 
+# --- In-process registry so we don't reload on every request ---
+# Loaded models and per-model build assets, each a bounded LRU keyed on
+# model_name, so clients alternating between models don't evict each other.
+# An assets entry holds:
+#   embeddings     (N, D) float32, normalized (np.memmap if EMBEDDINGS_MMAP)
+#   doc_index      DocStore or ColumnarCorpus (or list from doc_index.json) aligned
+#                  with embeddings rows
+#   index          FlatIndex / IVFIndex over embeddings (+ compressed codes if built),
+#                  or ShardedIndex (shard worker processes) for a sharded build
+#   columns        MetadataColumns aligned with embeddings rows (for filters)
+#   lexical        BM25Index over combined_text (None for builds without one)
+#   neighbors      NeighborLists precomputed by /similar/precompute (or None)
+#   build_dir      directory the build was loaded from
+#   index_version  build id (or embeddings.npy identity) the above was loaded from
+_MODELS: "OrderedDict[str, SentenceTransformer]" = OrderedDict()
+# Encoder backend each loaded model runs on (and its parity check).
+_ENCODERS: Dict[str, Dict[str, Any]] = {}
+_ASSETS: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_REGISTRY_LOCK = threading.Lock()
+_LOAD_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
 
-def _load_doc_index(index_path: str) -> List[Dict[str, Any]]:
-    with open(index_path, "r", encoding="utf-8") as f:
+# Query vectors keyed on (normalized query, model_name); ranked responses keyed
+# on (normalized query, top_k, model_name, nprobe, filters, mode, rerank, index_version).
+# Results are cleared whenever a new build is picked up; query vectors depend
+# only on the model, so they survive.
+_QUERY_CACHE = LRUCache(max_size=settings.QUERY_CACHE_SIZE, ttl_s=settings.QUERY_CACHE_TTL_S)
+_RESULT_CACHE = LRUCache(max_size=settings.RESULT_CACHE_SIZE, ttl_s=settings.RESULT_CACHE_TTL_S)
+# Ranked candidate lists of paginated searches, keyed on cursor id. An entry
+# remembers the index_version it was ranked on and is refused once the model
+# serves another build.
+_CURSORS = LRUCache(max_size=settings.SEARCH_CURSOR_MAX, ttl_s=settings.SEARCH_CURSOR_TTL_S)
+
+
+class ModelMismatchError(ValueError):
+    """
+    The build served for a model was produced by a different model (or has
+    a different embedding dimension), so its vectors are not comparable.
+    """
+
+
+def _load_lock(kind: str, name: str) -> threading.Lock:
+    with _REGISTRY_LOCK:
+        return _LOAD_LOCKS.setdefault((kind, name), threading.Lock())
+
+
+def _lru_get(registry: "OrderedDict[str, Any]", name: str) -> Any:
+    with _REGISTRY_LOCK:
+        value = registry.get(name)
+        if value is not None:
+            registry.move_to_end(name)
+        return value
+
+
+def _lru_put(registry: "OrderedDict[str, Any]", name: str, value: Any, max_size: int) -> None:
+    with _REGISTRY_LOCK:
+        registry[name] = value
+        registry.move_to_end(name)
+        while len(registry) > max(1, max_size):
+            registry.popitem(last=False)
+
+
+def _load_doc_index(build_dir: str) -> Union[DocStore, ColumnarCorpus, List[Dict[str, Any]]]:
+    """
+    Prefer the columnar doc index or the offset-indexed doc store written by
+    /embed (both decode rows on demand); fall back to parsing doc_index.json
+    for older builds.
+    """
+    columnar_path = os.path.join(build_dir, DOC_INDEX_COLUMNAR)
+    if os.path.exists(os.path.join(columnar_path, SCHEMA_FILE)):
+        return ColumnarCorpus(columnar_path)
+
+    store_path = os.path.join(build_dir, "doc_store.bin")
+    offsets_path = os.path.join(build_dir, "doc_offsets.npy")
+    if os.path.exists(store_path) and os.path.exists(offsets_path):
+        return DocStore(store_path, offsets_path)
+
+    with open(os.path.join(build_dir, "doc_index.json"), "r", encoding="utf-8") as f:
         return json.load(f)
 
 
-def load_search_assets(model_name: str) -> None:
+def _load_embeddings(embeddings_path: str) -> np.ndarray:
+    if settings.EMBEDDINGS_MMAP:
+        emb = np.load(embeddings_path, mmap_mode="r")
+        if emb.dtype == np.float32:
+            return emb
+        # Old builds may not be float32; those have to be copied once.
+        return np.asarray(emb, dtype=np.float32)
+    return np.load(embeddings_path).astype(np.float32)
+
+
+def _index_version(build_id: Optional[str], embeddings_path: str) -> str:
+    """
+    Identity of the served build: its build id, or for the legacy flat layout
+    the mtime + size of embeddings.npy (rewritten by every /embed).
+    """
+    if build_id is not None:
+        return build_id
+    st = os.stat(embeddings_path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def get_model(model_name: str) -> "SentenceTransformer":
+    """
+    The loaded SentenceTransformer for `model_name`, loading it on first use.
+    Up to MAX_LOADED_MODELS models stay loaded (least recently used is
+    dropped). Loading is single-flight: concurrent first requests for the
+    same model wait for one load instead of each loading it. The model runs
+    on ENCODER_BACKEND if that passes its parity check (see
+    app.embeddings.encoder), else on stock torch.
+    """
+    model = _lru_get(_MODELS, model_name)
+    if model is not None:
+        return model
+
+    with _load_lock("model", model_name):
+        model = _lru_get(_MODELS, model_name)
+        if model is None:
+            with stage("load_model"):
+                model, _ENCODERS[model_name] = load_checked_encoder(model_name)
+            _lru_put(_MODELS, model_name, model, settings.MAX_LOADED_MODELS)
+    return model
+
+
+def _check_build_model(build_dir: str, model_name: str) -> None:
+    manifest_path = os.path.join(build_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return  # flat layout from before manifests; only the dimension check applies
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        built_with = json.load(f).get("model_name")
+    if built_with and built_with != model_name:
+        raise ModelMismatchError(
+            f"No index built with {model_name!r} (the available build used {built_with!r}). "
+            f"Run /embed?model_name={model_name} first."
+        )
+
+
+def _load_build(build_dir: str, version: str) -> Dict[str, Any]:
+    def _path(filename: str) -> str:
+        return os.path.join(build_dir, filename)
+
+    emb = _load_embeddings(_path("embeddings.npy"))
+    idx = _load_doc_index(build_dir)
+
+    # Basic sanity checks
+    if emb.ndim != 2:
+        raise ValueError(f"Embeddings must be 2D, got shape {emb.shape}")
+    if len(idx) != emb.shape[0]:
+        raise ValueError(
+            f"doc_index length ({len(idx)}) must match embeddings rows ({emb.shape[0]})"
+        )
+
+    shards = load_shard_manifest(build_dir)
+    if shards is not None:
+        index = ShardedIndex(
+            build_dir,
+            shards,
+            timeout_s=settings.SEARCH_SHARD_TIMEOUT_MS / 1000.0,
+            start_timeout_s=settings.SEARCH_SHARD_START_TIMEOUT_S,
+        )
+    else:
+        codes, rerank_factor = load_codes(_path("quantized.npz"), emb.shape[0])
+        index = load_index(_path("ann_index.npz"), emb, codes=codes, rerank_factor=rerank_factor)
+    return {
+        "embeddings": emb,
+        "doc_index": idx,
+        "index": index,
+        "columns": load_columns(build_dir, idx),
+        "lexical": load_lexical_index(build_dir),
+        "neighbors": load_neighbors(build_dir),
+        "build_dir": build_dir,
+        "index_version": version,
+    }
+
+
+def load_search_assets(model_name: str, load_model: bool = True) -> Dict[str, Any]:
     """
-    Load model + embeddings + doc index into memory (cached).
-    Re-load if model_name differs or assets not loaded yet.
+    Load model + embeddings + doc index (+ ANN index / quantized codes if built) into memory (cached).
+    Each model is served from its own build (written by /embed under
+    DATA_DIR/models/<model>/); up to MAX_LOADED_INDEXES builds stay loaded.
+    The index files are re-loaded when /embed has published a new build
+    since they were loaded. The new build is loaded fully before it replaces
+    the old one, so requests never see a mix. A build produced by another
+    model raises ModelMismatchError instead of returning meaningless scores.
+    load_model=False (lexical search) leaves the model alone.
+    Returns the assets entry for `model_name`.
     """
+    build_id, build_dir = resolve_build(model_name)
+
+    def _path(filename: str) -> str:
+        return os.path.join(build_dir, filename)
+
     embeddings_path = _path("embeddings.npy")
-    index_path = _path("doc_index.json")
 
     if not os.path.exists(embeddings_path):
         raise FileNotFoundError(f"Missing embeddings file: {embeddings_path}")
-    if not os.path.exists(index_path):
-        raise FileNotFoundError(f"Missing doc index file: {index_path}")
-
-    need_reload = (
-        _CACHE["model"] is None
-        or _CACHE["embeddings"] is None
-        or _CACHE["doc_index"] is None
-        or _CACHE["model_name"] != model_name
-    )
+    if not any(os.path.exists(_path(name)) for name in ("doc_index.json", "doc_store.bin", DOC_INDEX_COLUMNAR)):
+        raise FileNotFoundError(f"Missing doc index file: {_path('doc_index.json')}")
+
+    version = _index_version(build_id, embeddings_path)
+    assets = _lru_get(_ASSETS, model_name)
+    if assets is None or assets["index_version"] != version:
+        with _load_lock("assets", model_name):
+            assets = _lru_get(_ASSETS, model_name)
+            if assets is None or assets["index_version"] != version:
+                _check_build_model(build_dir, model_name)
+                replacing = assets is not None
+                with stage("load_build"):
+                    assets = _load_build(build_dir, version)
+                _lru_put(_ASSETS, model_name, assets, settings.MAX_LOADED_INDEXES)
+                if replacing:
+                    _RESULT_CACHE.clear()
 
-    if need_reload:
-        _CACHE["model_name"] = model_name
-        _CACHE["model"] = SentenceTransformer(model_name)
-        _CACHE["embeddings"] = np.load(embeddings_path).astype(np.float32)
-        _CACHE["doc_index"] = _load_doc_index(index_path)
-
-        # Basic sanity checks
-        emb = _CACHE["embeddings"]
-        idx = _CACHE["doc_index"]
-        if emb.ndim != 2:
-            raise ValueError(f"Embeddings must be 2D, got shape {emb.shape}")
-        if len(idx) != emb.shape[0]:
-            raise ValueError(
-                f"doc_index length ({len(idx)}) must match embeddings rows ({emb.shape[0]})"
+    if load_model:
+        dim = get_model(model_name).get_sentence_embedding_dimension()
+        if dim and dim != assets["embeddings"].shape[1]:
+            raise ModelMismatchError(
+                f"{model_name!r} produces {dim}-d vectors but the index holds "
+                f"{assets['embeddings'].shape[1]}-d vectors. Run /embed?model_name={model_name} first."
             )
+    return assets
 
 
-def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+def _encode_queries(model: "SentenceTransformer", queries: List[str]) -> np.ndarray:
+    # Normalized to match corpus normalization
+    return model.encode(
+        queries,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    ).astype(np.float32)  # (Q, D)
+
+
+def _embed_queries(queries: List[str], model_name: str) -> np.ndarray:
     """
-    Return indices of top-k scores in descending order.
-    Uses argpartition for speed then sorts the small top-k slice.
+    Query vectors for `queries`, encoding only the ones not in the query cache
+    (in a single model.encode call).
     """
-    k = max(1, min(int(k), scores.shape[0]))
-    if k == scores.shape[0]:
-        return np.argsort(-scores)
+    keys = [(_normalize_query(q), model_name) for q in queries]
+    vecs: List[Optional[np.ndarray]] = [_QUERY_CACHE.get(key) for key in keys]
 
-    top = np.argpartition(-scores, kth=k - 1)[:k]
-    top_sorted = top[np.argsort(-scores[top])]
-    return top_sorted
+    missing = [i for i, v in enumerate(vecs) if v is None]
+    if missing:
+        model = get_model(model_name)
+        with stage("encode"):
+            encoded = _encode_queries(model, [queries[i] for i in missing])
+        for i, v in zip(missing, encoded):
+            vecs[i] = v
+            _QUERY_CACHE.put(keys[i], v)
 
+    return np.stack(vecs)
 
-def search_movies(
+
+def embed_query(text: str, model_name: str) -> np.ndarray:
+    """
+    Normalized embedding of `text` with `model_name` (query-cache backed).
+    """
+    return _embed_queries([text], model_name)[0]
+
+
+def doc_vectors(movie_ids: List[Any], model_name: str) -> np.ndarray:
+    """
+    Corpus embeddings of `movie_ids` from the build served for `model_name`,
+    (len(movie_ids), D) float32; rows for ids not in the build are zero.
+    """
+    assets = load_search_assets(model_name, load_model=False)
+    embeddings: np.ndarray = assets["embeddings"]
+    rows = assets["columns"].rows_for_movie_ids(movie_ids)
+    out = np.zeros((len(rows), embeddings.shape[1]), dtype=np.float32)
+    found = rows >= 0
+    if found.any():
+        out[found] = embeddings[rows[found]]
+    return out
+
+
+def _result_key(
+    assets: Dict[str, Any],
     query: str,
-    top_k: int = 10,
-    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
-) -> Dict[str, Any]:
+    top_k: int,
+    model_name: str,
+    nprobe: Optional[int],
+    filters: Optional[Dict[str, Any]],
+    mode: str,
+    rerank: str = "none",
+) -> Tuple:
+    return (
+        _normalize_query(query),
+        int(top_k),
+        model_name,
+        nprobe,
+        filters_key(filters),
+        mode,
+        rerank,
+        assets["index_version"],
+    )
+
+
+def _mode_error(assets: Dict[str, Any], mode: str, rerank: str = "none") -> Optional[str]:
+    # Called after load_search_assets, so the lexical index is known.
+    if rerank not in RERANK_METHODS:
+        return f"Unknown rerank method {rerank!r}; expected one of {list(RERANK_METHODS)}."
+    if mode not in SEARCH_MODES:
+        return f"Unknown search mode {mode!r}; expected one of {list(SEARCH_MODES)}."
+    if mode != "semantic" and assets["lexical"] is None:
+        return "This build has no lexical index. Re-run /embed to build one."
+    return None
+
+
+def _retrieve(
+    assets: Dict[str, Any],
+    queries: List[str],
+    k: int,
+    model_name: str,
+    nprobe: Optional[int],
+    mask: Optional[np.ndarray],
+    mode: str,
+    shard_status: Optional[Dict[str, Any]] = None,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
     """
-    Semantic search:
-    - embed query (normalized)
-    - similarity = dot(query_emb, doc_emb) since both are normalized
-    - return top_k docs with scores
+    Ranked (row ids, scores) per query for the given mode:
+    - semantic: vector index only
+    - lexical: BM25 only (no query encoding, so no model needed)
+    - hybrid: top HYBRID_CANDIDATES from each, fused by reciprocal rank
+    A sharded index fills `shard_status` with which shards answered.
     """
-    query = (query or "").strip()
-    if not query:
-        return {"error": "Query is empty."}
+    lexical = assets["lexical"]
+    if mode == "lexical":
+        with stage("bm25"):
+            return [lexical.search(q, k, mask=mask) for q in queries]
 
-    load_search_assets(model_name=model_name)
+    depth = k if mode == "semantic" else max(k, settings.HYBRID_CANDIDATES)
+    vecs = _embed_queries(queries, model_name)
+    index = assets["index"]
+    with stage("vector_search"):
+        if isinstance(index, ShardedIndex):
+            hits = index.search_batch(vecs, depth, nprobe=nprobe, mask=mask, status=shard_status)
+        elif len(queries) == 1:
+            # cosine similarity for normalized vectors = dot product
+            hits = [index.search(vecs[0], depth, nprobe=nprobe, mask=mask)]
+        else:
+            hits = index.search_batch(vecs, depth, nprobe=nprobe, mask=mask)
 
-    model: SentenceTransformer = _CACHE["model"]
-    embeddings: np.ndarray = _CACHE["embeddings"]  # (N, D)
-    doc_index: List[Dict[str, Any]] = _CACHE["doc_index"]
+    if mode == "semantic":
+        return hits
+    with stage("bm25"):
+        lexical_hits = [lexical.search(q, depth, mask=mask)[0] for q in queries]
+    with stage("fusion"):
+        return [
+            reciprocal_rank_fusion([sem_ids, lex_ids], k, rrf_k=settings.HYBRID_RRF_K)
+            for (sem_ids, _), lex_ids in zip(hits, lexical_hits)
+        ]
 
-    # Encode query (normalized to match corpus normalization)
-    q = model.encode(
-        [query],
-        normalize_embeddings=True,
-        convert_to_numpy=True,
-        show_progress_bar=False,
-    ).astype(np.float32)[0]  # (D,)
 
-    # cosine similarity for normalized vectors = dot product
-    scores = embeddings @ q  # (N,)
+def _candidate_depth(top_k: int, rerank: str) -> int:
+    # Re-ranking picks top_k out of a larger retrieved pool.
+    return int(top_k) if rerank == "none" else max(int(top_k), settings.RERANK_CANDIDATES)
+
 
-    top_idx = _top_k_indices(scores, top_k)
+def _rerank(
+    assets: Dict[str, Any],
+    top_idx: np.ndarray,
+    top_scores: np.ndarray,
+    top_k: int,
+    rerank: str,
+) -> Tuple[np.ndarray, np.ndarray, Optional[Dict[str, Any]]]:
+    """
+    Re-rank a retrieved candidate pool to top_k (see app.search.rerank).
+    Returns (rows, scores, info for the response; None when not re-ranking).
+    """
+    if rerank == "none":
+        return top_idx[:top_k], top_scores[:top_k], None
 
+    started = time.perf_counter()
+    with stage("rerank"):
+        rows, scores = rerank_candidates(
+            top_idx,
+            top_scores,
+            np.asarray(assets["embeddings"][top_idx], dtype=np.float32),
+            assets["columns"],
+            top_k,
+            rerank,
+            lam=settings.RERANK_MMR_LAMBDA,
+            popularity_weight=settings.RERANK_POPULARITY_WEIGHT,
+        )
+    info = {
+        "method": rerank,
+        "candidates": int(top_idx.shape[0]),
+        "latency_ms": round((time.perf_counter() - started) * 1000.0, 3),
+    }
+    return rows, scores, info
+
+
+def _result_rows(doc_index, top_idx: np.ndarray, top_scores: np.ndarray) -> List[Dict[str, Any]]:
     results = []
-    for i in top_idx:
+    for i, score in zip(top_idx, top_scores):
         d = doc_index[int(i)]
         results.append(
             {
@@ -124,14 +446,621 @@ def search_movies(
                 "rating": d.get("rating"),
                 "vote_count": d.get("vote_count"),
                 "overview": d.get("overview"),
-                "score": float(scores[int(i)]),
+                "score": float(score),
             }
         )
+    return results
 
-    return {
+
+def _search_response(
+    assets: Dict[str, Any],
+    query: str,
+    top_k: int,
+    model_name: str,
+    top_idx: np.ndarray,
+    top_scores: np.ndarray,
+    filters: Optional[Dict[str, Any]] = None,
+    mask: Optional[np.ndarray] = None,
+    mode: str = "semantic",
+    rerank_info: Optional[Dict[str, Any]] = None,
+    shard_status: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    embeddings: np.ndarray = assets["embeddings"]  # (N, D)
+    index = assets["index"]
+    results = _result_rows(assets["doc_index"], top_idx, top_scores)
+
+    response = {
         "query": query,
         "top_k": int(top_k),
         "model_name": model_name,
+        "mode": mode,
+        "index_version": assets["index_version"],
         "num_docs": int(embeddings.shape[0]),
+        "index_type": index.kind,
+        "storage": index.codes.kind if index.codes is not None else getattr(index, "storage", "float32"),
         "results": results,
     }
+    if mask is not None:
+        response["filters"] = normalize_filters(filters)
+        response["num_matching"] = int(np.count_nonzero(mask))
+    if rerank_info is not None:
+        response["rerank"] = rerank_info
+    if shard_status:
+        response["partial"] = shard_status["partial"]
+        response["shards"] = shard_status
+    return response
+
+
+def search_movies(
+    query: str,
+    top_k: int = 10,
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    nprobe: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "semantic",
+    rerank: str = "none",
+    debug: bool = False,
+    paginate: bool = False,
+) -> Dict[str, Any]:
+    """
+    Semantic search:
+    - embed query (normalized)
+    - similarity = dot(query_emb, doc_emb) since both are normalized
+    - return top_k docs with scores
+
+    If /embed built an IVF index, only the `nprobe` closest lists are scanned
+    (defaults to the nprobe stored with the index).
+
+    `filters` (year_min/year_max, genres, rating_min/rating_max,
+    vote_count_min) restrict the search to matching docs before scoring,
+    so top_k results are returned even when few docs match.
+
+    `mode` picks the ranking: "semantic" (default), "lexical" (BM25 over
+    combined_text; never loads the model, so it also works before the
+    model is warm) or "hybrid" (both, fused by reciprocal rank).
+
+    `rerank` ("mmr", "popularity", "mmr_popularity"; default "none")
+    re-orders a pool of RERANK_CANDIDATES retrieved docs before cutting to
+    top_k: MMR trades relevance against similarity to results already
+    taken (so one franchise does not fill the page), and the popularity
+    prior blends in TMDb popularity and vote-weighted rating. The response
+    reports the re-ranking latency.
+
+    For a sharded build (/embed?shards=N) the vector search is scattered to
+    the shard worker processes and their top-k lists are merged; if a shard
+    fails or misses SEARCH_SHARD_TIMEOUT_MS, the response is built from the
+    others and flagged "partial": true, with the missing shards under
+    "shards" (partial responses are not cached).
+
+    paginate=True ranks SEARCH_CURSOR_DEPTH candidates (at least top_k)
+    once, returns the first top_k of them and keeps the list under an
+    opaque `next_cursor` (None when there is nothing more); search_page
+    serves the following pages as slices of it. Paginated calls bypass
+    the result cache.
+
+    Every call is timed per stage (see app.core.metrics) into the /metrics
+    histograms; debug=True also returns the stage timings (ms) as `timings`.
+    """
+    with operation("search") as timer:
+        response = _search_movies(query, top_k, model_name, nprobe, filters, mode, rerank, paginate)
+    if debug and "error" not in response:
+        response = dict(response, timings=timer.as_ms())
+    return response
+
+
+def _search_movies(
+    query: str,
+    top_k: int,
+    model_name: str,
+    nprobe: Optional[int],
+    filters: Optional[Dict[str, Any]],
+    mode: str,
+    rerank: str,
+    paginate: bool = False,
+) -> Dict[str, Any]:
+    query = (query or "").strip()
+    if not query:
+        return {"error": "Query is empty."}
+
+    try:
+        assets = load_search_assets(model_name=model_name, load_model=mode != "lexical")
+    except ModelMismatchError as e:
+        return {"error": str(e)}
+    error = _mode_error(assets, mode, rerank)
+    if error:
+        return {"error": error}
+
+    key = _result_key(assets, query, top_k, model_name, nprobe, filters, mode, rerank)
+    if not paginate:
+        cached = _RESULT_CACHE.get(key)
+        if cached is not None:
+            return dict(cached, query=query)
+
+    # A paginated search ranks the whole list it will page through now.
+    depth = max(int(top_k), settings.SEARCH_CURSOR_DEPTH) if paginate else int(top_k)
+    with stage("filter_mask"):
+        mask = assets["columns"].mask(filters)
+    shard_status: Dict[str, Any] = {}
+    [(top_idx, top_scores)] = _retrieve(
+        assets, [query], _candidate_depth(depth, rerank), model_name, nprobe, mask, mode, shard_status
+    )
+    top_idx, top_scores, rerank_info = _rerank(assets, top_idx, top_scores, depth, rerank)
+
+    with stage("build_results"):
+        response = _search_response(
+            assets,
+            query,
+            top_k,
+            model_name,
+            top_idx[:top_k],
+            top_scores[:top_k],
+            filters,
+            mask,
+            mode,
+            rerank_info,
+            shard_status,
+        )
+    if paginate:
+        return _open_cursor(assets, response, top_idx, top_scores)
+    if not response.get("partial"):
+        _RESULT_CACHE.put(key, response)
+    return response
+
+
+def _encode_cursor(cursor_id: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{cursor_id}:{offset}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        cursor_id, offset = raw.rsplit(":", 1)
+        offset = int(offset)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return (cursor_id, offset) if cursor_id and offset >= 0 else None
+
+
+def _open_cursor(
+    assets: Dict[str, Any], response: Dict[str, Any], top_idx: np.ndarray, top_scores: np.ndarray
+) -> Dict[str, Any]:
+    # Keep the ranked list (8 bytes per candidate) for search_page; the first page is already built.
+    page_size = response["top_k"]
+    num_ranked = int(top_idx.shape[0])
+    next_cursor = None
+    if num_ranked > page_size:
+        cursor_id = secrets.token_urlsafe(12)
+        _CURSORS.put(
+            cursor_id,
+            {
+                "rows": np.asarray(top_idx, dtype=np.int32),
+                "scores": np.asarray(top_scores, dtype=np.float32),
+                "index_version": assets["index_version"],
+                "model_name": response["model_name"],
+                "query": response["query"],
+                "mode": response["mode"],
+                "page_size": page_size,
+                "filters": response.get("filters"),
+                "num_matching": response.get("num_matching"),
+            },
+        )
+        next_cursor = _encode_cursor(cursor_id, page_size)
+    return dict(response, offset=0, num_ranked=num_ranked, next_cursor=next_cursor)
+
+
+def search_page(cursor: str, page_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    The page of a paginated search (search_movies(paginate=True)) that
+    `cursor` points at: a slice of the list the first call ranked, so no
+    encoding or scoring happens. `page_size` defaults to the first call's
+    top_k. A cursor is refused once it has expired (SEARCH_CURSOR_TTL_S,
+    or dropped to stay within SEARCH_CURSOR_MAX) or the model now serves
+    a different build; the search then has to be run again.
+    """
+    with operation("search_page"):
+        parsed = _decode_cursor(cursor or "")
+        if parsed is None:
+            return {"error": "Invalid cursor."}
+        cursor_id, offset = parsed
+        entry = _CURSORS.get(cursor_id)
+        if entry is None:
+            return {"error": "Cursor expired; run the search again.", "cursor_expired": True}
+        try:
+            assets = load_search_assets(model_name=entry["model_name"], load_model=False)
+        except ModelMismatchError as e:
+            return {"error": str(e)}
+        if assets["index_version"] != entry["index_version"]:
+            _CURSORS.pop(cursor_id)
+            return {
+                "error": "The index changed since this search was run; run it again.",
+                "cursor_expired": True,
+            }
+
+        page_size = int(page_size or entry["page_size"])
+        num_ranked = int(entry["rows"].shape[0])
+        end = min(offset + page_size, num_ranked)
+        with stage("build_results"):
+            response = _search_response(
+                assets,
+                entry["query"],
+                page_size,
+                entry["model_name"],
+                entry["rows"][offset:end],
+                entry["scores"][offset:end],
+                mode=entry["mode"],
+            )
+        if entry["filters"] is not None:
+            response["filters"] = entry["filters"]
+            response["num_matching"] = entry["num_matching"]
+        response.update(
+            offset=offset,
+            num_ranked=num_ranked,
+            next_cursor=_encode_cursor(cursor_id, end) if end < num_ranked else None,
+        )
+        return response
+
+
+def _search_group(
+    requests: List[Dict[str, Any]],
+    ids: List[int],
+    out: List[Any],
+    model_name: str,
+    nprobe: Optional[int],
+    mode: str,
+    rerank: str,
+) -> None:
+    # One micro-batch group (same model, nprobe, filters, mode, rerank); fills out[i] for i in ids.
+    filters = requests[ids[0]].get("filters")
+    try:
+        assets = load_search_assets(model_name=model_name, load_model=mode != "lexical")
+        error = _mode_error(assets, mode, rerank)
+        if error:
+            for i in ids:
+                out[i] = {"error": error}
+            return
+
+        todo = []
+        for i in ids:
+            r = requests[i]
+            cached = _RESULT_CACHE.get(
+                _result_key(assets, r["query"], r["top_k"], model_name, nprobe, filters, mode, rerank)
+            )
+            if cached is not None:
+                out[i] = dict(cached, query=r["query"])
+            else:
+                todo.append(i)
+        if not todo:
+            return
+
+        k = _candidate_depth(max(requests[i]["top_k"] for i in todo), rerank)
+        with stage("filter_mask"):
+            mask = assets["columns"].mask(filters)
+        shard_status: Dict[str, Any] = {}
+        hits = _retrieve(
+            assets, [requests[i]["query"] for i in todo], k, model_name, nprobe, mask, mode, shard_status
+        )
+
+        for i, (top_idx, top_scores) in zip(todo, hits):
+            r = requests[i]
+            top_idx, top_scores, rerank_info = _rerank(
+                assets, top_idx, top_scores, r["top_k"], rerank
+            )
+            with stage("build_results"):
+                out[i] = _search_response(
+                    assets,
+                    r["query"],
+                    r["top_k"],
+                    model_name,
+                    top_idx,
+                    top_scores,
+                    filters,
+                    mask,
+                    mode,
+                    rerank_info,
+                    shard_status,
+                )
+            if not out[i].get("partial"):
+                _RESULT_CACHE.put(
+                    _result_key(assets, r["query"], r["top_k"], model_name, nprobe, filters, mode, rerank),
+                    out[i],
+                )
+    except ModelMismatchError as e:
+        for i in ids:
+            out[i] = {"error": str(e)}
+    except Exception as e:
+        for i in ids:
+            out[i] = e
+
+
+def _run_search_batch(requests: List[Dict[str, Any]]) -> List[Any]:
+    """
+    Micro-batch handler: result-cache misses sharing a model, nprobe, filters
+    and mode are encoded in one model.encode call and scored with one Q @ E.T product.
+    Returns one response (or Exception) per request, in order.
+    """
+    out: List[Any] = [None] * len(requests)
+
+    groups: Dict[Tuple[str, Optional[int], str, str, str], List[int]] = {}
+    for i, r in enumerate(requests):
+        key = (
+            r["model_name"],
+            r["nprobe"],
+            filters_key(r.get("filters")),
+            r.get("mode", "semantic"),
+            r.get("rerank", "none"),
+        )
+        groups.setdefault(key, []).append(i)
+
+    for (model_name, nprobe, _, mode, rerank), ids in groups.items():
+        with operation("search_batch") as timer:
+            _search_group(requests, ids, out, model_name, nprobe, mode, rerank)
+        for i in ids:
+            if requests[i].get("debug") and isinstance(out[i], dict) and "error" not in out[i]:
+                out[i] = dict(out[i], timings=dict(timer.as_ms(), batch_size=len(ids)))
+
+    return out
+
+
+def search_movies_batch(
+    queries: List[str],
+    top_k: int = 10,
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    nprobe: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "semantic",
+    rerank: str = "none",
+) -> Dict[str, Any]:
+    """
+    Search many queries in one call. Each chunk of `chunk_size` queries
+    (SEARCH_BATCH_CHUNK_SIZE by default) is encoded with one model.encode
+    call and scored with blocked Q @ E.T products, so memory stays bounded
+    however many queries are sent. Results are returned in input order;
+    empty queries get an error entry instead of failing the batch.
+    `filters`, `mode` and `rerank` apply to every query in the batch.
+    """
+    chunk_size = max(1, int(chunk_size or settings.SEARCH_BATCH_CHUNK_SIZE))
+
+    cleaned = [(q or "").strip() for q in queries]
+    results: List[Dict[str, Any]] = [{"error": "Query is empty."} for _ in cleaned]
+    pending = [i for i, q in enumerate(cleaned) if q]
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        responses = _run_search_batch(
+            [
+                {
+                    "query": cleaned[i],
+                    "top_k": int(top_k),
+                    "model_name": model_name,
+                    "nprobe": nprobe,
+                    "filters": filters,
+                    "mode": mode,
+                    "rerank": rerank,
+                }
+                for i in chunk
+            ]
+        )
+        for i, response in zip(chunk, responses):
+            if isinstance(response, Exception):
+                raise response
+            results[i] = response
+
+    return {
+        "top_k": int(top_k),
+        "model_name": model_name,
+        "mode": mode,
+        "rerank": rerank,
+        "num_queries": len(queries),
+        "results": results,
+    }
+
+
+def similar_movies(
+    movie_id: int,
+    top_k: int = 10,
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    nprobe: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    "More like this": the movies closest to `movie_id`'s own stored vector.
+    The movie is found through the build's movie_id -> row hash index and
+    its embeddings row is the query, so no text is encoded (the model is
+    never loaded). Served straight from the precomputed neighbor lists when
+    /similar/precompute has built them with at least top_k entries;
+    otherwise searched in the vector index.
+    """
+    try:
+        assets = load_search_assets(model_name=model_name, load_model=False)
+    except ModelMismatchError as e:
+        return {"error": str(e)}
+
+    row = assets["columns"].row_for_movie_id(movie_id)
+    if row < 0:
+        return {"error": f"Movie {movie_id} is not in the index for {model_name!r}."}
+
+    if assets["neighbors"] is None:
+        # Precomputed by another worker since this build was loaded?
+        assets["neighbors"] = load_neighbors(assets["build_dir"])
+    neighbors = assets["neighbors"]
+
+    if neighbors is not None and len(neighbors) == len(assets["doc_index"]) and top_k <= neighbors.top_n:
+        top_idx, top_scores = neighbors.get(row, top_k)
+        source = "precomputed"
+    else:
+        vec = np.asarray(assets["embeddings"][row], dtype=np.float32)
+        top_idx, top_scores = assets["index"].search(vec, top_k + 1, nprobe=nprobe)
+        keep = top_idx != row
+        top_idx, top_scores = top_idx[keep][:top_k], top_scores[keep][:top_k]
+        source = "index"
+
+    d = assets["doc_index"][row]
+    return {
+        "movie_id": movie_id,
+        "title": d.get("title"),
+        "top_k": int(top_k),
+        "model_name": model_name,
+        "index_version": assets["index_version"],
+        "source": source,
+        "results": _result_rows(assets["doc_index"], top_idx, top_scores),
+    }
+
+
+def precompute_neighbors(
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    top_n: int = 20,
+    chunk_size: int = 1024,
+) -> Dict[str, Any]:
+    """
+    Compute exact top_n neighbor lists for the whole catalog of the build
+    served for `model_name` (chunked matrix products over the stored
+    vectors) and save them next to it as neighbors.npz, so /similar becomes
+    a lookup. A new build needs a new run.
+    """
+    try:
+        assets = load_search_assets(model_name=model_name, load_model=False)
+    except ModelMismatchError as e:
+        return {"error": str(e)}
+
+    started = time.perf_counter()
+    neighbors = compute_neighbors(assets["embeddings"], top_n, chunk_size=max(1, int(chunk_size)))
+    elapsed = time.perf_counter() - started
+
+    path = os.path.join(assets["build_dir"], NEIGHBORS_FILE)
+    neighbors.save(path)
+    assets["neighbors"] = neighbors
+    return {
+        "model_name": model_name,
+        "index_version": assets["index_version"],
+        "path": path,
+        "seconds": round(elapsed, 3),
+        **neighbors.stats(),
+    }
+
+
+# CPU-bound search work (query encoding, scoring) runs on its own threads
+# instead of the shared default pool, so it never queues behind other
+# blocking work and can't be starved by it.
+_SEARCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.SEARCH_EXECUTOR_WORKERS, thread_name_prefix="search"
+)
+
+_BATCHER = MicroBatcher(
+    _run_search_batch,
+    max_batch_size=settings.SEARCH_BATCH_MAX_SIZE,
+    window_ms=settings.SEARCH_BATCH_WINDOW_MS,
+    executor=_SEARCH_EXECUTOR,
+)
+
+
+async def run_in_search_executor(fn, *args, **kwargs) -> Any:
+    """
+    Await `fn(*args, **kwargs)` run on the search executor.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_SEARCH_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+async def search_movies_async(
+    query: str,
+    top_k: int = 10,
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    nprobe: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    mode: str = "semantic",
+    rerank: str = "none",
+    debug: bool = False,
+    paginate: bool = False,
+) -> Dict[str, Any]:
+    """
+    Async front door for /search. With SEARCH_BATCHING on, concurrent calls
+    are coalesced by the micro-batcher; otherwise (and for lexical queries,
+    which have no encode to share, and paginated ones) search_movies runs
+    on the search executor.
+    """
+    query = (query or "").strip()
+    if not query:
+        return {"error": "Query is empty."}
+
+    if not settings.SEARCH_BATCHING or mode == "lexical" or paginate:
+        return await run_in_search_executor(
+            search_movies, query, top_k, model_name, nprobe, filters, mode, rerank, debug, paginate
+        )
+
+    return await _BATCHER.submit(
+        {
+            "query": query,
+            "top_k": int(top_k),
+            "model_name": model_name,
+            "nprobe": nprobe,
+            "filters": filters,
+            "mode": mode,
+            "rerank": rerank,
+            "debug": debug,
+        }
+    )
+
+
+# Outcome of the startup warmup, served by /ready.
+_READINESS: Dict[str, Any] = {"status": "starting"}
+
+
+def warmup(model_name: Optional[str]) -> Dict[str, Any]:
+    """
+    Load `model_name` and its build and push one throwaway query through
+    both, so the first real /search pays for neither the model load, lazy
+    initialisation inside the model, nor page faults on the embeddings.
+    An empty model_name skips warmup (everything loads on first use).
+    A tree with no index yet is still ready: there is nothing to serve.
+    """
+    if not model_name:
+        _READINESS.update({"status": "ready", "warmup": "disabled"})
+        return dict(_READINESS)
+
+    _READINESS.update({"status": "warming", "model_name": model_name})
+    started = time.perf_counter()
+    try:
+        vec = _encode_queries(get_model(model_name), ["warmup"])[0]
+        try:
+            assets = load_search_assets(model_name)
+        except (FileNotFoundError, ModelMismatchError) as e:
+            _READINESS.update({"index_version": None, "warning": str(e)})
+        else:
+            assets["index"].search(vec, 1)
+            _READINESS["index_version"] = assets["index_version"]
+    except Exception as e:
+        logger.exception("Warmup of %s failed", model_name)
+        _READINESS.update({"status": "failed", "error": str(e)})
+    else:
+        _READINESS["status"] = "ready"
+    _READINESS["warmup_seconds"] = round(time.perf_counter() - started, 3)
+    return dict(_READINESS)
+
+
+def readiness() -> Dict[str, Any]:
+    return dict(_READINESS)
+
+
+def batcher_stats() -> Dict[str, Any]:
+    return _BATCHER.stats()
+
+
+def _index_stats(assets: Dict[str, Any]) -> Dict[str, Any]:
+    stats = dict(assets["index"].stats(), dim=int(assets["embeddings"].shape[1]))
+    if assets["lexical"] is not None:
+        stats["lexical"] = assets["lexical"].stats()
+    if assets["neighbors"] is not None:
+        stats["neighbors"] = assets["neighbors"].stats()
+    return stats
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {
+        "loaded_models": list(_MODELS),
+        "encoders": {name: _ENCODERS.get(name) for name in list(_MODELS)},
+        "loaded_indexes": {name: assets["index_version"] for name, assets in _ASSETS.items()},
+        "indexes": {name: _index_stats(assets) for name, assets in list(_ASSETS.items())},
+        "query_embeddings": _QUERY_CACHE.stats(),
+        "results": _RESULT_CACHE.stats(),
+        "cursors": dict(_CURSORS.stats(), depth=settings.SEARCH_CURSOR_DEPTH),
+    }
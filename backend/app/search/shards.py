@@ -0,0 +1,415 @@
+import heapq
+import itertools
+import json
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.search.index import build_index, load_index
+from app.search.quantize import load_codes, save_codes, storage_report, train_codes
+
+
+logger = logging.getLogger(__name__)
+
+# A sharded build (/embed?shards=N) splits the rows of embeddings.npy into N
+# contiguous ranges. shards.json lists them; each shard's own ANN index and
+# compressed codes (if any) live in shards/<nnn>/, with row ids local to the
+# shard. The vectors stay in the build's embeddings.npy: a worker memory-maps
+# only its own range.
+SHARDS_FILE = "shards.json"
+SHARDS_DIR = "shards"
+
+# Seconds between restarts of a shard worker that died.
+RESTART_BACKOFF_S = 5.0
+
+# Workers are spawned, not forked: the server process has threads (and maybe torch).
+_CTX = multiprocessing.get_context("spawn")
+
+
+class ShardError(RuntimeError):
+    """
+    A shard worker could not answer (not running, crashed, or raised).
+    """
+
+
+def shard_ranges(num_docs: int, num_shards: int) -> List[Tuple[int, int]]:
+    num_shards = max(1, min(int(num_shards), num_docs))
+    bounds = [num_docs * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def build_shards(
+    build_dir: str,
+    embeddings: np.ndarray,
+    num_shards: int,
+    index_type: str = "flat",
+    nlist: int = 0,
+    nprobe: int = 8,
+    storage: str = "float32",
+    pq_m: int = 0,
+    rerank_factor: int = 10,
+) -> Dict[str, Any]:
+    """
+    Split a build into `num_shards` row ranges and build each shard's index
+    (and codes) over its own rows. nlist is the total across shards
+    (0 = ~sqrt(rows) lists per shard). Raises ValueError from train_codes.
+    """
+    shards = []
+    reports = []
+    for i, (start, stop) in enumerate(shard_ranges(embeddings.shape[0], num_shards)):
+        rel_dir = os.path.join(SHARDS_DIR, f"{i:03d}")
+        shard_dir = os.path.join(build_dir, rel_dir)
+        os.makedirs(shard_dir, exist_ok=True)
+
+        part = embeddings[start:stop]
+        codes = train_codes(part, storage, pq_m=pq_m) if storage != "float32" else None
+        index = build_index(
+            part,
+            index_type=index_type,
+            nlist=max(1, nlist // num_shards) if nlist > 0 else 0,
+            nprobe=nprobe,
+            codes=codes,
+            rerank_factor=rerank_factor,
+        )
+        report = dict(index.stats(), shard=i, start=start, stop=stop)
+        if index_type != "flat":
+            index.save(os.path.join(shard_dir, "ann_index.npz"))
+        if codes is not None:
+            save_codes(codes, os.path.join(shard_dir, "quantized.npz"), rerank_factor=rerank_factor)
+            report.update(storage_report(codes, part))
+
+        shards.append({"shard": i, "start": start, "stop": stop, "dir": rel_dir})
+        reports.append(report)
+
+    manifest = {"num_docs": int(embeddings.shape[0]), "num_shards": len(shards), "shards": shards}
+    path = os.path.join(build_dir, SHARDS_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return {"index_type": "sharded", "num_shards": len(shards), "shards": reports, "shards_file": path}
+
+
+def load_shard_manifest(build_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(build_dir, SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def merge_top_k(parts: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k best of several (row ids, scores) rankings, each sorted best
+    first: a k-way heap merge that stops after k items.
+    """
+    streams = [zip(scores.tolist(), ids.tolist()) for ids, scores in parts]
+    merged = list(itertools.islice(heapq.merge(*streams, key=lambda t: t[0], reverse=True), int(k)))
+    if not merged:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    scores, ids = zip(*merged)
+    return np.asarray(ids, dtype=np.int64), np.asarray(scores, dtype=np.float32)
+
+
+def serve_shard(conn, build_dir: str, spec: Dict[str, Any]) -> None:
+    """
+    Main loop of a shard worker process: load the shard, report ready
+    (request id 0), then answer (request_id, op, payload) messages in
+    order until "close" or the coordinator goes away. Row ids in answers
+    are global.
+    """
+    start, stop = int(spec["start"]), int(spec["stop"])
+    shard_dir = os.path.join(build_dir, spec["dir"])
+    try:
+        emb = np.load(os.path.join(build_dir, "embeddings.npy"), mmap_mode="r")[start:stop]
+        if emb.dtype != np.float32:
+            emb = np.asarray(emb, dtype=np.float32)
+        codes, rerank_factor = load_codes(os.path.join(shard_dir, "quantized.npz"), emb.shape[0])
+        index = load_index(
+            os.path.join(shard_dir, "ann_index.npz"), emb, codes=codes, rerank_factor=rerank_factor
+        )
+    except Exception as e:
+        conn.send((0, "error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send((0, "ok", index.stats()))
+
+    while True:
+        try:
+            req_id, op, payload = conn.recv()
+        except (EOFError, OSError):
+            return
+        if op == "close":
+            return
+        try:
+            if op == "search":
+                mask = payload["mask"]
+                if mask is not None:
+                    mask = np.unpackbits(mask, count=stop - start).astype(bool)
+                hits = index.search_batch(payload["queries"], payload["k"], nprobe=payload["nprobe"], mask=mask)
+                result = [(ids + start, scores) for ids, scores in hits]
+            elif op == "stats":
+                result = index.stats()
+            else:
+                raise ValueError(f"Unknown op {op!r}")
+            conn.send((req_id, "ok", result))
+        except Exception as e:
+            conn.send((req_id, "error", f"{type(e).__name__}: {e}"))
+
+
+class _ShardWorker:
+    """
+    Coordinator-side handle of one shard worker process: a pipe (a local
+    socket pair), a reader thread resolving one Future per request id, and
+    a background restart (at most every RESTART_BACKOFF_S) if the process dies.
+    """
+
+    def __init__(self, build_dir: str, spec: Dict[str, Any]):
+        self.build_dir = build_dir
+        self.spec = spec
+        self.shard = int(spec["shard"])
+        self.start = int(spec["start"])
+        self.stop = int(spec["stop"])
+        self.stats: Dict[str, Any] = {}
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self._up = False
+        self._closed = False
+        self._conn = None
+        self._proc = None
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._started_at = 0.0
+        self._restarting = False
+
+    @property
+    def up(self) -> bool:
+        return self._up
+
+    def launch(self) -> Future:
+        """
+        Start the process; the returned Future resolves when it is ready.
+        """
+        parent, child = _CTX.Pipe()
+        proc = _CTX.Process(
+            target=serve_shard,
+            args=(child, self.build_dir, self.spec),
+            name=f"shard-{self.shard}",
+            daemon=True,
+        )
+        proc.start()
+        child.close()
+
+        ready: Future = Future()
+        ready.add_done_callback(self._on_ready)
+        with self._lock:
+            self._conn, self._proc = parent, proc
+            self._pending = {0: ready}
+            self._started_at = time.monotonic()
+        threading.Thread(target=self._read, args=(parent,), name=f"shard-{self.shard}-reader", daemon=True).start()
+        return ready
+
+    def _on_ready(self, ready: Future) -> None:
+        error = ready.exception()
+        if error is None:
+            self.stats = ready.result()
+            self._up = True
+        else:
+            self.last_error = str(error)
+            logger.error("Shard %d failed to start: %s", self.shard, error)
+
+    def _read(self, conn) -> None:
+        while True:
+            try:
+                req_id, status, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                fut = self._pending.pop(req_id, None)
+            if fut is None or not fut.set_running_or_notify_cancel():
+                continue  # the caller timed out and stopped waiting
+            if status == "ok":
+                fut.set_result(payload)
+            else:
+                fut.set_exception(ShardError(payload))
+
+        with self._lock:
+            current = conn is self._conn
+            pending = self._pending if current else {}
+            if current:
+                self._up = False
+                self._conn = None
+                self._pending = {}
+        conn.close()
+        if current and not self._closed:
+            self.last_error = "worker exited"
+            logger.error("Shard %d worker exited", self.shard)
+        for fut in pending.values():
+            if fut.set_running_or_notify_cancel():
+                fut.set_exception(ShardError(self.last_error or "worker exited"))
+
+    def submit(self, op: str, payload: Any) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            conn = self._conn if self._up else None
+            if conn is not None:
+                req_id = next(self._ids)
+                self._pending[req_id] = fut
+        if conn is None:
+            self._maybe_restart()
+            fut.set_exception(ShardError(self.last_error or "worker not running"))
+            return fut
+        try:
+            with self._send_lock:
+                conn.send((req_id, op, payload))
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self._pending.pop(req_id, None)
+            fut.set_exception(ShardError(f"send failed: {e}"))
+        return fut
+
+    def _maybe_restart(self) -> None:
+        with self._lock:
+            if (
+                self._closed
+                or self._restarting
+                or self._conn is not None
+                or time.monotonic() - self._started_at < RESTART_BACKOFF_S
+            ):
+                return
+            self._restarting = True
+            self._started_at = time.monotonic()
+
+        def _restart():
+            try:
+                self.restarts += 1
+                logger.warning("Restarting shard %d worker", self.shard)
+                self.launch()
+            except Exception as e:
+                self.last_error = f"restart failed: {e}"
+                logger.exception("Restart of shard %d failed", self.shard)
+            finally:
+                self._restarting = False
+
+        threading.Thread(target=_restart, name=f"shard-{self.shard}-restart", daemon=True).start()
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            conn, proc = self._conn, self._proc
+            self._up = False
+        if conn is not None:
+            try:
+                with self._send_lock:
+                    conn.send((0, "close", None))
+            except (OSError, ValueError):
+                pass
+        if proc is not None:
+            proc.join(timeout=2.0)
+            if proc.is_alive():
+                proc.terminate()
+
+
+def _close_workers(workers: List[_ShardWorker]) -> None:
+    for worker in workers:
+        worker.close()
+
+
+class ShardedIndex:
+    """
+    Scatter-gather search over a sharded build. Each shard is served by its
+    own worker process (so one query uses one core per shard, and each
+    process only pages in its own rows); the coordinator sends the query
+    vectors (and each shard's slice of the filter mask, bit-packed) to all
+    shards at once, waits up to `timeout_s`, and heap-merges the per-shard
+    top-k lists. Shards that fail or time out are left out: the answer is
+    partial, and `status` (when given) records which shards were missing.
+    Workers are shut down when the index is dropped.
+    """
+
+    kind = "sharded"
+    codes = None  # scoring (and any compressed codes) live in the workers
+
+    def __init__(self, build_dir: str, manifest: Dict[str, Any], timeout_s: float, start_timeout_s: float):
+        self.num_docs = int(manifest["num_docs"])
+        self.timeout_s = float(timeout_s)
+        self.workers = [_ShardWorker(build_dir, spec) for spec in manifest["shards"]]
+        # Runs when the index is dropped, or at exit before multiprocessing kills daemon processes.
+        self._finalizer = multiprocessing.util.Finalize(self, _close_workers, args=(self.workers,), exitpriority=10)
+
+        readies = [worker.launch() for worker in self.workers]
+        wait(readies, timeout=start_timeout_s)
+        up = sum(worker.up for worker in self.workers)
+        if up < len(self.workers):
+            logger.warning("%d of %d shard workers are up for %s", up, len(self.workers), build_dir)
+
+    @property
+    def storage(self) -> str:
+        for worker in self.workers:
+            if worker.stats:
+                return worker.stats.get("storage", "float32")
+        return "float32"
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def search(
+        self,
+        q: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+        status: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        return self.search_batch(q[None, :], k, nprobe=nprobe, mask=mask, status=status)[0]
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+        status: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        futures = []
+        for worker in self.workers:
+            local_mask = None if mask is None else np.packbits(mask[worker.start:worker.stop])
+            futures.append(
+                worker.submit("search", {"queries": queries, "k": int(k), "nprobe": nprobe, "mask": local_mask})
+            )
+        done, _ = wait(futures, timeout=self.timeout_s)
+
+        parts = []
+        failed = []
+        for worker, fut in zip(self.workers, futures):
+            if fut not in done:
+                fut.cancel()
+                failed.append({"shard": worker.shard, "error": "timeout"})
+            elif fut.exception() is not None:
+                failed.append({"shard": worker.shard, "error": str(fut.exception())})
+            else:
+                parts.append(fut.result())
+        if failed:
+            logger.warning("Partial search: %d of %d shards failed: %s", len(failed), len(self.workers), failed)
+        if status is not None:
+            status.update(num_shards=len(self.workers), ok=len(parts), failed=failed, partial=bool(failed))
+
+        return [merge_top_k([part[i] for part in parts], k) for i in range(queries.shape[0])]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "index_type": self.kind,
+            "num_docs": self.num_docs,
+            "storage": self.storage,
+            "num_shards": len(self.workers),
+            "shards_up": sum(worker.up for worker in self.workers),
+            "shard_restarts": sum(worker.restarts for worker in self.workers),
+            "shard_index_type": next((w.stats["index_type"] for w in self.workers if w.stats), None),
+        }
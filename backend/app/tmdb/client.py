@@ -1,26 +1,145 @@
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+
 import httpx
 from app.core.config import settings
 
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` requests per second on average, with bursts
+    of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
 class TMDbClient:
-    def __init__(self):
-        self.base_url = settings.TMDB_BASE_URL
+    """
+    TMDb API client sharing one keep-alive connection pool across requests.
+
+    Every request goes through a concurrency semaphore and a token-bucket
+    rate limiter, and is retried with exponential backoff (honouring
+    Retry-After) on 429, 5xx and transport errors.
+
+    Use as `async with TMDbClient() as client:` (or call `aclose()`).
+    `base_url` / `transport` can point it at a local mock server in tests.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        rate_limit_per_s: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url or settings.TMDB_BASE_URL
         self.headers = {
             "Authorization": f"Bearer {settings.TMDB_API_READ_TOKEN}",
             "Accept": "application/json",
         }
+        self.max_concurrency = max_concurrency or settings.TMDB_MAX_CONCURRENCY
+        self.max_retries = settings.TMDB_MAX_RETRIES if max_retries is None else max_retries
+
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+            transport=transport,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(
+            settings.TMDB_RATE_LIMIT_PER_S if rate_limit_per_s is None else rate_limit_per_s
+        )
+
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    async def __aenter__(self) -> "TMDbClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def _get(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            async with self._semaphore:
+                self.requests += 1
+                try:
+                    r = await self._client.get(path, params=params)
+                except httpx.TransportError:
+                    if attempt >= self.max_retries:
+                        raise
+                    r = None
+
+            if r is not None:
+                if r.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    r.raise_for_status()
+                    return r.json()
+                if r.status_code == 429:
+                    self.rate_limited += 1
+
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(self._backoff(attempt, r))
+
+    @staticmethod
+    def _backoff(attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        # Exponential backoff with full jitter, capped at 30s.
+        return random.uniform(0, min(30.0, 0.5 * (2 ** attempt)))
 
     async def get_popular_movies_page(self, page: int = 1, language: str = "en-US"):
-        url = f"{self.base_url}/movie/popular"
-        params = {"page": page, "language": language}
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            r = await client.get(url, headers=self.headers, params=params)
-            r.raise_for_status()
-            return r.json()
+        return await self._get("/movie/popular", {"page": page, "language": language})
 
     async def get_movie_details(self, movie_id: int, language: str = "en-US"):
-        url = f"{self.base_url}/movie/{movie_id}"
-        params = {"language": language}
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            r = await client.get(url, headers=self.headers, params=params)
-            r.raise_for_status()
-            return r.json()
+        return await self._get(f"/movie/{movie_id}", {"language": language})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "max_concurrency": self.max_concurrency,
+            "rate_limit_per_s": self._bucket.rate,
+        }
@@ -0,0 +1,98 @@
+"""
+Compare two bench.run reports metric by metric.
+
+    python -m bench.compare bench/results/old.json bench/results/new.json [--threshold 10] [--fail]
+
+Every numeric leaf under "stages" present in both reports is listed with its
+relative change. Changes in the bad direction (slower, more memory, lower
+QPS / recall) beyond --threshold percent are marked REGRESSION; with --fail
+the exit status is 1 if there are any.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional
+
+
+# Metrics where bigger is better; everything else (latency, seconds, RSS) is lower-is-better.
+HIGHER_IS_BETTER = ("qps", "recall", "docs_per_s", "mb_per_s", "cosine", "speedup", "size_ratio")
+# Bookkeeping values that are not performance.
+IGNORED = (
+    "count", "calls", "concurrency", "num_docs", "dim", "errors", "nlist", "bytes", "docs",
+    "num_texts", "tolerance", "threads", "max_seq_length", "rows",
+)
+
+
+def flatten(node: Any, prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    if isinstance(node, dict):
+        for key, value in node.items():
+            out.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(node, list):
+        for i, value in enumerate(node):
+            # Throughput levels are keyed by concurrency rather than position.
+            label = f"c{value['concurrency']}" if isinstance(value, dict) and "concurrency" in value else str(i)
+            out.update(flatten(value, f"{prefix}[{label}]"))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        out[prefix] = float(node)
+    return out
+
+
+def _direction(name: str) -> Optional[int]:
+    leaf = name.rsplit(".", 1)[-1]
+    if leaf.endswith(IGNORED) or leaf in IGNORED:
+        return None
+    return 1 if any(h in leaf for h in HIGHER_IS_BETTER) else -1
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    a, b = flatten(old.get("stages", {})), flatten(new.get("stages", {}))
+    rows = []
+    for name in sorted(set(a) & set(b)):
+        direction = _direction(name)
+        if direction is None:
+            continue
+        change = (b[name] - a[name]) / abs(a[name]) * 100.0 if a[name] else 0.0
+        rows.append(
+            {
+                "metric": name,
+                "old": a[name],
+                "new": b[name],
+                "change_pct": round(change, 1),
+                "regression": -direction * change > threshold,
+            }
+        )
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    p.add_argument("--fail", action="store_true", help="exit 1 if anything regressed")
+    a = p.parse_args(argv)
+
+    with open(a.old, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(a.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"old: {a.old} ({old.get('meta', {}).get('git_commit')})")
+    print(f"new: {a.new} ({new.get('meta', {}).get('git_commit')})")
+    if old.get("params") != new.get("params"):
+        print("warning: the runs used different parameters")
+
+    rows = compare(old, new, a.threshold)
+    width = max((len(r["metric"]) for r in rows), default=10)
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"{r['metric']:<{width}}  {r['old']:>12g}  {r['new']:>12g}  {r['change_pct']:>+7.1f}%{flag}")
+
+    regressions = sum(r["regression"] for r in rows)
+    print(f"{regressions} regression(s) beyond {a.threshold:g}%")
+    return 1 if a.fail and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
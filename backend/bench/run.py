@@ -0,0 +1,503 @@
+"""
+Benchmark harness for search, QA retrieval and the build pipeline.
+
+    cd backend
+    python -m bench.run --docs 100000 --dim 384 --stages index
+    python -m bench.run --docs 1000000 --dim 384 --index ivf --nlist 1024 --nprobe 16
+    python -m bench.run --stages search,build --model sentence-transformers/all-MiniLM-L6-v2 --dim 384
+    python -m bench.run --stages http --url http://127.0.0.1:8000
+    python -m bench.compare bench/results/old.json bench/results/new.json
+
+Stages (each runs in a fresh process, so peak RSS and cold start are its own):
+  - index:     load a synthetic corpus (embeddings.npy + doc_index.json) and
+               time the vector index directly with synthetic query vectors:
+               cold start, p50/p95/p99, QPS per concurrency level, recall@k
+               against exact search. Any size / dimension; no model needed.
+  - search:    search_movies end to end (encode + search + results) on the
+               same corpus; needs --model with --dim equal to its dimension.
+  - http:      POST /search against a running server (--url), concurrently.
+  - transform: transform_raw_to_corpus on --raw-docs synthetic raw records.
+  - build:     build_embeddings on --build-docs docs (needs --model), then an
+               incremental no-op rebuild.
+  - encode:    each of --encoder-backends against stock torch on synthetic
+               texts (needs --model): query latency, docs/sec, cosine parity.
+  - corpus:    transform --raw-docs synthetic records into the JSONL and the
+               columnar corpus, then compare them: bytes, time to parse every
+               row, time to read combined_text alone.
+
+Results (with the parameters, git commit and machine) are written as JSON to
+--out, default bench/results/bench-<time>.json.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+STAGES = ("index", "search", "http", "transform", "build", "encode", "corpus")
+
+# load_search_assets needs a model name; the flat synthetic layout is served
+# for any name (there is no per-model build), and the index stage never loads it.
+SYNTH_MODEL = "bench-synthetic"
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    if ms.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(ms.size),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0, 1)
+
+
+def _timed(fn: Callable, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def _throughput(fn: Callable, items: List[Any], concurrency: int, min_seconds: float) -> Dict[str, float]:
+    """
+    Calls per second with `concurrency` threads calling fn over `items`
+    (cycled until at least min_seconds have passed).
+    """
+    done = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            list(pool.map(fn, items))
+            done += len(items)
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_seconds:
+                break
+    return {"concurrency": concurrency, "qps": round(done / elapsed, 1), "calls": done}
+
+
+# --- stages (run in child processes; app modules are imported there, after DATA_DIR is set) ---
+
+
+def stage_prepare(args: Dict[str, Any]) -> Dict[str, Any]:
+    from bench.synth import write_corpus
+
+    out: Dict[str, Any] = {}
+    started = time.perf_counter()
+    out.update(
+        write_corpus(
+            args["corpus_dir"], args["docs"], args["dim"], seed=args["seed"], doc_store=args["doc_store"]
+        )
+    )
+    out["generate_s"] = round(time.perf_counter() - started, 3)
+
+    if args["index"] == "ivf":
+        from app.search.index import build_index
+
+        emb = np.load(os.path.join(args["corpus_dir"], "embeddings.npy"), mmap_mode="r")
+        started = time.perf_counter()
+        index = build_index(
+            emb, index_type="ivf", nlist=args["nlist"], nprobe=args["nprobe"], seed=args["seed"]
+        )
+        index.save(os.path.join(args["corpus_dir"], "ann_index.npz"))
+        out["ivf_train_s"] = round(time.perf_counter() - started, 3)
+        out["nlist"] = index.nlist
+    return out
+
+
+def stage_index(args: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    from app.search.index import blocked_top_k
+    from app.search.service import load_search_assets
+    from bench.synth import query_vectors
+
+    import_s = time.perf_counter() - started
+    load_s = _timed(load_search_assets, SYNTH_MODEL, False)
+    assets = load_search_assets(SYNTH_MODEL, load_model=False)
+    index, emb = assets["index"], assets["embeddings"]
+    k, nprobe = args["k"], args["nprobe"] if args["index"] == "ivf" else None
+
+    queries = query_vectors(emb, args["queries"], seed=args["seed"])
+    first_s = _timed(index.search, queries[0], k, nprobe)
+
+    def search(q: np.ndarray):
+        return index.search(q, k, nprobe=nprobe)
+
+    latencies = [_timed(search, q) for q in queries]
+    hits = [search(q)[0] for q in queries]
+    exact = blocked_top_k(emb, queries, k)
+    recall = float(np.mean([len(set(h.tolist()) & set(e[0].tolist())) / k for h, e in zip(hits, exact)]))
+
+    return {
+        "index_type": index.kind,
+        "num_docs": int(emb.shape[0]),
+        "dim": int(emb.shape[1]),
+        "cold_start": {
+            "import_s": round(import_s, 3),
+            "load_s": round(load_s, 3),
+            "first_query_s": round(first_s, 4),
+            "total_s": round(import_s + load_s + first_s, 3),
+        },
+        "latency": latency_summary(latencies),
+        "throughput": [
+            _throughput(search, list(queries), c, args["min_seconds"]) for c in args["concurrency"]
+        ],
+        f"recall_at_{k}": round(recall, 4),
+    }
+
+
+def stage_search(args: Dict[str, Any]) -> Dict[str, Any]:
+    if not args["model"]:
+        return {"skipped": "needs --model"}
+    started = time.perf_counter()
+    try:
+        from app.search.service import get_model, search_movies
+    except ImportError as e:
+        return {"skipped": str(e)}
+    from bench.synth import query_texts
+
+    import_s = time.perf_counter() - started
+    try:
+        dim = get_model(args["model"]).get_sentence_embedding_dimension()
+    except ImportError as e:
+        return {"skipped": str(e)}
+    if dim != args["dim"]:
+        return {"skipped": f"{args['model']} is {dim}-d; run with --dim {dim}"}
+
+    k = args["k"]
+    first_s = _timed(search_movies, "warm up query", k, args["model"])
+    # Unique texts, so neither the query nor the result cache is hit.
+    texts = [f"{t} {i}" for i, t in enumerate(query_texts(args["queries"], seed=args["seed"]))]
+    latencies = [_timed(search_movies, t, k, args["model"]) for t in texts]
+
+    rounds = itertools.count()  # next() on a count is atomic, so threads can share it
+
+    def search(t: str):
+        return search_movies(f"{t} r{next(rounds)}", k, args["model"])
+
+    return {
+        "cold_start": {"import_s": round(import_s, 3), "first_search_s": round(first_s, 3)},
+        "latency": latency_summary(latencies),
+        "throughput": [_throughput(search, texts, c, args["min_seconds"]) for c in args["concurrency"]],
+    }
+
+
+def stage_http(args: Dict[str, Any]) -> Dict[str, Any]:
+    if not args["url"]:
+        return {"skipped": "needs --url"}
+    import httpx
+
+    from bench.synth import query_texts
+
+    texts = [f"{t} {i}" for i, t in enumerate(query_texts(args["queries"], seed=args["seed"]))]
+    url = args["url"].rstrip("/") + "/search"
+
+    async def run(concurrency: int, tag: str) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+        errors = 0
+
+        async def one(client: httpx.AsyncClient, text: str) -> None:
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                body = {
+                    "query": f"{text} {tag}",
+                    "top_k": args["k"],
+                    "model_name": args["model"] or SYNTH_MODEL,
+                }
+                r = await client.post(url, json=body)
+                latencies.append(time.perf_counter() - started)
+                if r.status_code != 200 or "error" in r.json():
+                    errors += 1
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(client, t) for t in texts))
+            elapsed = time.perf_counter() - started
+        return {
+            "concurrency": concurrency,
+            "qps": round(len(texts) / elapsed, 1),
+            "errors": errors,
+            "latency": latency_summary(latencies),
+        }
+
+    return {"url": url, "levels": [asyncio.run(run(c, f"c{c}")) for c in args["concurrency"]]}
+
+
+def stage_transform(args: Dict[str, Any]) -> Dict[str, Any]:
+    from app.ingestion.transform import transform_raw_to_corpus
+    from bench.synth import write_raw_jsonl
+
+    raw_path = os.path.join(args["data_dir"], "movies_raw.jsonl")
+    corpus_path = os.path.join(args["data_dir"], "movies_corpus.jsonl")
+    raw_bytes = write_raw_jsonl(raw_path, args["raw_docs"], seed=args["seed"])
+
+    started = time.perf_counter()
+    result = transform_raw_to_corpus(raw_path, corpus_path, workers=args["workers"])
+    elapsed = time.perf_counter() - started
+    return {
+        "raw_docs": args["raw_docs"],
+        "raw_mb": round(raw_bytes / 1e6, 1),
+        "workers": args["workers"],
+        "seconds": round(elapsed, 3),
+        "docs_per_s": round(args["raw_docs"] / elapsed, 1),
+        "mb_per_s": round(raw_bytes / 1e6 / elapsed, 1),
+        "stats": result.get("stats"),
+    }
+
+
+def stage_build(args: Dict[str, Any]) -> Dict[str, Any]:
+    if not args["model"]:
+        return {"skipped": "needs --model"}
+    from app.ingestion.transform import transform_raw_to_corpus
+    from bench.synth import write_raw_jsonl
+
+    try:
+        import sentence_transformers  # noqa: F401
+    except ImportError as e:
+        return {"skipped": str(e)}
+    from app.embeddings.build import build_embeddings
+
+    raw_path = os.path.join(args["data_dir"], "movies_raw.jsonl")
+    corpus_path = os.path.join(args["data_dir"], "movies_corpus.jsonl")
+    write_raw_jsonl(raw_path, args["build_docs"], seed=args["seed"])
+    transform_raw_to_corpus(raw_path, corpus_path)
+
+    def build(incremental: bool) -> Dict[str, Any]:
+        return build_embeddings(
+            corpus_path=corpus_path,
+            model_name=args["model"],
+            index_type=args["index"],
+            nlist=args["nlist"],
+            nprobe=args["nprobe"],
+            incremental=incremental,
+            resume=False,
+        )
+
+    started = time.perf_counter()
+    full = build(False)
+    full_s = time.perf_counter() - started
+    if "error" in full:
+        return {"error": full["error"]}
+    started = time.perf_counter()
+    build(True)
+    noop_s = time.perf_counter() - started
+    return {
+        "build_docs": args["build_docs"],
+        "full_s": round(full_s, 3),
+        "docs_per_s": round(args["build_docs"] / full_s, 1),
+        "incremental_noop_s": round(noop_s, 3),
+    }
+
+
+def stage_encode(args: Dict[str, Any]) -> Dict[str, Any]:
+    if not args["model"]:
+        return {"skipped": "needs --model"}
+    try:
+        from app.embeddings.encoder import check_parity, load_encoder
+
+        reference = load_encoder(args["model"], "torch", max_seq_length=0)
+    except ImportError as e:
+        return {"skipped": str(e)}
+    from bench.synth import iter_raw
+
+    texts = [f"{d['title']}. {d['overview']}" for d in iter_raw(args["encode_docs"], seed=args["seed"])]
+    out: Dict[str, Any] = {"num_texts": len(texts)}
+    for backend in args["encoder_backends"]:
+        try:
+            out[backend] = check_parity(args["model"], backend, texts=texts, reference=reference)
+        except (ImportError, OSError, ValueError) as e:
+            out[backend] = {"skipped": f"{type(e).__name__}: {e}"}
+    return out
+
+
+def stage_corpus(args: Dict[str, Any]) -> Dict[str, Any]:
+    from app.ingestion.columnar import CORPUS_FILES, format_report
+    from app.ingestion.transform import transform_raw_to_corpus
+    from bench.synth import write_raw_jsonl
+
+    raw_path = os.path.join(args["data_dir"], "movies_raw.jsonl")
+    write_raw_jsonl(raw_path, args["raw_docs"], seed=args["seed"])
+    out: Dict[str, Any] = {"raw_docs": args["raw_docs"], "workers": args["workers"]}
+    paths = {}
+    for fmt, filename in CORPUS_FILES.items():
+        paths[fmt] = os.path.join(args["data_dir"], filename)
+        out[f"transform_{fmt}_s"] = round(
+            _timed(transform_raw_to_corpus, raw_path, paths[fmt], 20, args["workers"]), 3
+        )
+    out["formats"] = format_report(paths["jsonl"], paths["columnar"])
+    return out
+
+
+# --- orchestration ---
+
+
+def _child(fn_name: str, data_dir: str, args: Dict[str, Any], conn) -> None:
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.setdefault("WARMUP_MODEL", "")
+    try:
+        result = globals()[fn_name](dict(args, data_dir=data_dir))
+    except Exception as e:  # reported, so one failing stage does not lose the others
+        result = {"error": f"{type(e).__name__}: {e}"}
+    result["peak_rss_mb"] = peak_rss_mb()
+    conn.send(result)
+    conn.close()
+
+
+def run_stage(fn_name: str, data_dir: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run a stage function in a fresh (spawned) interpreter with DATA_DIR set.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(fn_name, data_dir, args, child))
+    started = time.perf_counter()
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"error": "stage process died"}
+    proc.join()
+    result["wall_s"] = round(time.perf_counter() - started, 3)
+    if proc.exitcode:
+        result.setdefault("error", f"exit code {proc.exitcode}")
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _corpus_ready(corpus_dir: str, params: Dict[str, Any]) -> bool:
+    try:
+        with open(os.path.join(corpus_dir, "bench_params.json"), "r", encoding="utf-8") as f:
+            return json.load(f) == params
+    except (OSError, ValueError):
+        return False
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    p = argparse.ArgumentParser(
+        description="Search / QA / build benchmarks",
+        epilog=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    p.add_argument("--stages", default="index,transform", help=f"comma-separated, from {','.join(STAGES)}")
+    p.add_argument("--docs", type=int, default=100_000, help="synthetic corpus rows (10k .. 5M)")
+    p.add_argument("--dim", type=int, default=384)
+    p.add_argument("--index", choices=("flat", "ivf"), default="flat")
+    p.add_argument("--nlist", type=int, default=0)
+    p.add_argument("--nprobe", type=int, default=8)
+    p.add_argument(
+        "--doc-store", action="store_true", help="also write the doc store (faster loads than doc_index.json)"
+    )
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--concurrency", default="1,4,16", help="comma-separated thread / connection counts")
+    p.add_argument("--min-seconds", type=float, default=2.0, help="minimum duration per throughput level")
+    p.add_argument("--model", default="", help="embedding model for the search, build and encode stages")
+    p.add_argument("--url", default="", help="server for the http stage")
+    p.add_argument("--raw-docs", type=int, default=100_000)
+    p.add_argument("--build-docs", type=int, default=2_000)
+    p.add_argument("--workers", type=int, default=1, help="transform worker processes")
+    p.add_argument("--encode-docs", type=int, default=500, help="texts for the encode stage")
+    p.add_argument(
+        "--encoder-backends", default="torch_int8,onnx,onnx_int8", help="backends compared to torch"
+    )
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "movie-search-bench"))
+    p.add_argument("--out", default="")
+    a = p.parse_args(argv)
+
+    stages = [s.strip() for s in a.stages.split(",") if s.strip()]
+    unknown = sorted(set(stages) - set(STAGES))
+    if unknown:
+        p.error(f"unknown stages {unknown}; expected {list(STAGES)}")
+
+    args = {
+        "docs": a.docs, "dim": a.dim, "index": a.index, "nlist": a.nlist, "nprobe": a.nprobe,
+        "doc_store": a.doc_store, "queries": a.queries, "k": a.k,
+        "concurrency": [int(c) for c in a.concurrency.split(",") if c.strip()],
+        "min_seconds": a.min_seconds, "model": a.model, "url": a.url, "raw_docs": a.raw_docs,
+        "build_docs": a.build_docs, "workers": a.workers, "seed": a.seed, "encode_docs": a.encode_docs,
+        "encoder_backends": [b for b in a.encoder_backends.split(",") if b.strip()],
+    }
+    report: Dict[str, Any] = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": args,
+        "stages": {},
+    }
+
+    corpus_dir = os.path.join(a.work_dir, "corpus")
+    corpus_params = {k: args[k] for k in ("docs", "dim", "seed", "doc_store", "index", "nlist", "nprobe")}
+    if {"index", "search"} & set(stages):
+        if _corpus_ready(corpus_dir, corpus_params):
+            report["stages"]["prepare"] = {"reused": corpus_dir}
+        else:
+            # Start clean: a leftover ann_index.npz or doc store would change what is measured.
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+            os.makedirs(corpus_dir)
+            report["stages"]["prepare"] = run_stage(
+                "stage_prepare", corpus_dir, dict(args, corpus_dir=corpus_dir)
+            )
+            if "error" not in report["stages"]["prepare"]:
+                with open(os.path.join(corpus_dir, "bench_params.json"), "w", encoding="utf-8") as f:
+                    json.dump(corpus_params, f)
+
+    for name in stages:
+        data_dir = corpus_dir if name in ("index", "search") else os.path.join(a.work_dir, name)
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"[bench] {name} ...", file=sys.stderr, flush=True)
+        report["stages"][name] = run_stage(f"stage_{name}", data_dir, args)
+
+    out = a.out or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results",
+        f"bench-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["stages"], indent=2))
+    print(f"[bench] wrote {out}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
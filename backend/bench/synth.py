@@ -0,0 +1,168 @@
+"""
+Synthetic data for the benchmarks: corpora in the layout /embed writes
+(embeddings.npy + doc_index.json, optionally the doc store) and raw TMDb-like
+JSONL for /transform. Everything is derived from a seed, so two runs with the
+same parameters benchmark identical data.
+"""
+import json
+import os
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from app.search.docstore import write_doc_store
+
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary", "Drama",
+    "Family", "Fantasy", "History", "Horror", "Music", "Mystery", "Romance",
+    "Science Fiction", "Thriller", "War", "Western",
+]
+
+WORDS = [
+    "alien", "crime", "detective", "dragon", "family", "ghost", "heist", "jungle",
+    "king", "love", "magic", "ocean", "robot", "school", "space", "time", "travel",
+    "war", "zombie", "city", "island", "secret", "revenge", "friendship", "escape",
+    "storm", "desert", "kingdom", "spy", "mountain", "river", "prison", "winter",
+]
+
+
+# Independent random streams derived from the seed.
+_VECTORS, _DOCS, _CENTRES, _QUERIES, _TEXTS = range(5)
+
+
+def _rng(seed: int, stream: int, chunk: int = 0) -> np.random.Generator:
+    # Chunks get their own streams, so each can be generated on its own.
+    return np.random.default_rng([seed, stream, chunk])
+
+
+def clustered_vectors(
+    n: int, dim: int, seed: int = 0, num_clusters: int = 256, noise: float = 0.6, start: int = 0
+) -> np.ndarray:
+    """
+    Rows start..start+n of a normalized, clustered float32 matrix: each row is
+    a random cluster centre plus Gaussian noise. Clustered data gives ANN
+    recall numbers closer to real embeddings than uniform noise does.
+    """
+    centres = _rng(seed, _CENTRES).normal(size=(num_clusters, dim)).astype(np.float32)
+    rng = _rng(seed, _VECTORS, start)
+    assign = rng.integers(0, num_clusters, size=n)
+    x = centres[assign] + noise * rng.normal(size=(n, dim)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x
+
+
+def synth_doc(i: int, rng: np.random.Generator) -> Dict[str, Any]:
+    words = rng.choice(WORDS, size=int(rng.integers(12, 40)))
+    genres = sorted(set(rng.choice(GENRES, size=int(rng.integers(1, 4))).tolist()))
+    return {
+        "id": i + 1,
+        "title": f"Movie {i} {words[0]}",
+        "overview": " ".join(words.tolist()).capitalize() + ".",
+        "release_date": f"{int(rng.integers(1950, 2025))}-01-01",
+        "genres": [{"id": j, "name": g} for j, g in enumerate(genres)],
+        "vote_average": round(float(rng.uniform(1, 9.5)), 2),
+        "vote_count": int(rng.integers(0, 20000)),
+        "original_language": "en",
+        "popularity": float(rng.lognormal(2.0, 1.2)),
+        "tagline": "",
+    }
+
+
+def _doc_record(raw: Dict[str, Any]) -> Dict[str, Any]:
+    # The doc_index.json shape /embed writes (see app.embeddings.build._doc_record).
+    return {
+        "doc_id": f"movie_{raw['id']}",
+        "movie_id": raw["id"],
+        "title": raw["title"],
+        "year": int(raw["release_date"][:4]),
+        "genres": [g["name"] for g in raw["genres"]],
+        "rating": raw["vote_average"],
+        "vote_count": raw["vote_count"],
+        "overview": raw["overview"],
+        "metadata": {"popularity": raw["popularity"]},
+    }
+
+
+def iter_raw(n: int, seed: int = 0, chunk_size: int = 65536) -> Iterator[Dict[str, Any]]:
+    for start in range(0, n, chunk_size):
+        rng = _rng(seed, _DOCS, start)
+        for i in range(start, min(start + chunk_size, n)):
+            yield synth_doc(i, rng)
+
+
+def write_raw_jsonl(path: str, n: int, seed: int = 0) -> int:
+    """
+    TMDb-like raw records (the movies_raw.jsonl shape /ingest writes).
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for raw in iter_raw(n, seed):
+            f.write(json.dumps(raw, ensure_ascii=False) + "\n")
+    return os.path.getsize(path)
+
+
+def write_corpus(
+    out_dir: str,
+    n: int,
+    dim: int,
+    seed: int = 0,
+    chunk_size: int = 65536,
+    doc_store: bool = False,
+) -> Dict[str, Any]:
+    """
+    Write a synthetic corpus of `n` rows to `out_dir`: embeddings.npy
+    (normalized float32, written chunk by chunk through a memory map, so
+    5M x 384 needs no 7 GB array in memory) and doc_index.json, plus the
+    doc store when `doc_store` is set. Returns sizes.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    emb_path = os.path.join(out_dir, "embeddings.npy")
+    emb = np.lib.format.open_memmap(emb_path, mode="w+", dtype=np.float32, shape=(n, dim))
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        emb[start:stop] = clustered_vectors(stop - start, dim, seed=seed, start=start)
+    emb.flush()
+    del emb
+
+    idx_path = os.path.join(out_dir, "doc_index.json")
+    with open(idx_path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i, raw in enumerate(iter_raw(n, seed)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(_doc_record(raw), ensure_ascii=False))
+        f.write("\n]\n")
+
+    sizes = {
+        "embeddings_bytes": os.path.getsize(emb_path),
+        "doc_index_bytes": os.path.getsize(idx_path),
+    }
+    if doc_store:
+        write_doc_store(
+            (_doc_record(raw) for raw in iter_raw(n, seed)),
+            os.path.join(out_dir, "doc_store.bin"),
+            os.path.join(out_dir, "doc_offsets.npy"),
+        )
+        sizes["doc_store_bytes"] = os.path.getsize(os.path.join(out_dir, "doc_store.bin"))
+    return sizes
+
+
+def query_vectors(
+    embeddings: np.ndarray, num_queries: int, seed: int = 0, noise: float = 0.3
+) -> np.ndarray:
+    """
+    Queries near the data: random corpus rows plus noise, normalized.
+    """
+    rng = _rng(seed, _QUERIES)
+    rows = rng.integers(0, embeddings.shape[0], size=num_queries)
+    q = np.asarray(embeddings[np.sort(rows)], dtype=np.float32)
+    q += noise * rng.normal(size=q.shape).astype(np.float32) / np.sqrt(q.shape[1])
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return q
+
+
+def query_texts(num_queries: int, seed: int = 0) -> List[str]:
+    rng = _rng(seed, _TEXTS)
+    return [
+        " ".join(rng.choice(WORDS, size=int(rng.integers(2, 6))).tolist()) for _ in range(num_queries)
+    ]
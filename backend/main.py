@@ -1,18 +1,52 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
 import os
+import time
+from typing import Optional
 
+from app.ingestion.columnar import (
+    CORPUS_FILES,
+    columnar_to_jsonl,
+    find_corpus,
+    format_report,
+    jsonl_to_columnar,
+)
 from app.ingestion.ingest import ingest_movies
 from app.ingestion.transform import transform_raw_to_corpus
 from app.core.config import settings
-from app.embeddings.build import build_embeddings
-from app.search.service import search_movies
-from app.search.schemas import SearchRequest
+from app.core.metrics import HTTP_REQUEST_SECONDS, render_gauges, render_histograms
+from app.core.profiler import PROFILER
+from app.embeddings.build import build_embeddings, embed_progress
+from app.embeddings.encoder import ENCODER_BACKENDS, check_parity, corpus_texts
+from app.search.service import (
+    batcher_stats,
+    cache_stats,
+    precompute_neighbors,
+    readiness,
+    run_in_search_executor,
+    search_movies_async,
+    search_movies_batch,
+    search_page,
+    similar_movies,
+    warmup,
+)
+from app.search.schemas import SearchBatchRequest, SearchRequest
 from app.qa.schemas import QARequest
-from app.qa.service import answer_question_grounded
+from app.qa.service import answer_cache_stats, answer_question_grounded, stream_answer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background: the server accepts connections (and answers
+    # /health) right away, while /ready holds traffic until the model is warm.
+    app.state.warmup = asyncio.create_task(asyncio.to_thread(warmup, settings.WARMUP_MODEL))
+    yield
 
 
-app = FastAPI(title="Movie Semantic Search API")
+app = FastAPI(title="Movie Semantic Search API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,21 +59,54 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Route template (/similar/{movie_id}), not the raw path, to bound label cardinality.
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        route=getattr(route, "path", "unmatched"),
+        method=request.method,
+        status=str(response.status_code),
+    )
+    return response
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    """
+    Readiness (vs /health liveness): 200 once the startup warmup has loaded
+    the model and index, 503 while it is still running or if it failed.
+    """
+    state = readiness()
+    if state["status"] != "ready":
+        return JSONResponse(status_code=503, content=state)
+    return state
+
 @app.post("/ingest")
-async def ingest(limit: int = 200, language: str = "en-US"):
-    return await ingest_movies(limit=limit, language=language)
+async def ingest(limit: int = 200, language: str = "en-US", resume: bool = True):
+    return await ingest_movies(limit=limit, language=language, resume=resume)
 
 @app.post("/transform")
-def transform(min_overview_chars: int = 20):
+def transform(
+    min_overview_chars: int = 20,
+    workers: int = 1,
+    embed: bool = False,
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+):
     """
-    Transform raw TMDb movie JSONL into a normalized corpus JSONL.
+    Transform raw TMDb movie JSONL into a normalized corpus (JSONL, or
+    columnar with CORPUS_FORMAT=columnar).
+    workers > 1 (0 = all CPUs) transforms byte ranges in parallel processes;
+    embed=true feeds the new corpus straight into an (incremental) /embed run.
     """
     raw_path = os.path.join(settings.DATA_DIR, "movies_raw.jsonl")
-    corpus_path = os.path.join(settings.DATA_DIR, "movies_corpus.jsonl")
+    corpus_path = os.path.join(settings.DATA_DIR, CORPUS_FILES[settings.CORPUS_FORMAT])
 
     if not os.path.exists(raw_path):
         return {
@@ -51,7 +118,20 @@ def transform(min_overview_chars: int = 20):
         raw_path=raw_path,
         corpus_path=corpus_path,
         min_overview_chars=min_overview_chars,
+        workers=workers,
     )
+    stages = {"transform": result["stats"]}
+
+    if embed:
+        started = time.perf_counter()
+        result["embed"] = build_embeddings(corpus_path=corpus_path, model_name=model_name)
+        elapsed = time.perf_counter() - started
+        stages["embed"] = {
+            "seconds": round(elapsed, 3),
+            "docs_per_s": round(result["embed"].get("num_docs", 0) / elapsed, 1) if elapsed > 0 else None,
+        }
+
+    result["stages"] = stages
     return result
 
 @app.post("/embed")
@@ -59,15 +139,31 @@ def embed(
     model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
     batch_size: int = 32,
     normalize: bool = True,
+    index_type: str = "flat",
+    nlist: int = 0,
+    nprobe: int = 8,
+    storage: str = "float32",
+    pq_m: int = 0,
+    rerank_factor: int = 10,
+    incremental: bool = True,
+    chunk_size: int = 4096,
+    encode_workers: int = 1,
+    resume: bool = True,
+    shards: int = 1,
+    encoder_backend: Optional[str] = None,
+    doc_index_json: bool = False,
 ):
     """
     Build embeddings for the cleaned corpus and persist them to disk.
+    shards > 1 splits the index into shards served by separate worker processes.
+    encoder_backend overrides ENCODER_BACKEND (torch, torch_int8, onnx, onnx_int8).
+    doc_index_json=true also writes the full metadata list as doc_index.json.
     """
-    corpus_path = os.path.join(settings.DATA_DIR, "movies_corpus.jsonl")
+    corpus_path = find_corpus(settings.DATA_DIR, settings.CORPUS_FORMAT)
 
     if not os.path.exists(corpus_path):
         return {
-            "error": "movies_corpus.jsonl not found. Run /transform first.",
+            "error": f"{os.path.basename(corpus_path)} not found. Run /transform first.",
             "expected_path": corpus_path,
         }
 
@@ -76,22 +172,178 @@ def embed(
         model_name=model_name,
         batch_size=batch_size,
         normalize=normalize,
+        index_type=index_type,
+        nlist=nlist,
+        nprobe=nprobe,
+        storage=storage,
+        pq_m=pq_m,
+        rerank_factor=rerank_factor,
+        incremental=incremental,
+        chunk_size=chunk_size,
+        encode_workers=encode_workers,
+        resume=resume,
+        shards=shards,
+        encoder_backend=encoder_backend,
+        doc_index_json=doc_index_json,
     )
 
+@app.post("/encoder/parity")
+def encoder_parity(
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    backend: str = "onnx_int8",
+    num_texts: int = 256,
+):
+    """
+    Compare an encoder backend to stock torch on corpus texts: cosine
+    between their embeddings, plus query latency and docs/sec of both.
+    """
+    if backend not in ENCODER_BACKENDS:
+        return {"error": f"Unknown encoder backend {backend!r}.", "supported": list(ENCODER_BACKENDS)}
+    corpus_path = find_corpus(settings.DATA_DIR, settings.CORPUS_FORMAT)
+    try:
+        return check_parity(model_name, backend, texts=corpus_texts(corpus_path, max(1, num_texts)))
+    except ImportError as e:
+        return {"error": f"Backend {backend!r} is not available: {e}"}
+
+@app.post("/corpus/convert")
+def corpus_convert(to: str = "columnar"):
+    """
+    Convert the corpus to `to` ("columnar" imports movies_corpus.jsonl,
+    "jsonl" exports movies_corpus.cols), then report both formats side by
+    side: bytes on disk, time to parse every row, time to read combined_text.
+    """
+    if to not in CORPUS_FILES:
+        return {"error": f"Unknown format {to!r}.", "supported": list(CORPUS_FILES)}
+    jsonl_path = os.path.join(settings.DATA_DIR, CORPUS_FILES["jsonl"])
+    columnar_path = os.path.join(settings.DATA_DIR, CORPUS_FILES["columnar"])
+    source = columnar_path if to == "jsonl" else jsonl_path
+    if not os.path.exists(source):
+        return {"error": f"{os.path.basename(source)} not found. Run /transform first.", "expected_path": source}
+
+    if to == "columnar":
+        result = jsonl_to_columnar(jsonl_path, columnar_path)
+    else:
+        result = columnar_to_jsonl(columnar_path, jsonl_path)
+    result["report"] = format_report(jsonl_path, columnar_path)
+    return result
+
+@app.get("/embed/progress")
+def embed_progress_status(model_name: Optional[str] = None):
+    """
+    Progress of a running (or interrupted, resumable) /embed build for
+    `model_name`, or of every model's when omitted.
+    """
+    return embed_progress(model_name)
+
 @app.post("/search")
-def search(req: SearchRequest):
-    return search_movies(
+async def search(req: SearchRequest):
+    return await search_movies_async(
         query=req.query,
         top_k=req.top_k,
         model_name=req.model_name,
+        nprobe=req.nprobe,
+        filters=req.filters.model_dump(exclude_none=True) if req.filters else None,
+        mode=req.mode,
+        rerank=req.rerank,
+        debug=req.debug,
+        paginate=req.paginate,
     )
 
+@app.get("/search/page")
+async def search_next_page(cursor: str, page_size: Optional[int] = None):
+    """
+    Next page of a /search run with paginate=true: pass its `next_cursor`.
+    """
+    if page_size is not None:
+        page_size = max(1, min(page_size, 50))
+    return await run_in_search_executor(search_page, cursor, page_size)
+
+@app.post("/search/batch")
+async def search_batch(req: SearchBatchRequest):
+    return await run_in_search_executor(
+        search_movies_batch,
+        queries=req.queries,
+        top_k=req.top_k,
+        model_name=req.model_name,
+        nprobe=req.nprobe,
+        filters=req.filters.model_dump(exclude_none=True) if req.filters else None,
+        mode=req.mode,
+        rerank=req.rerank,
+    )
+
+@app.get("/similar/{movie_id}")
+async def similar(
+    movie_id: int,
+    top_k: int = 10,
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    nprobe: Optional[int] = None,
+):
+    """
+    Movies most similar to `movie_id`, from its stored vector (no text encoding).
+    """
+    return await run_in_search_executor(
+        similar_movies, movie_id, max(1, min(top_k, 50)), model_name, nprobe
+    )
+
+@app.post("/similar/precompute")
+def similar_precompute(
+    model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+    top_n: int = 20,
+    chunk_size: int = 1024,
+):
+    """
+    Precompute top_n neighbor lists for the whole catalog, so /similar is a lookup.
+    """
+    return precompute_neighbors(model_name=model_name, top_n=top_n, chunk_size=chunk_size)
+
+@app.get("/search/cache")
+def search_cache():
+    """
+    Hit/miss counters for the query-embedding and result caches and the
+    pagination cursors.
+    """
+    return cache_stats()
+
 @app.post("/qa")
-def qa(req: QARequest):
-    return answer_question_grounded(
+async def qa(req: QARequest):
+    kwargs = dict(
         question=req.question,
         query=req.query,
         top_k=req.top_k,
         model_name=req.model_name,
         llm_model=req.llm_model,
+        filters=req.filters.model_dump(exclude_none=True) if req.filters else None,
+        mode=req.mode,
+        debug=req.debug,
+    )
+    if req.stream:
+        return StreamingResponse(stream_answer(**kwargs), media_type="text/event-stream")
+    return await answer_question_grounded(**kwargs)
+
+@app.get("/qa/cache")
+def qa_cache():
+    """
+    Hit rate and LLM latency saved by the /qa answer cache.
+    """
+    return answer_cache_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus text format: latency histograms (HTTP routes, operations and
+    their stages) plus cache, batcher, loaded-index and profiler gauges.
+    """
+    stats = cache_stats()
+    lines = render_histograms()
+    lines += render_gauges("search_cache_query_embeddings", stats["query_embeddings"])
+    lines += render_gauges("search_cache_results", stats["results"])
+    lines += render_gauges("search_cursors", stats["cursors"])
+    lines += render_gauges("qa_answer_cache", answer_cache_stats())
+    lines += render_gauges("search_batcher", batcher_stats())
+    lines += render_gauges("loaded_models", {"count": len(stats["loaded_models"])})
+    for model_name, index in stats["indexes"].items():
+        lines += render_gauges("search_index", index, model_name=model_name)
+    lines += render_gauges(
+        "profiler", {"enabled": int(PROFILER.enabled), "profiles_written": PROFILER.profiles_written}
     )
+    return "\n".join(lines) + "\n"